@@ -11,6 +11,7 @@ sys.path.append(os.path.realpath(os.path.join(lib_path, os.pardir, 'libs')))
 
 try:
     from crl.handle import Handle, HandleError
+    from ktl.git import GitBatch, GitError as KtlGitError
     from ktl.log import cnotice, cwarn
 except ImportError as e:
     print("Failed to import internal libraries:", e)
@@ -38,6 +39,9 @@ class GitHandle():
     '''
     A handle to a single git repository.
     '''
+    # Resolve refs via a long-lived git process, see ktl.git.GitBatch.
+    batch = os.getenv('KTL_GIT_BATCH', '') not in ('', '0')
+
     def __init__(self, handle_tree):
         self.__ht = handle_tree
 
@@ -85,6 +89,13 @@ class GitHandle():
         '''
         repo_dir = self.directory
 
+        if self.batch and ref.startswith('refs/'):
+            try:
+                info = GitBatch.get(repo_dir).check(ref)
+            except KtlGitError as e:
+                raise GitError("git cat-file failed {}".format(e.msg))
+            return info[0] if info is not None else None
+
         result = run(["git", "for-each-ref", "--format", "%(objectname)", ref],
                      cwd=repo_dir, stdout=PIPE)
         if result.returncode != 0:
@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 
 import contextlib
+import hashlib
+import json
 import os
 import sys
 
@@ -27,6 +29,104 @@ def change_directory(new_dir):
         os.chdir(previous_dir)
 
 
+class HandleIndex:
+    """
+    Handle resolution index for a KernelSeries and Config pair, mapping
+    encoded directory to packages, repository url to primary package and
+    (series, package name) to package.  Built once per pair and cached on
+    disk keyed by the kernel-series and config hashes.
+    """
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                             'kteam-tools', 'cranky-handle')
+    _instances = {}
+
+    @classmethod
+    def lookup(cls, handle):
+        key = (id(handle.ks), id(handle.config))
+        index = cls._instances.get(key)
+        if index is None or index.ks is not handle.ks or index.config is not handle.config:
+            index = cls._instances[key] = cls(handle)
+        return index
+
+    def __init__(self, handle):
+        self.ks = handle.ks
+        self.config = handle.config
+
+        cache_path = None
+        data_hash = getattr(self.ks, 'data_hash', None)
+        if self.cache_dir is not None and data_hash is not None:
+            digest = hashlib.sha256()
+            digest.update(data_hash.encode('utf-8'))
+            digest.update(json.dumps(self.config.config, sort_keys=True, default=str).encode('utf-8'))
+            digest.update(handle.base_path.encode('utf-8'))
+            cache_path = os.path.join(self.cache_dir, digest.hexdigest() + '.json')
+
+        data = None
+        if cache_path is not None:
+            try:
+                with open(cache_path) as rfd:
+                    data = json.load(rfd)
+            except (OSError, ValueError):
+                data = None
+        if data is None:
+            data = self.build(handle)
+            if cache_path is not None:
+                try:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    with open(cache_path + '.new', 'w') as wfd:
+                        json.dump(data, wfd)
+                    os.rename(cache_path + '.new', cache_path)
+                except OSError:
+                    pass
+
+        # Directories are recorded as encoded, base-path may be relative.
+        self.directories = {}
+        for directory, entries in data['directories'].items():
+            self.directories.setdefault(os.path.abspath(directory), []).extend(entries)
+        self.repos = data['repos']
+        self.packages = data['packages']
+
+    def build(self, handle):
+        # Packages are recorded as [series, source, package] keys.
+        directories = {}
+        repos = {}
+        packages = {}
+        for series in self.ks.series:
+            for source in series.sources:
+                for package in source.packages:
+                    entry = [series.name, source.name, package.name]
+                    directory = handle.encode_directory(package)
+                    directories.setdefault(directory, []).append(entry)
+                    if package.repo:
+                        repos.setdefault(package.repo.url, entry)
+                    packages.setdefault(series.name + ':' + package.name, entry)
+        return {'directories': directories, 'repos': repos, 'packages': packages}
+
+    def resolve(self, entry):
+        if entry is None:
+            return None
+        (series_name, source_name, package_name) = entry
+        return self.ks.lookup_series(series=series_name).lookup_source(source_name).lookup_package(package_name)
+
+    def directory_packages(self, directory):
+        """
+        All packages whose encoded directory is directory.
+        """
+        return [self.resolve(entry) for entry in self.directories.get(directory, [])]
+
+    def primary_package(self, url):
+        """
+        The first package which references the repository url.
+        """
+        return self.resolve(self.repos.get(url))
+
+    def lookup_package(self, series, package_name):
+        """
+        The first package named package_name in series.
+        """
+        return self.resolve(self.packages.get(series.name + ':' + package_name))
+
+
 class HandleCore:
     def __init__(self, series=None, package=None, source=None, config=None, ks=None):
         self.series = series
@@ -46,6 +146,10 @@ class HandleCore:
                               "Check the config example in kteam-tools/cranky/docs/"
                               "snip-cranky.yaml for more information.")
 
+    @property
+    def index(self):
+        return HandleIndex.lookup(self)
+
     def lookup_config(self, key, default=None):
         """
         Lookup a config option and encode it if necessary
@@ -128,10 +232,10 @@ class HandleCore:
         # Always use topmost entry for package name, even if unreleased
         package = changelog[0]['package']
 
-        if len(changelog) > 0 and changelog[0]['series'] == 'UNRELEASED':
+        if changelog and changelog[0]['series'] == 'UNRELEASED':
             changelog.pop(0)
 
-        if len(changelog) == 0:
+        if not changelog:
             raise HandleError("{}: Unable to identify directory handle".format(directory))
 
         return (changelog[0]['series'], package)
@@ -159,24 +263,19 @@ class HandleTree(HandleCore):
         cross_source = False
         cross_type = False
         primary_package = None
-        for series in self.ks.series:
-            for source in series.sources:
-                for package in source.packages:
-                    # We work against the remote name for the first package
-                    # which references our repository.
-                    if primary_package is None and self.package.repo and package.repo:
-                        if self.package.repo.url == package.repo.url:
-                            primary_package = package
-                    if self.package == package:
-                        continue
-                    directory = os.path.abspath(self.encode_directory(package))
-                    if self.directory == directory:
-                        if self.series != series:
-                            cross_series = True
-                        if self.package.source != source:
-                            cross_source = True
-                        if self.package.type != package.type:
-                            cross_type = True
+        # We work against the remote name for the first package
+        # which references our repository.
+        if self.package.repo:
+            primary_package = self.index.primary_package(self.package.repo.url)
+        for package in self.index.directory_packages(self.directory):
+            if self.package == package:
+                continue
+            if self.series != package.series:
+                cross_series = True
+            if self.package.source != package.source:
+                cross_source = True
+            if self.package.type != package.type:
+                cross_type = True
 
         if primary_package is None:
             primary_package = self.package
@@ -267,14 +366,7 @@ class Handle(HandleCore):
         if series is None:
             raise HandleError("{}: handle directory contains unknown series {}".format(handle, series_name))
 
-        for source_entry in series.sources:
-            for package_entry in source_entry.packages:
-                if package_entry.name == package_name:
-                    package = package_entry
-                    break
-            if package:
-                break
-
+        package = self.index.lookup_package(series, package_name)
         if package is None:
             raise HandleError("{}: handle directory contains unknown package {}".format(handle, package_name))
 
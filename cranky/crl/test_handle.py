@@ -9,7 +9,7 @@ from subprocess                 import getstatusoutput
 sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'libs')))
 sys.path.append(os.pardir)
 
-from handle                     import Handle, change_directory, HandleError
+from handle                     import Handle, HandleIndex, change_directory, HandleError
 from ktl.kernel_series          import KernelSeries
 from config                     import Config
 
@@ -806,5 +806,44 @@ class TestHandleTreeRemote(TestHandle):
         self.assertEqual('origin', hdl.remote)
 
 
+class TestHandleIndex(TestHandle):
+
+    data_yaml = TestHandleTreeRemote.data_yaml
+    path_config_one_yaml = TestHandleTreeRemote.path_config_one_yaml
+
+    def setUp(self):
+        self.cache_dir = HandleIndex.cache_dir
+
+    def tearDown(self):
+        HandleIndex.cache_dir = self.cache_dir
+
+    def test_lookup_package(self):
+        HandleIndex.cache_dir = None
+        ks = KernelSeries(data=self.data_yaml)
+        config = Config(data=self.path_config_one_yaml)
+
+        index = Handle(ks=ks, config=config).index
+        series = ks.lookup_series(codename='bionic')
+
+        self.assertIs(index.lookup_package(series, 'linux-meta-kvm'),
+                      series.lookup_source('linux-kvm').lookup_package('linux-meta-kvm'))
+        self.assertIsNone(index.lookup_package(series, 'linux-unknown'))
+        self.assertEqual(str(index.primary_package('A')), '18.04 linux linux None')
+
+    def test_disk_cache_relative(self):
+        with TempDirectory() as d:
+            HandleIndex.cache_dir = d.getpath('cache')
+            for directory in ('one', 'two'):
+                d.makedir(directory)
+                with change_directory(d.getpath(directory)):
+                    ks = KernelSeries(data=self.data_yaml)
+                    config = Config(data=self.path_config_one_yaml)
+
+                    hdl = Handle(ks=ks, config=config).lookup_tree('xenial:linux-meta')
+
+                    self.assertEqual('xenial-meta', hdl.remote)
+                    self.assertEqual(len(os.listdir(d.getpath('cache'))), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
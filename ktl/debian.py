@@ -8,12 +8,12 @@ from __future__                         import absolute_import
 
 from debian.changelog                   import Changelog, get_maintainer
 from email.utils                        import formatdate
-from os                                 import path, listdir, system
+from os                                 import path, listdir, system, stat
 from re                                 import compile, findall, finditer
 from sys                                import stdout
 from glob                               import glob
 
-from ktl.git                            import Git, GitError
+from ktl.git                            import Git, GitBatch, GitError
 from ktl.utils                          import debug, run_command
 from ktl.kernel_series                  import KernelSeries
 
@@ -26,8 +26,93 @@ class DebianError(Exception):
     def __init__(self, error):
         self.msg = error
 
-# Note: Think about cacheing the decoded, changelog dictionary.
+# DebianChangelogParser
 #
+# The parse state for a single changelog; sections are only parsed as they
+# are requested.  A parser is shared by all DebianChangelog views of the
+# same changelog content.
+#
+class DebianChangelogParser:
+    def __init__(self, sections):
+        self.sections = []
+        self.__pending = sections
+
+    def ensure(self, count=None):
+        while self.__pending is not None and (count is None or len(self.sections) < count):
+            try:
+                self.sections.append(next(self.__pending))
+            except StopIteration:
+                self.__pending = None
+        return self.sections
+
+
+# DebianChangelog
+#
+# A read-mostly list of changelog sections, newest first, which parses the
+# underlying changelog lazily.  Looking at the first few entries only parses
+# those.  The section dictionaries are shared with other callers reading the
+# same changelog and must not be modified.
+#
+class DebianChangelog:
+    def __init__(self, parser):
+        self.__parser = parser
+        self.__offset = 0
+
+    def __section(self, index):
+        sections = self.__parser.ensure(self.__offset + index + 1)
+        return sections[self.__offset + index]
+
+    def __all(self):
+        return self.__parser.ensure()[self.__offset:]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if (index.start or 0) >= 0 and index.stop is not None and index.stop >= 0:
+                return self.__parser.ensure(self.__offset + index.stop)[self.__offset:][index]
+            return self.__all()[index]
+        if index < 0:
+            return self.__all()[index]
+        try:
+            return self.__section(index)
+        except IndexError:
+            raise IndexError('changelog index out of range')
+
+    def __len__(self):
+        return len(self.__all())
+
+    def __bool__(self):
+        return len(self.__parser.ensure(self.__offset + 1)) > self.__offset
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        index = 0
+        while True:
+            try:
+                yield self.__section(index)
+            except IndexError:
+                return
+            index += 1
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def pop(self, index=-1):
+        if index == 0:
+            section = self[0]
+            self.__offset += 1
+            return section
+        sections = list(self.__all())
+        section = sections.pop(index)
+        self.__parser = DebianChangelogParser(iter(sections))
+        self.__offset = 0
+        return section
+
 
 class Debian:
     verbose = False
@@ -44,6 +129,11 @@ class Debian:
     parent_bug_section_rc = compile("^\s*\[ Ubuntu: .*\]")
     endsection_line_rc = compile("^ -- ")
 
+    # Parsed changelogs keyed by path and (mtime, size) for local files or
+    # by blob id for changelogs read from git.
+    changelog_cache = {}
+    changelog_cache_max = 16
+
     @classmethod
     def fdr(cls, cmd, dry_run=False):
         """
@@ -113,6 +203,13 @@ class Debian:
 
         return debdirs
 
+    # file_lines
+    #
+    @classmethod
+    def file_lines(cls, fid):
+        with open(fid, 'r') as fd:
+            return fd.read().split('\n')
+
     # master_changelog
     #
     @classmethod
@@ -123,10 +220,9 @@ class Debian:
         '''
         fid = 'debian.master/changelog'
         if path.exists(fid):
-            with open(fid, 'r') as f:
-                changelog_contents = f.read()
-
-            retval = cls.changelog_as_list(changelog_contents.split('\n'))
+            st = stat(fid)
+            retval = cls.changelog_cached(('file', path.abspath(fid), st.st_mtime, st.st_size),
+                lambda: cls.file_lines(fid))
         else:
             raise DebianError('Failed to find the master changelog.')
         return retval
@@ -147,7 +243,7 @@ class Debian:
             debug("Trying '%s': " % chglog, cls.debug)
             try:
                 if local:
-                    changelog_contents = open(chglog, 'r').read().split('\n')
+                    changelog_contents = cls.file_lines(chglog)
                 else:
                     changelog_contents = Git.show(chglog, branch=current_branch)
                 return changelog_contents, chglog
@@ -157,19 +253,70 @@ class Debian:
         # Not there anywhere, barf
         raise DebianError('Failed to find the changelog.')
 
+    # changelog_key
+    #
+    # Locate the changelog for this branch and return a key identifying its
+    # current content, without reading it.
+    #
+    @classmethod
+    def changelog_key(cls, local=False):
+        current_branch = Git.current_branch()
+
+        for debdir in cls.debian_directories():
+            chglog = debdir + '/changelog'
+            if local:
+                try:
+                    st = stat(chglog)
+                except OSError:
+                    continue
+                return ('file', path.abspath(chglog), st.st_mtime, st.st_size)
+            if Git.batch:
+                info = GitBatch.get().check(current_branch + ':' + chglog)
+                if info is None:
+                    continue
+                return ('blob', info[0])
+            status, result = run_command("git rev-parse --verify -q '%s:%s'" % (current_branch, chglog), cls.debug)
+            if status == 0:
+                return ('blob', result[0])
+        return None
+
+    # changelog_cached
+    #
+    @classmethod
+    def changelog_cached(cls, key, contents):
+        parser = cls.changelog_cache.get(key)
+        if parser is None:
+            parser = DebianChangelogParser(cls.changelog_sections(contents()))
+            if len(cls.changelog_cache) >= cls.changelog_cache_max:
+                del cls.changelog_cache[next(iter(cls.changelog_cache))]
+            cls.changelog_cache[key] = parser
+        return DebianChangelog(parser)
+
     # changelog
     #
+    # Returns the changelog sections for the current branch, newest first.
+    # These are parsed on demand and cached against the changelog content.
+    #
     @classmethod
     def changelog(cls, local=False):
-        changelog_contents, changelog_path = cls.raw_changelog(local)
-        return cls.changelog_as_list(changelog_contents)
+        key = cls.changelog_key(local)
+        if key is None:
+            raise DebianError('Failed to find the changelog.')
+        return cls.changelog_cached(key, lambda: cls.raw_changelog(local)[0])
 
     # changelog_as_list
     #
     @classmethod
     def changelog_as_list(cls, changelog_contents):
-        retval = []
+        return list(cls.changelog_sections(changelog_contents))
 
+    # changelog_sections
+    #
+    # Parse the changelog, yielding each section as it is completed.  A
+    # section is only complete once the next version line is seen.
+    #
+    @classmethod
+    def changelog_sections(cls, changelog_contents):
         # The first line of the changelog should always be a version line.
         #
         m = cls.version_line_rc.match(changelog_contents[0])
@@ -185,15 +332,24 @@ class Debian:
 
             raise DebianError("The first line in the changelog is not a version line.")
 
+        return cls.__changelog_sections(changelog_contents)
+
+    @classmethod
+    def __changelog_sections(cls, changelog_contents):
         content = []
         own_content = []
         bugs = []
         own_bugs = []
         parsing_own_bugs = True
+        pending = []
 
         for line in changelog_contents:
             m = cls.version_line_rc.match(line)
             if m is not None:
+                for section in pending:
+                    yield section
+                pending = []
+
                 version = ""
                 release = ""
                 pocket  = ""
@@ -252,9 +408,10 @@ class Debian:
                 section['own-content'] = own_content
                 section['bugs'] = set(bugs)
                 section['own-bugs'] = set(own_bugs)
-                retval.append(section)
+                pending.append(section)
 
-        return retval
+        for section in pending:
+            yield section
 
     # abi
     #
@@ -4,7 +4,11 @@ from __future__ import print_function
 
 from ktl.utils                  import run_command, dump
 from re                         import compile
+import atexit
 import json
+import os
+import subprocess
+import threading
 
 class GitError(Exception):
     # __init__
@@ -12,8 +16,166 @@ class GitError(Exception):
     def __init__(self, error):
         self.msg = error
 
+# GitBatch
+#
+# A set of long-lived git processes for a single repository answering object
+# and ref queries without forking a new git for each.  Objects are read via
+# 'git cat-file --batch' and resolved via 'git cat-file --batch-check', both
+# of which resolve names afresh for every query.  Ref listings come from a
+# single 'git for-each-ref' which is snapshotted on first use; call
+# invalidate() after changing refs.
+#
+class GitBatch:
+    __instances = {}
+    __instances_lock = threading.Lock()
+
+    # get
+    #
+    # Return the shared GitBatch for the repository containing directory.
+    #
+    @classmethod
+    def get(cls, directory='.'):
+        directory = os.path.realpath(directory)
+        with cls.__instances_lock:
+            batch = cls.__instances.get(directory)
+            if batch is None:
+                batch = cls.__instances[directory] = cls(directory)
+        return batch
+
+    @classmethod
+    def close_all(cls):
+        with cls.__instances_lock:
+            for batch in cls.__instances.values():
+                batch.close()
+            cls.__instances = {}
+
+    def __init__(self, directory='.'):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.__git_dir = None
+        self.__batch = None
+        self.__check = None
+        self.__refs = None
+
+    def __start(self, option):
+        try:
+            return subprocess.Popen(['git', 'cat-file', option], cwd=self.directory,
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL)
+        except OSError as e:
+            raise GitError(str(e))
+
+    def __request(self, proc, spec):
+        if '\n' in spec:
+            raise GitError("{}: invalid object name".format(spec))
+        proc.stdin.write(spec.encode('utf-8') + b'\n')
+        proc.stdin.flush()
+        header = proc.stdout.readline().decode('utf-8')
+        if header == '':
+            raise GitError("git cat-file exited unexpectedly")
+        bits = header.split()
+        if len(bits) != 3:
+            # <spec> missing or <spec> ambiguous
+            return None
+        return (bits[0], bits[1], int(bits[2]))
+
+    # check
+    #
+    # Return (sha1, type, size) for the object named spec, or None.
+    #
+    def check(self, spec):
+        with self.lock:
+            if self.__check is None:
+                self.__check = self.__start('--batch-check')
+            return self.__request(self.__check, spec)
+
+    # read
+    #
+    # Return (sha1, type, content) for the object named spec, or None.
+    #
+    def read(self, spec):
+        with self.lock:
+            if self.__batch is None:
+                self.__batch = self.__start('--batch')
+            info = self.__request(self.__batch, spec)
+            if info is None:
+                return None
+            (sha1, kind, size) = info
+            content = self.__batch.stdout.read(size)
+            # Consume the terminating newline.
+            self.__batch.stdout.read(1)
+            return (sha1, kind, content)
+
+    # rev_parse
+    #
+    def rev_parse(self, spec):
+        info = self.check(spec)
+        return info[0] if info is not None else None
+
+    # git_dir
+    #
+    @property
+    def git_dir(self):
+        if self.__git_dir is None:
+            status, result = run_command("cd '%s' && git rev-parse --absolute-git-dir" % self.directory)
+            if status != 0:
+                raise GitError(result)
+            self.__git_dir = result[0]
+        return self.__git_dir
+
+    # symbolic_head
+    #
+    # Return the ref HEAD points to, or None if it is detached.
+    #
+    def symbolic_head(self):
+        with open(os.path.join(self.git_dir, 'HEAD')) as rfd:
+            head = rfd.read().strip()
+        if head.startswith('ref: '):
+            return head[5:]
+        return None
+
+    # refs
+    #
+    # Return a dictionary of refname to sha1 for all refs under prefix.
+    #
+    def refs(self, prefix='refs/'):
+        with self.lock:
+            if self.__refs is None:
+                status, result = run_command("cd '%s' && git for-each-ref --format='%%(objectname) %%(refname)'" % self.directory)
+                if status != 0:
+                    raise GitError(result)
+                refs = {}
+                for line in result:
+                    if line == '':
+                        continue
+                    (sha1, refname) = line.split(' ', 1)
+                    refs[refname] = sha1
+                self.__refs = refs
+            refs = self.__refs
+        return dict((refname, sha1) for refname, sha1 in refs.items() if refname.startswith(prefix))
+
+    # invalidate
+    #
+    def invalidate(self):
+        with self.lock:
+            self.__refs = None
+
+    def close(self):
+        with self.lock:
+            for proc in (self.__batch, self.__check):
+                if proc is not None:
+                    proc.stdin.close()
+                    proc.wait()
+                    proc.stdout.close()
+            self.__batch = None
+            self.__check = None
+
+atexit.register(GitBatch.close_all)
+
 class Git:
     debug = False
+    # Answer queries via long-lived git processes, see GitBatch.
+    batch = os.getenv('KTL_GIT_BATCH', '') not in ('', '0')
     commit_rc  = compile('^commit\s+([a-f0-9]+)\s*$')
     author_rc  = compile('^Author:\s+(.*)\s+<(.*)>$')
     date_rc    = compile('^Date:\s+(.*)$')
@@ -59,6 +221,10 @@ class Git:
     #
     @classmethod
     def branches(cls):
+        if cls.batch:
+            return [refname[len('refs/heads/'):]
+                    for refname in sorted(GitBatch.get().refs('refs/heads/'))]
+
         retval = []
         status, result = run_command("git branch", cls.debug)
         if status == 0:
@@ -75,6 +241,10 @@ class Git:
     #
     @classmethod
     def tags(cls, contains=''):
+        if cls.batch and contains == '':
+            return [refname[len('refs/tags/'):]
+                    for refname in sorted(GitBatch.get().refs('refs/tags/'))]
+
         retval = []
         cmd = "git tag"
         if contains != '':
@@ -97,6 +267,12 @@ class Git:
     #
     @classmethod
     def current_branch(cls):
+        if cls.batch:
+            head = GitBatch.get().symbolic_head()
+            if head is None:
+                raise GitError("no current branch")
+            return head.replace("refs/heads/", "")
+
         # Note: older versions of git symbolic-ref do not support --short
         status, result = run_command("git symbolic-ref HEAD", cls.debug)
         if status != 0:
@@ -113,6 +289,12 @@ class Git:
         Return a string that is the commit sha1 of the current HEAD.
         Will raise an exception if it fails.
         """
+        if cls.batch:
+            sha1 = GitBatch.get().rev_parse('HEAD')
+            if sha1 is None:
+                raise GitError("no current commit")
+            return sha1
+
         status, result = run_command("git rev-parse HEAD", cls.debug)
         if status != 0:
             raise GitError("no current commit")
@@ -157,6 +339,16 @@ class Git:
         """
         Return message summary/subject from given commit.
         """
+        if cls.batch:
+            obj = GitBatch.get().read(commit + '^{commit}')
+            if obj is None:
+                return None
+            message = obj[2].decode('utf-8', errors='replace').split('\n\n', 1)
+            if len(message) != 2:
+                return None
+            # The subject is the first paragraph of the message, folded.
+            return ' '.join(line.strip() for line in message[1].split('\n\n', 1)[0].strip().split('\n'))
+
         (status, output) = run_command('git show --pretty=%%s -s %s' % (commit), cls.debug)
         if status == 0 and len(output) == 1:
             return output[0]
@@ -188,6 +380,16 @@ class Git:
     #
     @classmethod
     def show(cls, obj, branch=''):
+        # Only blobs may be read directly, show formats everything else.
+        if cls.batch and branch != '':
+            result = GitBatch.get().read(branch + ':' + obj)
+            if result is None or result[1] != 'blob':
+                raise GitError(["fatal: path '%s' does not exist in '%s'" % (obj, branch)])
+            content = result[2].decode('utf-8', errors='replace')
+            if content.endswith('\n'):
+                content = content[:-1]
+            return content.split('\n')
+
         cmd = 'git show '
         if branch != '':
             cmd += branch + ':'
@@ -327,4 +529,33 @@ class Git:
 
         return cls.log_results
 
+if __name__ == '__main__':
+    # Benchmark per-query forks against the batch backend in the repository
+    # containing the current directory.
+    import sys
+    from timeit import repeat
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    status, commits = run_command("git rev-list --max-count=%d HEAD" % count)
+    if status != 0:
+        raise SystemExit("not a git repository")
+    status, files = run_command("git ls-tree --name-only HEAD")
+
+    def queries():
+        Git.current_commit()
+        Git.current_branch()
+        for commit in commits:
+            Git.subject(commit)
+        for name in files[:count]:
+            try:
+                Git.show(name, branch='HEAD')
+            except (GitError, UnicodeDecodeError):
+                pass
+
+    print("commits={} files={}".format(len(commits), min(len(files), count)))
+    for batch in (False, True):
+        Git.batch = batch
+        best = min(repeat(queries, number=1, repeat=3))
+        print("batch={:5} {:8.1f}ms".format(str(batch), best * 1000))
+
 # vi:set ts=4 sw=4 expandtab:
@@ -0,0 +1,561 @@
+#
+# job_queue -- the build job queue and a pool of workers to run it
+#
+# The queue is a directory shared with queue/queue.  Each job is a file
+# holding its command line, named for its priority, the time it was queued
+# and its type:
+#
+#   <prio>.<time>.<which>.<random>.N  being written, invisible to pickers,
+#   <prio>.<time>.<which>.<random>.Q  queued,
+#   <prio>.<time>.<which>.<random>.R  running,
+#   <who>.O                           the job <who> is running.
+#
+# Priorities are A, B and C, jobs are picked in name order and so by
+# priority then age.  Every transition is a rename so a job is claimed by
+# exactly one picker.  A leased picker holds a lease on its job, the mtime
+# of its .O file, which it must renew() while it works; jobs whose lease
+# expires are returned to the queue by recover() for someone else to run.
+# Leased owners are marked by a second 'leased' line in their .O file.
+# Pickers which do not ask for a lease, the old shell runners which never
+# renew, keep their job until they complete it as before.
+#
+# Rolling out: update the queue host first, old runners keep picking
+# without a lease; then move the runners over to the leased slot commands.
+#
+import os
+import tempfile
+import threading
+from time import time, sleep
+
+from ktl.log import cinfo, cwarn
+
+
+class JobQueueError(Exception):
+    pass
+
+
+# JobQueue
+#
+class JobQueue:
+
+    priorities = ('A', 'B', 'C')
+
+    # __init__
+    #
+    def __init__(self, path, lease=900):
+        self.path = path
+        self.lease = lease
+        os.makedirs(path, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.path, name)
+
+    @staticmethod
+    def _who_check(who):
+        if who == '' or '/' in who or who.startswith('.'):
+            raise JobQueueError("{}: invalid".format(who))
+
+    @staticmethod
+    def parse(entry):
+        '''
+        Split an entry name into (prio, time, which, state).
+        '''
+        fields = entry.split('.')
+        if len(fields) != 5 or not fields[1].isdigit():
+            return None
+        return (fields[0], int(fields[1]), fields[2], fields[4])
+
+    def _entries(self, state):
+        entries = []
+        for entry in os.listdir(self.path):
+            fields = self.parse(entry)
+            if fields is not None and fields[3] == state:
+                entries.append((entry, fields))
+        entries.sort()
+        return entries
+
+    # enqueue
+    #
+    def enqueue(self, which, priority, cmd):
+        '''
+        Queue cmd, a list of words, as a job of type which.  Returns the
+        entry name.
+        '''
+        if priority not in self.priorities:
+            raise JobQueueError("{}: invalid priority".format(priority))
+        if which == '' or '.' in which or '/' in which:
+            raise JobQueueError("{}: invalid job type".format(which))
+
+        (fd, job) = tempfile.mkstemp(prefix='{}.{}.{}.'.format(priority, int(time()), which), suffix='.N', dir=self.path)
+        with os.fdopen(fd, 'w') as jfd:
+            jfd.write(' '.join(cmd) + '\n')
+        entry = job[:-2] + '.Q'
+        os.rename(job, entry)
+        return os.path.basename(entry)
+
+    # pick
+    #
+    def pick(self, who, which, leased=True):
+        '''
+        Claim the next job of type which for who, returning (entry, command)
+        or None if there is nothing to run.  Expired leases are recovered
+        first.  Without leased the job is held until completed however long
+        that takes, for pickers which cannot renew().
+        '''
+        self._who_check(who)
+        if os.path.exists(self._path(who + '.O')):
+            raise JobQueueError("{}: already executing job".format(who))
+        self.recover()
+
+        for (entry, fields) in self._entries('Q'):
+            if fields[2] != which:
+                continue
+            rentry = entry[:-2] + '.R'
+            try:
+                os.rename(self._path(entry), self._path(rentry))
+            except FileNotFoundError:
+                # Picked by someone else.
+                continue
+
+            with open(self._path(who + '.O.new'), 'w') as ofd:
+                ofd.write(rentry + '\n')
+                if leased:
+                    ofd.write('leased\n')
+            os.rename(self._path(who + '.O.new'), self._path(who + '.O'))
+
+            with open(self._path(rentry)) as jfd:
+                return (rentry, jfd.read())
+
+        return None
+
+    def _owner(self, who):
+        try:
+            with open(self._path(who + '.O')) as ofd:
+                lines = ofd.read().split('\n')
+        except FileNotFoundError:
+            return (None, False)
+        return (lines[0].strip(), 'leased' in lines[1:])
+
+    def _owned(self, who):
+        return self._owner(who)[0]
+
+    # complete
+    #
+    def complete(self, whos):
+        '''
+        Retire the jobs whos are running.  Returns those whos which were not
+        running a job, most likely their lease expired.
+        '''
+        lost = []
+        for who in whos:
+            self._who_check(who)
+            entry = self._owned(who)
+            if entry is None:
+                lost.append(who)
+                continue
+            for name in (entry, who + '.O'):
+                try:
+                    os.unlink(self._path(name))
+                except FileNotFoundError:
+                    pass
+        return lost
+
+    # renew
+    #
+    def renew(self, whos):
+        '''
+        Extend the leases on the jobs whos are running.  Returns those whos
+        which were not running a job.
+        '''
+        lost = []
+        for who in whos:
+            self._who_check(who)
+            try:
+                os.utime(self._path(who + '.O'))
+            except FileNotFoundError:
+                lost.append(who)
+        return lost
+
+    # recover
+    #
+    def recover(self, lease=None):
+        '''
+        Return running jobs whose lease has expired to the queue, their
+        runner has most likely died.  Jobs left running without an owner and
+        abandoned partial writes are treated the same way.  Returns the
+        entries requeued.
+        '''
+        limit = time() - (self.lease if lease is None else lease)
+        recovered = []
+
+        owned = set()
+        for name in os.listdir(self.path):
+            if not name.endswith('.O'):
+                continue
+            (entry, leased) = self._owner(name[:-2])
+            try:
+                expired = leased and os.stat(self._path(name)).st_mtime < limit
+            except FileNotFoundError:
+                continue
+            if not expired:
+                owned.add(entry)
+                continue
+
+            # Drop the owner first, a late complete() then fails rather than
+            # removing the requeued job.
+            try:
+                os.unlink(self._path(name))
+            except FileNotFoundError:
+                continue
+            cwarn("job_queue: {}: lease expired".format(name[:-2]))
+
+        for (entry, fields) in self._entries('R'):
+            if entry in owned:
+                continue
+            try:
+                # The rename which picked it updated the ctime, if that was
+                # recent its owner may not be recorded yet.
+                st = os.stat(self._path(entry))
+                if max(st.st_mtime, st.st_ctime) >= limit:
+                    continue
+                os.rename(self._path(entry), self._path(entry[:-2] + '.Q'))
+                recovered.append(entry[:-2] + '.Q')
+            except FileNotFoundError:
+                pass
+
+        for (entry, fields) in self._entries('N'):
+            try:
+                if os.stat(self._path(entry)).st_mtime < limit:
+                    os.unlink(self._path(entry))
+            except FileNotFoundError:
+                pass
+
+        return recovered
+
+    # listing
+    #
+    def listing(self):
+        '''
+        The running then queued jobs as (entry, command) pairs.
+        '''
+        listing = []
+        for state in ('R', 'Q'):
+            for (entry, fields) in self._entries(state):
+                try:
+                    with open(self._path(entry)) as jfd:
+                        listing.append((entry, jfd.readline().strip()))
+                except FileNotFoundError:
+                    pass
+        return listing
+
+    # metrics
+    #
+    def metrics(self, now=None):
+        '''
+        Queue depth and waiting times: for each job type the number queued
+        at each priority and the age of the oldest, and for each running job
+        how long it waited to be picked, how long it has been running and
+        when its lease was last renewed, None if it holds no lease.
+        '''
+        now = time() if now is None else now
+        metrics = {'queued': {}, 'running': []}
+        for (entry, (prio, queued, which, state)) in self._entries('Q'):
+            info = metrics['queued'].setdefault(which, {'depth': {}, 'oldest': 0})
+            info['depth'][prio] = info['depth'].get(prio, 0) + 1
+            info['oldest'] = max(info['oldest'], int(now - queued))
+
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith('.O'):
+                continue
+            (entry, leased) = self._owner(name[:-2])
+            fields = self.parse(entry) if entry else None
+            try:
+                st = os.stat(self._path(entry))
+                picked = max(st.st_mtime, st.st_ctime)
+                lease = os.stat(self._path(name)).st_mtime
+            except (FileNotFoundError, TypeError):
+                continue
+            if fields is None:
+                continue
+            metrics['running'].append({
+                'who': name[:-2],
+                'entry': entry,
+                'wait': int(picked - fields[1]),
+                'running': int(now - picked),
+                'lease': int(now - lease) if leased else None,
+            })
+        return metrics
+
+
+
+
+# JobQueueWorkers
+#
+class JobQueueWorkers:
+    '''
+    Run the jobs of type which from queue on workers concurrent slots.  The
+    queue may be a JobQueue or anything offering its pick(), renew() and
+    complete(); slots pick as <prefix><n>.
+
+    run(who, entry, command) runs a job, returning its exit status.  With
+    areas, a list of one work area per worker, each worker runs its jobs in
+    its own area as run(who, entry, command, area).  Jobs
+    share their output area so finished jobs are published together, by
+    publish(entries) returning True on success, whenever nothing is running;
+    a job picked meanwhile waits for the publish before it starts.
+    Once a finished job has waited publish_delay seconds we stop starting
+    new jobs until those running finish so it can go.  A job is completed
+    only after it is published, or publish has failed publish_retries times
+    in a row, leaving its results for the next; if we die before then its
+    lease expires and it is run again.  Leases are renewed every
+    renew_interval seconds.
+
+    With poll set an empty queue is tried again that many seconds later,
+    otherwise run() returns once the queue is empty and everything is
+    published.
+    '''
+
+    # __init__
+    #
+    def __init__(self, queue, which, run, publish, workers=4, prefix='', publish_delay=300, publish_retries=3, renew_interval=60, poll=None, areas=None):
+        if areas is not None and len(areas) < workers:
+            raise ValueError("{} work areas for {} workers".format(len(areas), workers))
+        self.queue = queue
+        self.which = which
+        self.run_job = run
+        self.publish = publish
+        self.workers = workers
+        self.prefix = prefix
+        self.publish_delay = publish_delay
+        self.publish_retries = publish_retries
+        self.renew_interval = renew_interval
+        self.poll = poll
+        self.areas = areas
+
+        self.cond = threading.Condition()
+        self.slots = 0
+        self.free = []
+        self.running = {}
+        self.executing = 0
+        self.finished = []
+        self.completing = set()
+        self.publishing = False
+        self.renewing = False
+        self.retry = 0
+        self.barrier = False
+        self.active = 0
+        self.stopping = False
+
+        self.stats = {'jobs': 0, 'failed': 0, 'lost': 0, 'batches': 0, 'publish-failed': 0,
+                      'wait-total': 0, 'wait-max': 0, 'run-total': 0}
+
+    def _slot(self):
+        # Finished jobs keep their slot until published, so we may need more
+        # slots than workers.
+        if len(self.free) == 0:
+            self.free.append(self.prefix + str(self.slots))
+            self.slots += 1
+        return self.free.pop(0)
+
+    def _stat_job(self, entry, picked, finished, rc):
+        fields = JobQueue.parse(entry)
+        wait = max(0, int(picked - fields[1])) if fields else 0
+        self.stats['jobs'] += 1
+        if rc != 0:
+            self.stats['failed'] += 1
+        self.stats['wait-total'] += wait
+        self.stats['wait-max'] = max(self.stats['wait-max'], wait)
+        self.stats['run-total'] += int(finished - picked)
+        return wait
+
+    # _worker
+    #
+    def _worker(self, area):
+        while True:
+            with self.cond:
+                while self.barrier and not self.stopping:
+                    self.cond.wait()
+                if self.stopping:
+                    break
+                who = self._slot()
+                self.running[who] = None
+
+            try:
+                picked = self.queue.pick(who, self.which)
+            except Exception as e:
+                cwarn("job_queue: {}: pick failed ({})".format(who, e))
+                picked = None
+
+            if picked is None:
+                with self.cond:
+                    del self.running[who]
+                    self.free.insert(0, who)
+                    self.cond.notify_all()
+                if self.poll is None:
+                    break
+                sleep(self.poll)
+                continue
+
+            (entry, command) = picked
+            with self.cond:
+                self.running[who] = entry
+                # Nothing else running, publish what has finished first
+                # rather than holding it until this one is done too.
+                while not self.stopping and (self.publishing or self._publish_due()):
+                    self.cond.wait()
+                self.executing += 1
+            start = time()
+            try:
+                if self.areas is None:
+                    rc = self.run_job(who, entry, command)
+                else:
+                    rc = self.run_job(who, entry, command, area)
+            except Exception as e:
+                cwarn("job_queue: {}: {} failed to run ({})".format(who, entry, e))
+                rc = -1
+
+            finished = time()
+            with self.cond:
+                wait = self._stat_job(entry, start, finished, rc)
+                cinfo("job_queue: {}: {} complete rc={} wait={}s run={}s".format(who, entry, rc, wait, int(finished - start)))
+                del self.running[who]
+                self.executing -= 1
+                self.finished.append((who, entry, finished))
+                self.cond.notify_all()
+
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    # _renewer
+    #
+    def _renewer(self):
+        with self.cond:
+            renew = time() + self.renew_interval
+            while not self.stopping:
+                # We are woken by every change of state, only renew once
+                # the interval is up.
+                now = time()
+                if now < renew:
+                    self.cond.wait(renew - now)
+                    continue
+                renew = now + self.renew_interval
+
+                whos = [who for (who, entry) in self.running.items() if entry is not None]
+                whos += [who for (who, entry, finished) in self.finished if who not in self.completing]
+                if len(whos) == 0:
+                    continue
+
+                self.renewing = True
+                self.cond.release()
+                try:
+                    lost = self.queue.renew(whos)
+                except Exception as e:
+                    cwarn("job_queue: lease renewal failed ({})".format(e))
+                    lost = []
+                finally:
+                    self.cond.acquire()
+                    self.renewing = False
+                    self.cond.notify_all()
+                for who in lost:
+                    cwarn("job_queue: {}: lease lost".format(who))
+
+    def _publish_due(self):
+        return self.executing == 0 and len(self.finished) > 0 and time() >= self.retry
+
+    # _publish
+    #
+    def _publish(self, failures):
+        '''
+        Publish and complete the finished jobs, called holding the condition
+        while nothing is running.  Returns whether the publish worked.
+        '''
+        batch = list(self.finished)
+        entries = [entry for (who, entry, finished) in batch]
+        whos = [who for (who, entry, finished) in batch]
+
+        self.publishing = True
+        self.cond.release()
+        try:
+            published = self.publish(entries)
+        except Exception as e:
+            cwarn("job_queue: publish failed ({})".format(e))
+            published = False
+        finally:
+            self.cond.acquire()
+
+        lost = []
+        try:
+            if published or failures + 1 >= self.publish_retries:
+                # A renewal racing the completion would report these lost.
+                while self.renewing:
+                    self.cond.wait()
+                self.completing = set(whos)
+                self.cond.release()
+                try:
+                    lost = self.queue.complete(whos)
+                finally:
+                    self.cond.acquire()
+                    self.completing = set()
+        finally:
+            self.publishing = False
+
+        if not published:
+            self.stats['publish-failed'] += 1
+            if failures + 1 < self.publish_retries:
+                return False
+            cwarn("job_queue: completing {} jobs unpublished".format(len(batch)))
+
+        for who in lost:
+            cwarn("job_queue: {}: lease lost before completion".format(who))
+        self.stats['lost'] += len(lost)
+        self.stats['batches'] += 1
+        self.finished = [job for job in self.finished if job not in batch]
+        self.free.extend(whos)
+        cinfo("job_queue: completed {} jobs".format(len(batch)))
+        return published
+
+    # run
+    #
+    def run(self):
+        threads = [threading.Thread(target=self._renewer, name='job-queue-renew')]
+        for n in range(self.workers):
+            area = self.areas[n] if self.areas is not None else None
+            threads.append(threading.Thread(target=self._worker, args=(area,), name='job-queue-worker-{}'.format(n)))
+        with self.cond:
+            self.active = self.workers
+        for thread in threads:
+            thread.start()
+
+        failures = 0
+        try:
+            with self.cond:
+                while len(self.finished) > 0 or self.active > 0:
+                    now = time()
+                    if len(self.finished) > 0:
+                        # Slots still picking do not hold up the publish,
+                        # what they pick waits for it.
+                        if self._publish_due():
+                            if self._publish(failures):
+                                failures = 0
+                            else:
+                                failures += 1
+                                self.retry = time() + min(self.publish_delay, 60) * failures
+                            self.barrier = False
+                            self.cond.notify_all()
+                            continue
+
+                        if min(finished for (who, entry, finished) in self.finished) + self.publish_delay <= now:
+                            self.barrier = True
+
+                    self.cond.wait(min(1, self.retry - now) if self.retry > now else 1)
+        finally:
+            with self.cond:
+                self.stopping = True
+                self.cond.notify_all()
+            for thread in threads:
+                thread.join()
+
+        return self.stats
+
+# vi:set ts=4 sw=4 expandtab:
@@ -6,11 +6,15 @@ try:
 except ImportError:
     from urllib2 import urlopen
 
+import hashlib
 import os
+import pickle
 import yaml
 
 
 class KernelRoutingEntry:
+    __slots__ = ('_ks', '_source', '_name', '_data')
+
     def __init__(self, ks, source, data):
         name = "{}:{}".format(source.series.codename, source.name)
         if isinstance(data, str):
@@ -71,6 +75,8 @@ class KernelRoutingEntry:
 
 
 class KernelRepoEntry:
+    __slots__ = ('_ks', '_owner', '_data')
+
     def __init__(self, ks, owner, data):
         if isinstance(data, list):
             new_data = {'url': data[0]}
@@ -111,6 +117,8 @@ class KernelRepoEntry:
 
 
 class KernelSnapEntry:
+    __slots__ = ('_ks', '_source', '_name', '_data')
+
     def __init__(self, ks, source, name, data):
         self._ks = ks
         self._source = source
@@ -219,6 +227,8 @@ class KernelSnapEntry:
 
 
 class KernelPackageEntry:
+    __slots__ = ('_ks', '_source', '_name', '_data')
+
     def __init__(self, ks, source, name, data):
         self._ks = ks
         self._source = source
@@ -261,11 +271,17 @@ class KernelPackageEntry:
 
 
 class KernelSourceEntry:
+    __slots__ = ('_ks', '_series', '_name', '_data', '_packages', '_snaps', '_routing')
+
     def __init__(self, ks, series, name, data):
         self._ks = ks
         self._series = series
         self._name = name
         self._data = data if data else {}
+        # Package and snap entries are created on first use and interned.
+        self._packages = {}
+        self._snaps = {}
+        self._routing = None
 
     def __eq__(self, other):
         if isinstance(self, other.__class__):
@@ -340,34 +356,38 @@ class KernelSourceEntry:
     @property
     def packages(self):
         # XXX: should this return None when empty
-        result = []
         packages = self._data.get('packages')
-        if packages:
-            for package_key, package in packages.items():
-                result.append(KernelPackageEntry(self._ks, self, package_key, package))
-        return result
+        if not packages:
+            return []
+        return [self.lookup_package(package_key) for package_key in packages]
 
     def lookup_package(self, package_key):
         packages = self._data.get('packages')
         if not packages or package_key not in packages:
             return None
-        return KernelPackageEntry(self._ks, self, package_key, packages[package_key])
+        entry = self._packages.get(package_key)
+        if entry is None:
+            entry = self._packages[package_key] = KernelPackageEntry(
+                self._ks, self, package_key, packages[package_key])
+        return entry
 
     @property
     def snaps(self):
         # XXX: should this return None when empty
-        result = []
         snaps = self._data.get('snaps')
-        if snaps:
-            for snap_key, snap in snaps.items():
-                result.append(KernelSnapEntry(self._ks, self, snap_key, snap))
-        return result
+        if not snaps:
+            return []
+        return [self.lookup_snap(snap_key) for snap_key in snaps]
 
     def lookup_snap(self, snap_key):
         snaps = self._data.get('snaps')
         if not snaps or snap_key not in snaps:
             return None
-        return KernelSnapEntry(self._ks, self, snap_key, snaps[snap_key])
+        entry = self._snaps.get(snap_key)
+        if entry is None:
+            entry = self._snaps[snap_key] = KernelSnapEntry(
+                self._ks, self, snap_key, snaps[snap_key])
+        return entry
 
     @property
     def derived_from(self):
@@ -445,7 +465,9 @@ class KernelSourceEntry:
         data = self._data.get('routing', default)
         if data is None:
             return data
-        return KernelRoutingEntry(self._ks, self, data)
+        if self._routing is None:
+            self._routing = KernelRoutingEntry(self._ks, self, data)
+        return self._routing
 
     @property
     def swm_data(self):
@@ -459,6 +481,8 @@ class KernelSourceEntry:
         return "{} {}".format(self.series.name, self.name)
 
 class KernelSourceTestingFlavourEntry:
+    __slots__ = ('_name', '_data', '_source', '_arches', '_clouds', '_meta_pkg')
+
     def __init__(self, name, data, kernel_testing, source=None):
         self._name = name
         self._data = data
@@ -490,9 +514,13 @@ class KernelSourceTestingFlavourEntry:
         return self._meta_pkg
 
 class KernelSeriesEntry:
+    __slots__ = ('_ks', '_name', '_data', '_sources')
+
     def __init__(self, ks, name, data, defaults=None):
         self._ks = ks
         self._name = name
+        # Source entries are created on first use and interned.
+        self._sources = {}
         self._data = {}
         if defaults is not None:
             self._data.update(defaults)
@@ -562,13 +590,10 @@ class KernelSeriesEntry:
 
     @property
     def sources(self):
-        result = []
         sources = self._data.get('sources')
-        if sources:
-            for source_key, source in sources.items():
-                result.append(KernelSourceEntry(
-                    self._ks, self, source_key, source))
-        return result
+        if not sources:
+            return []
+        return [self.lookup_source(source_key) for source_key in sources]
 
     @property
     def routing_table(self):
@@ -582,7 +607,11 @@ class KernelSeriesEntry:
         sources = self._data.get('sources')
         if not sources or source_key not in sources:
             return None
-        return KernelSourceEntry(self._ks, self, source_key, sources[source_key])
+        entry = self._sources.get(source_key)
+        if entry is None:
+            entry = self._sources[source_key] = KernelSourceEntry(
+                self._ks, self, source_key, sources[source_key])
+        return entry
 
 
 # KernelSeries
@@ -595,6 +624,44 @@ class KernelSeries:
     #_url = 'file:///home/apw/git2/kteam-tools/info/kernel-series.yaml'
     #_url = 'file:///home/work/kteam-tools/info/kernel-series.yaml'
     _data_txt = {}
+    # Parsed kernel-series data, pickled and keyed by a hash of the YAML,
+    # cached both in memory and on disk.  Set _cache_dir to None to disable
+    # the disk cache.
+    _data_compiled = {}
+    _cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                              'kteam-tools', 'kernel-series')
+
+    @classmethod
+    def __load_compiled(cls, data):
+        key = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        compiled = cls._data_compiled.get(key)
+
+        cache_path = None
+        if compiled is None and cls._cache_dir is not None:
+            cache_path = os.path.join(cls._cache_dir, key + '.pickle')
+            try:
+                with open(cache_path, 'rb') as rfd:
+                    compiled = rfd.read()
+                pickle.loads(compiled)
+            except Exception:
+                compiled = None
+
+        if compiled is None:
+            compiled = pickle.dumps(yaml.safe_load(data), protocol=pickle.HIGHEST_PROTOCOL)
+            if cache_path is not None:
+                try:
+                    if not os.path.isdir(cls._cache_dir):
+                        os.makedirs(cls._cache_dir)
+                    with open(cache_path + '.new', 'wb') as wfd:
+                        wfd.write(compiled)
+                    os.rename(cache_path + '.new', cache_path)
+                except OSError:
+                    pass
+        cls._data_compiled[key] = compiled
+
+        # Each instance gets its own copy as the entries normalise the data
+        # in place.
+        return (key, pickle.loads(compiled))
 
     @classmethod
     def __load_once(cls, url):
@@ -615,8 +682,17 @@ class KernelSeries:
                 data = data.decode('utf-8')
         else:
             data = self.__load_once(self._url_local if use_local else self._url)
-        self._data = yaml.safe_load(data)
-
+        # data_hash identifies the source YAML for consumers caching
+        # information derived from it.
+        (self.data_hash, self._data) = self.__load_compiled(data)
+
+        # Series entries are created on first use and interned.
+        self._series = {}
+        # Reverse indexes, built on first use.
+        self._index_packages = None
+        self._index_snaps = None
+        self._index_derivatives = None
+        self._index_routes = None
         self._development_series = None
         self._codename_to_series = {}
         for series_key, series in self._data.items():
@@ -637,11 +713,81 @@ class KernelSeries:
     def key_series_name(series):
         return [int(x) for x in series.name.split('.')]
 
+    def __lookup_series(self, series_key):
+        entry = self._series.get(series_key)
+        if entry is None:
+            entry = self._series[series_key] = KernelSeriesEntry(self, series_key,
+                self._data[series_key], defaults=self._defaults_series)
+        return entry
+
     @property
     def series(self):
-        return [KernelSeriesEntry(self, series_key, series,
-                defaults=self._defaults_series)
-                for series_key, series in self._data.items()]
+        return [self.__lookup_series(series_key) for series_key in self._data]
+
+    def __build_indexes(self):
+        packages = {}
+        snaps = {}
+        derivatives = {}
+        routes = {}
+        for series in self.series:
+            for source in series.sources:
+                for package in source.packages:
+                    packages.setdefault(package.name, []).append(package)
+                for snap in source.snaps:
+                    snaps.setdefault(snap.name, []).append(snap)
+
+                derived_from = source._data.get('derived-from')
+                if derived_from is not None:
+                    derivatives.setdefault(tuple(derived_from), []).append(source)
+
+                try:
+                    routing = source.routing
+                except ValueError:
+                    routing = None
+                if routing is not None:
+                    references = set()
+                    for dest, archives in routing:
+                        for archive in archives or []:
+                            references.add(archive[0])
+                    for reference in references:
+                        routes.setdefault(reference, []).append(source)
+
+        self._index_packages = packages
+        self._index_snaps = snaps
+        self._index_derivatives = derivatives
+        self._index_routes = routes
+
+    def lookup_package_entries(self, package_name):
+        '''
+        All package entries named package_name, across all series.
+        '''
+        if self._index_packages is None:
+            self.__build_indexes()
+        return list(self._index_packages.get(package_name, []))
+
+    def lookup_snap_entries(self, snap_name):
+        '''
+        All snap entries named snap_name, across all series.
+        '''
+        if self._index_snaps is None:
+            self.__build_indexes()
+        return list(self._index_snaps.get(snap_name, []))
+
+    def lookup_derivatives(self, source):
+        '''
+        All sources whose derived-from is the supplied source.
+        '''
+        if self._index_derivatives is None:
+            self.__build_indexes()
+        return list(self._index_derivatives.get((source.series.name, source.name), []))
+
+    def lookup_routed_sources(self, reference):
+        '''
+        All sources with a routing destination in the archive reference.
+        '''
+        if self._index_routes is None:
+            self.__build_indexes()
+        return list(self._index_routes.get(reference, []))
 
     def lookup_series(self, series=None, codename=None, development=False):
         if not series and not codename and not development:
@@ -656,11 +802,88 @@ class KernelSeries:
             series = self._development_series
         if series and series not in self._data:
             return None
-        return KernelSeriesEntry(self, series, self._data[series],
-                                 defaults=self._defaults_series)
+        return self.__lookup_series(series)
+
+
+def _benchmark(path, repeat=5):
+    # Compare startup through the YAML parser, the on-disk compiled cache,
+    # and the in-memory compiled cache, plus a walk over every source.
+    from timeit import repeat as timeit_repeat
+
+    with open(path) as rfd:
+        data = rfd.read()
+
+    def yaml_load():
+        yaml.safe_load(data)
+
+    def disk_load():
+        KernelSeries._data_compiled.clear()
+        KernelSeries(data=data)
+
+    def memory_load():
+        KernelSeries(data=data)
+
+    ks = KernelSeries(data=data)
+
+    def walk():
+        for series in ks.series:
+            for source in series.sources:
+                source.packages
+                source.snaps
+
+    print("kernel-series: {} size={}KiB".format(path, len(data) // 1024))
+    for name, func in (
+            ('yaml', yaml_load),
+            ('disk-cache', disk_load),
+            ('memory-cache', memory_load),
+            ('walk-sources', walk)):
+        best = min(timeit_repeat(func, number=1, repeat=repeat))
+        print("{:14} {:8.2f}ms".format(name, best * 1000))
+
+
+def _benchmark_index(repeat=5):
+    # Compare finding the owners of a package by walking every source with
+    # the reverse index, over synthetic files of increasing size.
+    from timeit import repeat as timeit_repeat
+
+    for series_count in (5, 50, 500):
+        data = {}
+        for series_nr in range(series_count):
+            sources = {}
+            for source_nr in range(20):
+                name = 'linux-{}'.format(source_nr)
+                sources[name] = {
+                    'packages': {name: None, name.replace('linux', 'linux-meta'): {'type': 'meta'}},
+                    'snaps': {'{}-kernel'.format(name): None},
+                    }
+            data['{}.04'.format(series_nr)] = {'codename': 'series{}'.format(series_nr), 'sources': sources}
+        ks = KernelSeries(data=yaml.safe_dump(data))
+        ks.lookup_package_entries('linux-meta-1')
+
+        def walk():
+            return [package for series in ks.series
+                    for source in series.sources
+                    for package in source.packages
+                    if package.name == 'linux-meta-1']
+
+        def index():
+            return ks.lookup_package_entries('linux-meta-1')
+
+        print("sources={}".format(series_count * 20))
+        for name, func in (('walk', walk), ('index', index)):
+            best = min(timeit_repeat(func, number=100, repeat=repeat)) / 100
+            print("  {:8} {:10.2f}us".format(name, best * 1000000))
 
 
 if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['--benchmark']:
+        _benchmark(sys.argv[2] if len(sys.argv) > 2 else KernelSeries._url_local[len('file://'):])
+        sys.exit(0)
+    if sys.argv[1:2] == ['--benchmark-index']:
+        _benchmark_index()
+        sys.exit(0)
+
     db = KernelSeries()
 
     series = db.lookup_series('16.04')
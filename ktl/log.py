@@ -1,8 +1,14 @@
 #!/usr/bin/env python
 #
-from logging                            import info, debug, warning
+from logging                            import info, debug, warning, getLogger, DEBUG, INFO, WARNING
 from ktl.termcolor                      import colored
 
+# All of the log helpers accept either a message or a callable returning the
+# message.  A callable is only evaluated if the message will be emitted,
+# allowing expensive debug messages to be built lazily:
+#
+#   cdebug(lambda: 'status: {}'.format(expensive()))
+#
 def cinfo(msg, color='white'):
     Clog.info(msg, color)
 
@@ -32,6 +38,19 @@ class Clog:
     color = True
     indent = 0
 
+    _logger = getLogger()
+    _colors = {}
+
+    @classmethod
+    def colored(c, msg, color):
+        if callable(msg):
+            msg = msg()
+        # Cache the escape sequences for each color.
+        wrap = c._colors.get(color)
+        if wrap is None:
+            wrap = c._colors[color] = colored('\0', color).split('\0')
+        return wrap[0] + str(msg) + wrap[1]
+
     @classmethod
     def info(c, msg, color='white'):
         if c.dbg:
@@ -39,26 +58,29 @@ class Clog:
             # and "INFO -" is fewer chars then "DEBUG -" and so things don't line
             # up.
             #
-            debug(colored(msg, color))
-        else:
-            info(colored(msg, color))
+            if c._logger.isEnabledFor(DEBUG):
+                debug(c.colored(msg, color))
+        elif c._logger.isEnabledFor(INFO):
+            info(c.colored(msg, color))
 
     @classmethod
     def debug(c, msg, color='magenta'):
-        debug(colored(msg, color))
+        if c._logger.isEnabledFor(DEBUG):
+            debug(c.colored(msg, color))
 
     @classmethod
     def warn(c, msg, color='red'):
-        warning(colored(msg, color))
+        if c._logger.isEnabledFor(WARNING):
+            warning(c.colored(msg, color))
 
     @classmethod
     def notice(c, msg, color='yellow'):
-        c.info(colored(msg, color))
+        c.info(lambda: c.colored(msg, color), color)
 
     @classmethod
     def enter(c, msg):
         if c.color:
-            c.debug(colored(msg, 'green'))
+            c.debug(lambda: c.colored(msg, 'green'))
         else:
             c.debug(msg)
         c.indent += 4
@@ -67,7 +89,7 @@ class Clog:
     def leave(c, msg):
         c.indent -= 4
         if c.color:
-            c.debug(colored(msg, 'green'))
+            c.debug(lambda: c.colored(msg, 'green'))
         else:
             c.debug(msg)
 
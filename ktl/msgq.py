@@ -1,5 +1,10 @@
+import collections
+import concurrent.futures
 import functools
 import json
+import threading
+from time import time
+
 import pika
 
 # MsgQueue
@@ -8,8 +13,9 @@ class MsgQueue(object):
 
     # __init__
     #
-    def __init__(s, address='162.213.33.247', exchange='kernel', exchange_type='topic', heartbeat_interval=None, supports_global_qos=False, local=False, **kwargs):
+    def __init__(s, address='162.213.33.247', exchange='kernel', exchange_type='topic', heartbeat_interval=None, supports_global_qos=False, local=False, connect=True, **kwargs):
         s.exchange_name = exchange
+        s.exchange_type = exchange_type
 
         # Address should now be considered deprecated.
         if local:
@@ -25,15 +31,21 @@ class MsgQueue(object):
 
         s.connection = None
         s.channel = None
-
-        params = pika.ConnectionParameters(**kwargs)
-        s.connection = pika.BlockingConnection(params)
-        s.channel = s.connection.channel()
-        s.channel.exchange_declare(exchange=s.exchange_name, exchange_type=exchange_type)
+        s.pool = None
 
         s.supports_global_qos = supports_global_qos
 
+        # Producers which only use a publisher() need not connect here.
+        s.parameters = pika.ConnectionParameters(**kwargs)
+        if connect:
+            s.connection = pika.BlockingConnection(s.parameters)
+            s.channel = s.connection.channel()
+            s.channel.exchange_declare(exchange=s.exchange_name, exchange_type=exchange_type)
+
     def close(s):
+        if s.pool is not None:
+            s.pool.shutdown()
+            s.pool = None
         if s.channel is not None:
             s.channel.close()
             s.channel = None
@@ -60,21 +72,53 @@ class MsgQueue(object):
         s.channel.start_consuming()
 
 
-    def listen_worker(s, queue_name, routing_key, handler_function=None, handler=None, queue_durable=True, auto_delete=False, queue_arguments=None):
+    # listen_pool
+    #
+    def listen_pool(s, workers=4, processes=False, ordered=True):
+        '''
+        Run subsequent listen_worker() handlers on a pool of worker threads
+        (or processes) rather than inline; see MsgQueueWorkerPool.  Combine
+        with a prefetch_count above one to keep the workers busy.
+        '''
+        s.pool = MsgQueueWorkerPool(s.connection, workers=workers, processes=processes, ordered=ordered)
+
+    # listen_worker
+    #
+    def listen_worker(s, queue_name, routing_key, handler_function=None, handler=None, queue_durable=True, auto_delete=False, queue_arguments=None, prefetch_count=1, handler_acks=False):
+        '''
+        Consume queue_name, bound to routing_key, calling handler_function
+        with the payload and/or handler with the channel, method, properties
+        and payload of each message.  Messages are acknowledged once the
+        handlers return, unless handler_acks is set in which case handler
+        must acknowledge them itself, for example in batches once their
+        effects are durable; a prefetch_count above one lets messages keep
+        arriving while acknowledgements are held back.  Where the broker
+        supports global QoS the prefetch_count covers the whole channel and
+        each call replaces it, so give every listener the same one.
+        '''
+        if s.pool is not None and s.pool.processes and handler is not None:
+            raise ValueError("process pool workers only support handler_function")
+        if handler_acks and (s.pool is not None or handler is None):
+            raise ValueError("handler_acks needs an inline handler")
+
         def wrapped_handler(channel, method, properties, body):
             if isinstance(body, bytes):
                 body = body.decode('utf-8')
             payload = json.loads(body)
+            if s.pool is not None:
+                s.pool.submit(channel, method, properties, payload, handler_function, handler)
+                return
             if handler_function is not None:
                 handler_function(payload)
             if handler is not None:
                 handler(channel, method, properties, payload)
-            channel.basic_ack(method.delivery_tag)
+            if not handler_acks:
+                channel.basic_ack(method.delivery_tag)
 
         if s.supports_global_qos:
-            s.channel.basic_qos(prefetch_count=1, global_qos=True)
+            s.channel.basic_qos(prefetch_count=prefetch_count, global_qos=True)
         else:
-            s.channel.basic_qos(prefetch_count=1)
+            s.channel.basic_qos(prefetch_count=prefetch_count)
 
         if isinstance(routing_key, str):
             routing_key = [routing_key]
@@ -87,9 +131,21 @@ class MsgQueue(object):
     def listen_start(s):
         s.channel.start_consuming()
 
+        if s.pool is not None:
+            # Consumers are cancelled, let the running handlers finish and
+            # acknowledge their messages before we return.
+            while s.pool.running > 0:
+                s.connection.process_data_events(time_limit=1)
+            s.pool.reset()
+
 
     def listen_stop(s):
-        s.channel.stop_consuming()
+        # With a pool we may be called from a handler in a worker thread, or
+        # from a signal handler; do the drain on the connection thread.
+        if s.pool is not None:
+            s.connection.add_callback_threadsafe(functools.partial(s.pool.drain, s.channel))
+        else:
+            s.channel.stop_consuming()
 
 
     def queue_info(s, queue_name):
@@ -120,6 +176,392 @@ class MsgQueue(object):
         cb = functools.partial(s.publish, routing_key, payload, priority)
         s.connection.add_callback_threadsafe(cb)
 
+    # publisher
+    #
+    def publisher(s, **kwargs):
+        '''
+        Return a MsgQueuePublisher for this exchange, for bulk producers.
+        It makes its own connection to the broker.
+        '''
+        return MsgQueuePublisher(s.parameters, s.exchange_name, exchange_type=s.exchange_type, **kwargs)
+
+
+# MsgQueuePublisher
+#
+class MsgQueuePublisher(object):
+    '''
+    Pipelined publisher for bulk producers.
+
+    publish() only queues the message locally; a background thread owns its
+    own connection, publishes with publisher confirms and keeps up to window
+    messages awaiting confirmation at once rather than waiting a round trip
+    for each.  A message leaves the local buffer only once the broker has
+    confirmed it.  Anything unconfirmed when the connection drops, or nacked
+    by the broker, is published again ahead of anything not yet sent, so
+    delivery is at least once.  While the broker is unreachable we retry
+    with exponential backoff and keep buffering; publish() blocks only once
+    buffer_max messages are waiting.  close() flushes what is buffered before disconnecting.
+    '''
+
+    # __init__
+    #
+    def __init__(s, parameters, exchange, exchange_type='topic', window=256, buffer_max=10000, backoff_initial=0.5, backoff_max=30.0):
+        s.parameters = parameters
+        s.exchange_name = exchange
+        s.exchange_type = exchange_type
+        s.window = window
+        s.buffer_max = buffer_max
+        s.backoff_initial = backoff_initial
+        s.backoff_max = backoff_max
+
+        s.lock = threading.Condition()
+        s.pending = collections.deque()
+        s.unconfirmed = collections.OrderedDict()
+        s.connection = None
+        s.channel = None
+        s.ready = False
+        s.closing = False
+        s.pump_scheduled = False
+        s.delivery_tag = 0
+        s.stats = {
+            'published': 0,
+            'confirmed': 0,
+            'nacked': 0,
+            'republished': 0,
+            'reconnects': 0,
+        }
+
+        s.thread = threading.Thread(target=s._run, name='msgq-publisher', daemon=True)
+        s.thread.start()
+
+    def __enter__(s):
+        return s
+
+    def __exit__(s, exc_type, exc_value, traceback):
+        s.close()
+
+    # publish
+    #
+    def publish(s, routing_key, payload, priority=None):
+        s.publish_batch([(routing_key, payload, priority)])
+
+    # publish_batch
+    #
+    def publish_batch(s, messages):
+        '''
+        Queue a sequence of (routing_key, payload[, priority]) messages.
+        '''
+        queued = []
+        for message in messages:
+            (routing_key, payload) = message[:2]
+            priority = message[2] if len(message) > 2 else None
+            properties = pika.BasicProperties(delivery_mode=2, priority=priority)
+            queued.append((routing_key, json.dumps(payload), properties))
+
+        with s.lock:
+            for message in queued:
+                if s.closing:
+                    raise ValueError('MsgQueuePublisher is closed')
+                while len(s.pending) >= s.buffer_max:
+                    s.lock.wait()
+                s.pending.append(message)
+            s._schedule_pump()
+
+    def _schedule_pump(s):
+        # Called with the lock held; wakes the connection thread once per
+        # burst of messages rather than once per message.
+        if s.ready and not s.pump_scheduled:
+            s.pump_scheduled = True
+            s.connection.ioloop.add_callback_threadsafe(s._pump)
+
+    # flush
+    #
+    def flush(s, timeout=None):
+        '''
+        Wait for everything queued so far to be confirmed by the broker.
+        Returns False if that did not happen within timeout seconds.
+        '''
+        deadline = None if timeout is None else time() + timeout
+        with s.lock:
+            while len(s.pending) > 0 or len(s.unconfirmed) > 0:
+                remaining = None if deadline is None else deadline - time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                s.lock.wait(remaining)
+        return True
+
+    # close
+    #
+    def close(s, timeout=None):
+        '''
+        Flush and disconnect.  Messages still unconfirmed after timeout
+        seconds are abandoned; returns whether everything was delivered.
+        '''
+        if s.thread is None:
+            return True
+        flushed = s.flush(timeout)
+        with s.lock:
+            s.closing = True
+            connection = s.connection
+            s.lock.notify_all()
+        if connection is not None:
+            connection.ioloop.add_callback_threadsafe(functools.partial(s._close_connection, connection))
+        s.thread.join()
+        s.thread = None
+        return flushed
+
+    # Everything below runs in the connection thread.
+    def _run(s):
+        backoff = s.backoff_initial
+        while True:
+            connection = pika.SelectConnection(s.parameters,
+                on_open_callback=s._on_connection_open,
+                on_open_error_callback=s._on_connection_error,
+                on_close_callback=s._on_connection_closed)
+            with s.lock:
+                if s.closing:
+                    break
+                s.connection = connection
+            connection.ioloop.start()
+
+            with s.lock:
+                was_ready = s.ready
+                s.ready = False
+                s.pump_scheduled = False
+                s.connection = None
+                s.channel = None
+
+                # Anything unconfirmed goes back to the front, in order.
+                if len(s.unconfirmed) > 0:
+                    s.stats['republished'] += len(s.unconfirmed)
+                    s.pending.extendleft(reversed(list(s.unconfirmed.values())))
+                    s.unconfirmed.clear()
+                    s.lock.notify_all()
+
+                if s.closing:
+                    break
+                if was_ready:
+                    backoff = s.backoff_initial
+                s.stats['reconnects'] += 1
+                s.lock.wait(backoff)
+                if s.closing:
+                    break
+            backoff = min(backoff * 2, s.backoff_max)
+
+    def _close_connection(s, connection):
+        if connection.is_closing or connection.is_closed:
+            connection.ioloop.stop()
+        else:
+            connection.close()
+
+    def _on_connection_open(s, connection):
+        connection.channel(on_open_callback=s._on_channel_open)
+
+    def _on_connection_error(s, connection, error):
+        connection.ioloop.stop()
+
+    def _on_connection_closed(s, connection, reason):
+        connection.ioloop.stop()
+
+    def _on_channel_open(s, channel):
+        s.channel = channel
+        channel.add_on_close_callback(s._on_channel_closed)
+        channel.exchange_declare(exchange=s.exchange_name, exchange_type=s.exchange_type, callback=s._on_exchange_declared)
+
+    def _on_channel_closed(s, channel, reason):
+        connection = s.connection
+        if connection is not None and not (connection.is_closing or connection.is_closed):
+            connection.close()
+
+    def _on_exchange_declared(s, frame):
+        s.channel.confirm_delivery(ack_nack_callback=s._on_confirm, callback=s._on_confirm_selected)
+
+    def _on_confirm_selected(s, frame):
+        with s.lock:
+            s.ready = True
+            s.delivery_tag = 0
+        s._pump()
+
+    def _pump(s):
+        with s.lock:
+            s.pump_scheduled = False
+            if not s.ready:
+                return
+            published = False
+            while len(s.pending) > 0 and len(s.unconfirmed) < s.window:
+                message = s.pending.popleft()
+                s.delivery_tag += 1
+                s.unconfirmed[s.delivery_tag] = message
+                (routing_key, body, properties) = message
+                s.channel.basic_publish(exchange=s.exchange_name, routing_key=routing_key, body=body, properties=properties)
+                s.stats['published'] += 1
+                published = True
+            if published:
+                s.lock.notify_all()
+
+    def _on_confirm(s, frame):
+        method = frame.method
+        nacked = []
+        with s.lock:
+            if method.multiple:
+                tags = [tag for tag in s.unconfirmed if tag <= method.delivery_tag]
+            else:
+                tags = [method.delivery_tag]
+            for tag in tags:
+                message = s.unconfirmed.pop(tag, None)
+                if message is None:
+                    continue
+                if isinstance(method, pika.spec.Basic.Nack):
+                    nacked.append(message)
+                else:
+                    s.stats['confirmed'] += 1
+
+            # The broker refused these, try them again.
+            if len(nacked) > 0:
+                s.stats['nacked'] += len(nacked)
+                s.pending.extendleft(reversed(nacked))
+            s.lock.notify_all()
+        s._pump()
+
+
+# MsgQueueWorkerPool
+#
+class MsgQueueWorkerPool(object):
+    '''
+    Run listen_worker() handlers on a pool of threads, or processes, leaving
+    the connection thread free to keep heartbeats flowing through long
+    handlers and to keep up to prefetch_count messages in hand.
+
+    Completions are passed back to the connection thread with
+    add_callback_threadsafe, where the message is acknowledged.  Messages
+    with the same ordering key, by default their routing key, are handled
+    one at a time in delivery order; ordered may be False for no ordering or
+    a function of (method, payload) returning the key.  Handlers must not use
+    the channel they are passed.  Process pool handlers must be picklable
+    and only handler_function (payload only) is supported.
+
+    drain() stops consumption: the consumers are cancelled, messages held
+    but not yet started are returned to the broker and running handlers are
+    left to complete.  A handler exception also drains, the failed message
+    is returned to the broker and the exception is re-raised from
+    listen_start() once the pool is idle, as it would be inline.
+    '''
+
+    # __init__
+    #
+    def __init__(s, connection, workers=4, processes=False, ordered=True):
+        s.connection = connection
+        s.processes = processes
+        s.ordered = ordered
+        if processes:
+            s.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        else:
+            s.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='msgq-worker')
+
+        s.backlog = {}
+        s.running = 0
+        s.draining = False
+        s.failure = None
+
+    def _order_key(s, method, payload):
+        if s.ordered is True:
+            return method.routing_key
+        if s.ordered:
+            return s.ordered(method, payload)
+        return None
+
+    # submit
+    #
+    def submit(s, channel, method, properties, payload, handler_function, handler):
+        job = (channel, method, properties, payload, handler_function, handler)
+        if s.draining:
+            channel.basic_reject(method.delivery_tag, requeue=True)
+            return
+
+        # Wait behind any earlier message with the same key.
+        key = s._order_key(method, payload)
+        if key is not None:
+            if key in s.backlog:
+                s.backlog[key].append(job)
+                return
+            s.backlog[key] = collections.deque()
+        s._start(key, job)
+
+    @staticmethod
+    def _call(channel, method, properties, payload, handler_function, handler):
+        if handler_function is not None:
+            handler_function(payload)
+        if handler is not None:
+            handler(channel, method, properties, payload)
+
+    def _start(s, key, job):
+        (channel, method, properties, payload, handler_function, handler) = job
+        s.running += 1
+        if s.processes:
+            future = s.executor.submit(handler_function, payload)
+        else:
+            future = s.executor.submit(s._call, *job)
+        future.add_done_callback(functools.partial(s._complete, key, job))
+
+    def _complete(s, key, job, future):
+        # Worker side, hand over to the connection thread.  If the connection
+        # has gone the broker will redeliver the message.
+        try:
+            s.connection.add_callback_threadsafe(functools.partial(s._done, key, job, future))
+        except pika.exceptions.ConnectionWrongStateError:
+            pass
+
+    def _done(s, key, job, future):
+        (channel, method, properties, payload, handler_function, handler) = job
+        s.running -= 1
+
+        failure = future.exception()
+        if failure is None:
+            channel.basic_ack(method.delivery_tag)
+        else:
+            channel.basic_reject(method.delivery_tag, requeue=True)
+            if s.failure is None:
+                s.failure = failure
+            s.drain(channel)
+
+        backlog = s.backlog.get(key)
+        if backlog is not None:
+            if len(backlog) > 0:
+                s._start(key, backlog.popleft())
+            else:
+                del s.backlog[key]
+
+    # drain
+    #
+    def drain(s, channel):
+        if s.draining:
+            return
+        s.draining = True
+        channel.stop_consuming()
+        for key, backlog in s.backlog.items():
+            for job in backlog:
+                channel.basic_reject(job[1].delivery_tag, requeue=True)
+            backlog.clear()
+
+    # reset
+    #
+    def reset(s):
+        '''
+        Ready the pool for another listen_start(), raising any handler
+        failure which ended the last one.
+        '''
+        failure = s.failure
+        s.failure = None
+        s.draining = False
+        s.backlog = {}
+        if failure is not None:
+            raise failure
+
+    # shutdown
+    #
+    def shutdown(s):
+        s.executor.shutdown(wait=False)
+
 
 class MsgQueueCredentials(pika.PlainCredentials):
     pass
@@ -184,4 +626,49 @@ class MsgQueueCkct(MsgQueueService):
         kwargs.setdefault('service', 'ckct')
         super(MsgQueueCkct, s).__init__(**kwargs)
 
+
+if __name__ == '__main__':
+    # Benchmark publishing throughput against the in-process stand-in broker,
+    # which delays everything it sends by --latency to simulate the network.
+    import argparse
+    from ktl.msgq_stub import MsgQueueStubBroker
+
+    parser = argparse.ArgumentParser(description='MsgQueue publishing benchmark')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.001, help='simulated one way latency (seconds)')
+    parser.add_argument('--window', type=int, default=256)
+    args = parser.parse_args()
+
+    broker = MsgQueueStubBroker(latency=args.latency)
+    payload = {'key': 'dashboard.status', 'host': 'kernel01', 'status': 'ok' * 32}
+
+    def blocking():
+        mq = MsgQueue(**broker.parameters())
+        for nr in range(args.messages):
+            mq.publish('dashboard.status', payload)
+        mq.close()
+
+    def blocking_confirmed():
+        mq = MsgQueue(**broker.parameters())
+        mq.channel.confirm_delivery()
+        for nr in range(args.messages):
+            mq.publish('dashboard.status', payload)
+        mq.close()
+
+    def pipelined():
+        mq = MsgQueue(connect=False, **broker.parameters())
+        with mq.publisher(window=args.window) as publisher:
+            for nr in range(args.messages):
+                publisher.publish('dashboard.status', payload)
+
+    for name, func in (('blocking', blocking), ('blocking+confirms', blocking_confirmed), ('pipelined+confirms', pipelined)):
+        count = len(broker.published)
+        start = time()
+        func()
+        elapsed = time() - start
+        broker.wait_published(count + args.messages)
+        print("{:20} {:6d} messages {:7.3f}s {:9.1f} msg/s".format(name, len(broker.published) - count, elapsed, args.messages / elapsed))
+
+    broker.stop()
+
 # vi:set ts=4 sw=4 expandtab:
@@ -0,0 +1,517 @@
+#
+# msgq_stub -- an in-process stand-in for the RabbitMQ broker behind MsgQueue
+#
+# This speaks just enough AMQP 0-9-1 to let MsgQueue and MsgQueuePublisher
+# connect, declare their exchange, select publisher confirms, publish, and
+# consume from topic bound queues with prefetch and acks.  It is intended
+# for tests and benchmarks, not as a broker: nothing is persisted, there is
+# one implicit topic exchange namespace and errors are not reported.  Frames
+# are built and parsed with pika's own codec.
+#
+import collections
+import socket
+import threading
+from time import sleep, time
+
+from pika import frame, spec
+
+
+# topic_match
+#
+def topic_match(pattern, routing_key):
+    '''
+    Topic exchange matching, '*' matches one word and '#' zero or more.
+    '''
+    def match(words, keys):
+        if len(words) == 0:
+            return len(keys) == 0
+        if words[0] == '#':
+            return any(match(words[1:], keys[skip:]) for skip in range(len(keys) + 1))
+        if len(keys) == 0:
+            return False
+        return (words[0] == '*' or words[0] == keys[0]) and match(words[1:], keys[1:])
+    return match(pattern.split('.'), routing_key.split('.'))
+
+
+# MsgQueueStubConnection
+#
+class MsgQueueStubConnection:
+    '''
+    One client connection to the stub broker, served by its own reader
+    thread.  With latency set every frame we send is held back by that
+    many seconds, as if crossing a slow network, without limiting how many
+    frames may be in flight.
+    '''
+
+    # __init__
+    #
+    def __init__(s, broker, sock):
+        s.broker = broker
+        s.sock = sock
+        s.closed = False
+        s.confirming = {}
+        s.content = {}
+        s.channels = {}
+        s.outgoing = collections.deque()
+        s.outgoing_ready = threading.Condition()
+
+        s.reader = threading.Thread(target=s._read, name='msgq-stub-reader', daemon=True)
+        s.writer = None
+        if broker.latency > 0:
+            s.writer = threading.Thread(target=s._write, name='msgq-stub-writer', daemon=True)
+            s.writer.start()
+        s.reader.start()
+
+    # send
+    #
+    def send(s, *frames):
+        data = b''.join(f.marshal() for f in frames)
+        if s.writer is None:
+            try:
+                s.sock.sendall(data)
+            except OSError:
+                s.close()
+            return
+        with s.outgoing_ready:
+            s.outgoing.append((time() + s.broker.latency, data))
+            s.outgoing_ready.notify()
+
+    def _write(s):
+        while True:
+            with s.outgoing_ready:
+                while not s.closed and len(s.outgoing) == 0:
+                    s.outgoing_ready.wait()
+                if s.closed:
+                    return
+                (due, data) = s.outgoing.popleft()
+            delay = due - time()
+            if delay > 0:
+                sleep(delay)
+            try:
+                s.sock.sendall(data)
+            except OSError:
+                s.close()
+                return
+
+    # close
+    #
+    def close(s):
+        '''
+        Drop the connection without any closing handshake, as if the broker
+        had gone away.
+        '''
+        with s.outgoing_ready:
+            if s.closed:
+                return
+            s.closed = True
+            s.outgoing_ready.notify()
+        try:
+            s.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        s.sock.close()
+        s.broker._closed(s)
+
+    def _read(s):
+        # Like the real thing we give up on clients which miss heartbeats.
+        if s.broker.heartbeat > 0:
+            s.sock.settimeout(s.broker.heartbeat * 2)
+        data = b''
+        while not s.closed:
+            try:
+                chunk = s.sock.recv(65536)
+            except OSError:
+                break
+            if len(chunk) == 0:
+                break
+            data += chunk
+            while not s.closed:
+                (consumed, f) = frame.decode_frame(data)
+                if f is None:
+                    break
+                data = data[consumed:]
+                s._frame(f)
+        s.close()
+
+    def _frame(s, f):
+        if isinstance(f, frame.ProtocolHeader):
+            server_properties = {
+                'product': 'msgq-stub',
+                'capabilities': {
+                    'publisher_confirms': True,
+                    'basic.nack': True,
+                    'consumer_cancel_notify': True,
+                    'exchange_exchange_bindings': True,
+                    'connection.blocked': True,
+                    'authentication_failure_close': True,
+                    'per_consumer_qos': True,
+                },
+            }
+            s.send(frame.Method(0, spec.Connection.Start(server_properties=server_properties)))
+
+        elif isinstance(f, frame.Heartbeat):
+            s.send(frame.Heartbeat())
+
+        elif isinstance(f, frame.Method):
+            handler = getattr(s, '_method_' + f.method.NAME.replace('.', '_'), None)
+            if handler is not None:
+                handler(f.channel_number, f.method)
+
+        elif isinstance(f, frame.Header):
+            publish = s.content.get(f.channel_number)
+            if publish is not None:
+                publish['properties'] = f.properties
+                publish['size'] = f.body_size
+                if f.body_size == 0:
+                    s._published(f.channel_number)
+
+        elif isinstance(f, frame.Body):
+            publish = s.content.get(f.channel_number)
+            if publish is not None:
+                publish['body'] += f.fragment
+                if len(publish['body']) >= publish['size']:
+                    s._published(f.channel_number)
+
+    # Connection and channel handshakes.
+    def _method_Connection_StartOk(s, channel, method):
+        s.send(frame.Method(0, spec.Connection.Tune(channel_max=2047, frame_max=131072, heartbeat=s.broker.heartbeat)))
+
+    def _method_Connection_Open(s, channel, method):
+        s.send(frame.Method(0, spec.Connection.OpenOk()))
+
+    def _method_Connection_Close(s, channel, method):
+        s.send(frame.Method(0, spec.Connection.CloseOk()))
+
+    def _method_Connection_CloseOk(s, channel, method):
+        s.close()
+
+    def _method_Channel_Open(s, channel, method):
+        with s.broker.lock:
+            s.channels[channel] = {'prefetch': 0, 'delivery_tag': 0, 'unacked': collections.OrderedDict()}
+        s.send(frame.Method(channel, spec.Channel.OpenOk()))
+
+    def _method_Channel_Close(s, channel, method):
+        s.confirming.pop(channel, None)
+        s.content.pop(channel, None)
+        s.broker._channel_closed(s, channel)
+        s.send(frame.Method(channel, spec.Channel.CloseOk()))
+
+    def _method_Exchange_Declare(s, channel, method):
+        if not method.nowait:
+            s.send(frame.Method(channel, spec.Exchange.DeclareOk()))
+
+    def _method_Confirm_Select(s, channel, method):
+        s.confirming[channel] = 0
+        if not method.nowait:
+            s.send(frame.Method(channel, spec.Confirm.SelectOk()))
+
+    # Queues.
+    def _method_Queue_Declare(s, channel, method):
+        (queue, count, consumers) = s.broker._queue_declare(method.queue, method.auto_delete)
+        if not method.nowait:
+            s.send(frame.Method(channel, spec.Queue.DeclareOk(queue=queue, message_count=count, consumer_count=consumers)))
+
+    def _method_Queue_Bind(s, channel, method):
+        s.broker._queue_bind(method.queue, method.exchange, method.routing_key)
+        if not method.nowait:
+            s.send(frame.Method(channel, spec.Queue.BindOk()))
+
+    def _method_Queue_Delete(s, channel, method):
+        count = s.broker._queue_delete(method.queue)
+        if not method.nowait:
+            s.send(frame.Method(channel, spec.Queue.DeleteOk(message_count=count)))
+
+    # Consuming.
+    def _method_Basic_Qos(s, channel, method):
+        with s.broker.lock:
+            s.channels[channel]['prefetch'] = method.prefetch_count
+        s.send(frame.Method(channel, spec.Basic.QosOk()))
+
+    def _method_Basic_Consume(s, channel, method):
+        tag = s.broker._consume(s, channel, method.queue, method.consumer_tag, method.no_ack)
+        if not method.nowait:
+            s.send(frame.Method(channel, spec.Basic.ConsumeOk(consumer_tag=tag)))
+        s.broker._dispatch()
+
+    def _method_Basic_Cancel(s, channel, method):
+        s.broker._cancel(s, method.consumer_tag)
+        if not method.nowait:
+            s.send(frame.Method(channel, spec.Basic.CancelOk(consumer_tag=method.consumer_tag)))
+
+    def _method_Basic_Ack(s, channel, method):
+        s.broker._settle(s, channel, method.delivery_tag, method.multiple, None)
+
+    def _method_Basic_Nack(s, channel, method):
+        s.broker._settle(s, channel, method.delivery_tag, method.multiple, method.requeue)
+
+    def _method_Basic_Reject(s, channel, method):
+        s.broker._settle(s, channel, method.delivery_tag, False, method.requeue)
+
+    # deliver
+    #
+    def deliver(s, channel, tag, queue, message):
+        '''
+        Send message to one of our consumers, called with the broker lock
+        held.  Returns whether the channel could take it.
+        '''
+        state = s.channels.get(channel)
+        if state is None or (state['prefetch'] > 0 and len(state['unacked']) >= state['prefetch']):
+            return False
+        state['delivery_tag'] += 1
+        state['unacked'][state['delivery_tag']] = (queue, message)
+        s.send(frame.Method(channel, spec.Basic.Deliver(consumer_tag=tag, delivery_tag=state['delivery_tag'],
+                redelivered=message['redelivered'], exchange=message['exchange'], routing_key=message['routing_key'])),
+            frame.Header(channel, len(message['body']), message['properties']),
+            frame.Body(channel, message['body']))
+        return True
+
+    # Publishing.
+    def _method_Basic_Publish(s, channel, method):
+        s.content[channel] = {'method': method, 'properties': None, 'size': 0, 'body': b''}
+
+    def _published(s, channel):
+        publish = s.content.pop(channel)
+        method = publish['method']
+        nack = s.broker._publish(method.exchange, method.routing_key, publish['body'], publish['properties'])
+        if channel in s.confirming:
+            s.confirming[channel] += 1
+            if nack:
+                s.send(frame.Method(channel, spec.Basic.Nack(delivery_tag=s.confirming[channel])))
+            else:
+                s.send(frame.Method(channel, spec.Basic.Ack(delivery_tag=s.confirming[channel])))
+
+
+# MsgQueueStubBroker
+#
+class MsgQueueStubBroker:
+    '''
+    Listen on a local port and record everything published to us.  The
+    published list holds (exchange, routing_key, body, properties) for each
+    message in arrival order; those are also routed to any queues bound to
+    their exchange and delivered round robin to the queue's consumers.
+    drop() disconnects every client abruptly and nack may be set to a
+    function of (routing_key, body) returning True for messages which should
+    be refused.
+    '''
+
+    # __init__
+    #
+    def __init__(s, latency=0.0, heartbeat=0, port=0):
+        s.latency = latency
+        s.heartbeat = heartbeat
+        s.nack = None
+        s.published = []
+        s.connections = []
+        s.queues = {}
+        s.consumers = []
+        s.lock = threading.Condition()
+
+        s.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.listener.bind(('127.0.0.1', port))
+        s.listener.listen(16)
+        s.port = s.listener.getsockname()[1]
+
+        s.accepter = threading.Thread(target=s._accept, name='msgq-stub-accept', daemon=True)
+        s.accepter.start()
+
+    # parameters
+    #
+    def parameters(s):
+        '''
+        The MsgQueue keyword arguments needed to connect to us.
+        '''
+        return {'host': '127.0.0.1', 'port': s.port}
+
+    def _accept(s):
+        while True:
+            try:
+                (sock, addr) = s.listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with s.lock:
+                s.connections.append(MsgQueueStubConnection(s, sock))
+
+    def _closed(s, connection):
+        with s.lock:
+            if connection in s.connections:
+                s.connections.remove(connection)
+            for channel in list(connection.channels):
+                s._channel_closed(connection, channel)
+            s.lock.notify_all()
+
+    def _channel_closed(s, connection, channel):
+        # Anything the channel had not acknowledged goes back on its queue.
+        with s.lock:
+            s.consumers = [consumer for consumer in s.consumers
+                if consumer['connection'] is not connection or consumer['channel'] != channel]
+            state = connection.channels.pop(channel, None)
+            if state is not None:
+                for (queue, message) in reversed(state['unacked'].values()):
+                    s._requeue(queue, message)
+            s._dispatch()
+
+    def _publish(s, exchange, routing_key, body, properties):
+        with s.lock:
+            if s.nack is not None and s.nack(routing_key, body):
+                return True
+            s.published.append((exchange, routing_key, body, properties))
+            for name, queue in s.queues.items():
+                for (bound_exchange, pattern) in queue['bindings']:
+                    if bound_exchange == exchange and topic_match(pattern, routing_key):
+                        queue['messages'].append({'exchange': exchange, 'routing_key': routing_key,
+                            'body': body, 'properties': properties, 'redelivered': False})
+                        break
+            s._dispatch()
+            s.lock.notify_all()
+        return False
+
+    def _queue_declare(s, name, auto_delete):
+        with s.lock:
+            if name == '':
+                name = 'amq.gen-{}'.format(len(s.queues) + 1)
+            queue = s.queues.setdefault(name, {'messages': collections.deque(), 'bindings': set(), 'auto_delete': auto_delete})
+            consumers = len([consumer for consumer in s.consumers if consumer['queue'] == name])
+            return (name, len(queue['messages']), consumers)
+
+    def _queue_bind(s, name, exchange, pattern):
+        with s.lock:
+            s.queues[name]['bindings'].add((exchange, pattern))
+
+    def _queue_delete(s, name):
+        with s.lock:
+            queue = s.queues.pop(name, None)
+            return 0 if queue is None else len(queue['messages'])
+
+    def _consume(s, connection, channel, queue, tag, no_ack):
+        with s.lock:
+            if tag == '':
+                tag = 'ctag-{}'.format(id(connection) + len(s.consumers))
+            s.consumers.append({'connection': connection, 'channel': channel, 'queue': queue, 'tag': tag, 'no_ack': no_ack})
+        return tag
+
+    def _cancel(s, connection, tag):
+        with s.lock:
+            s.consumers = [consumer for consumer in s.consumers
+                if consumer['connection'] is not connection or consumer['tag'] != tag]
+            s._auto_delete()
+
+    def _auto_delete(s):
+        for name in list(s.queues):
+            if s.queues[name]['auto_delete'] and not any(consumer['queue'] == name for consumer in s.consumers):
+                del s.queues[name]
+
+    def _requeue(s, name, message):
+        queue = s.queues.get(name)
+        if queue is not None:
+            message['redelivered'] = True
+            queue['messages'].appendleft(message)
+
+    def _settle(s, connection, channel, delivery_tag, multiple, requeue):
+        # requeue is None for an ack.
+        with s.lock:
+            state = connection.channels.get(channel)
+            if state is None:
+                return
+            if multiple:
+                tags = [tag for tag in state['unacked'] if tag <= delivery_tag]
+            else:
+                tags = [delivery_tag]
+            settled = [state['unacked'].pop(tag) for tag in tags if tag in state['unacked']]
+            if requeue:
+                for (queue, message) in reversed(settled):
+                    s._requeue(queue, message)
+            s._dispatch()
+            s.lock.notify_all()
+
+    def _dispatch(s):
+        # Hand out ready messages round robin to consumers with room.
+        with s.lock:
+            progress = True
+            while progress:
+                progress = False
+                for consumer in list(s.consumers):
+                    queue = s.queues.get(consumer['queue'])
+                    if queue is None or len(queue['messages']) == 0:
+                        continue
+                    message = queue['messages'][0]
+                    connection = consumer['connection']
+                    if consumer['no_ack']:
+                        connection.send(frame.Method(consumer['channel'], spec.Basic.Deliver(consumer_tag=consumer['tag'], delivery_tag=1,
+                                redelivered=message['redelivered'], exchange=message['exchange'], routing_key=message['routing_key'])),
+                            frame.Header(consumer['channel'], len(message['body']), message['properties']),
+                            frame.Body(consumer['channel'], message['body']))
+                    elif not connection.deliver(consumer['channel'], consumer['tag'], consumer['queue'], message):
+                        continue
+                    queue['messages'].popleft()
+                    s.consumers.remove(consumer)
+                    s.consumers.append(consumer)
+                    progress = True
+
+    # queue_state
+    #
+    def queue_state(s, name):
+        '''
+        Return (ready, unacknowledged) message counts for a queue.
+        '''
+        with s.lock:
+            queue = s.queues.get(name)
+            ready = 0 if queue is None else len(queue['messages'])
+            unacked = 0
+            for connection in s.connections:
+                for state in connection.channels.values():
+                    unacked += len([entry for entry in state['unacked'].values() if entry[0] == name])
+            return (ready, unacked)
+
+    # wait_queue_state
+    #
+    def wait_queue_state(s, name, expected, timeout=10):
+        '''
+        Wait for queue_state() to reach expected, acknowledgements may still
+        be in flight when a client thinks it is done.  Returns the last
+        state seen.
+        '''
+        deadline = time() + timeout
+        with s.lock:
+            state = s.queue_state(name)
+            while state != expected and time() < deadline:
+                s.lock.wait(max(0, min(0.1, deadline - time())))
+                state = s.queue_state(name)
+        return state
+
+    # wait_published
+    #
+    def wait_published(s, count, timeout=10):
+        '''
+        Wait for at least count messages to have been published, returning
+        whether they were.
+        '''
+        deadline = time() + timeout
+        with s.lock:
+            while len(s.published) < count:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    return False
+                s.lock.wait(remaining)
+        return True
+
+    # drop
+    #
+    def drop(s):
+        with s.lock:
+            connections = list(s.connections)
+        for connection in connections:
+            connection.close()
+
+    # stop
+    #
+    def stop(s):
+        try:
+            s.listener.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        s.listener.close()
+        s.drop()
+
+# vi:set ts=4 sw=4 expandtab:
@@ -0,0 +1,109 @@
+#
+# swm_codec -- JSON encoding of datetimes in the swm status
+#
+# Datetimes are represented as { '_isoformat': datetime.isoformat() }.
+#
+from datetime import datetime
+
+
+def _datetime_decode_strptime(isoformat):
+    # XXX: before python 3.7 fromisoformat is not available, and %z only
+    # accepts offsets without the colon.
+    if len(isoformat) > 19 and isoformat[-6] in '+-' and isoformat[-3] == ':':
+        isoformat = isoformat[0:-3] + isoformat[-2:]
+    for fmt in (
+            '%Y-%m-%dT%H:%M:%S.%f%z',
+            '%Y-%m-%dT%H:%M:%S%z',
+            '%Y-%m-%dT%H:%M:%S.%f',
+            '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(isoformat, fmt)
+        except ValueError:
+            pass
+    raise ValueError("isoformat: {} invalid format".format(isoformat))
+
+
+_fromisoformat = getattr(datetime, 'fromisoformat', None)
+
+def datetime_decode(isoformat):
+    if _fromisoformat is not None:
+        try:
+            return _fromisoformat(isoformat)
+        except ValueError:
+            pass
+    return _datetime_decode_strptime(isoformat)
+
+
+def json_object_decode(obj):
+    # Encoded datetimes are the only single element objects with this key,
+    # everything else is returned untouched as quickly as possible.
+    if len(obj) != 1 or '_isoformat' not in obj:
+        return obj
+    return datetime_decode(obj['_isoformat'])
+
+
+def json_object_encode(obj):
+    if isinstance(obj, datetime):
+        return { '_isoformat': obj.isoformat() }
+    raise TypeError('Object of type %s with value of %s is not JSON serializable' % (type(obj), repr(obj)))
+
+
+def _json_object_decode_strptime(obj):
+    isoformat = obj.get('_isoformat')
+    if isoformat is not None:
+        obj = _datetime_decode_strptime(isoformat)
+    return obj
+
+
+if __name__ == '__main__':
+    # Benchmark decoding a synthetic status file against the original
+    # strptime based decoder.
+    import argparse
+    import json
+    from datetime import timedelta, timezone
+    from timeit import repeat
+
+    parser = argparse.ArgumentParser(description='benchmark swm status decoding')
+    parser.add_argument('--trackers', type=int, default=5000, help='number of synthetic trackers')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timing runs')
+    args = parser.parse_args()
+
+    base = datetime(2022, 1, 1, 0, 0, 0, 123456)
+    trackers = {}
+    for nr in range(args.trackers):
+        when = base + timedelta(minutes=nr)
+        trackers[str(1900000 + nr)] = {
+            'cycle': '2022.01.10-1',
+            'series': 'focal',
+            'source': 'linux-deriv-{}'.format(nr % 50),
+            'target': 'linux-deriv-{}'.format(nr % 50),
+            'master-bug': 1900000 + nr // 10,
+            'phase': 'Testing',
+            'reason': {
+                'automated-testing': 'Ongoing -- testing in progress',
+                'promote-to-proposed': 'Pending -- ready to copy',
+            },
+            'manager': {
+                'time-scanned': when,
+                'time-modified': when.replace(microsecond=0),
+            },
+            'versions': {'main': '5.4.0-{}.{}'.format(nr, nr)},
+            'task': {
+                'promote-to-proposed': {
+                    'status': 'Confirmed',
+                    'date': when.replace(tzinfo=timezone.utc),
+                },
+            },
+        }
+    data = json.dumps({'trackers': trackers}, default=json_object_encode, separators=(',', ':'))
+
+    if json.loads(data, object_hook=json_object_decode) != json.loads(data, object_hook=_json_object_decode_strptime):
+        raise SystemExit("decoders disagree")
+
+    print("trackers={} size={}KiB".format(args.trackers, len(data) // 1024))
+    for name, hook in (
+            ('none', None),
+            ('strptime', _json_object_decode_strptime),
+            ('codec', json_object_decode)):
+        best = min(repeat(lambda: json.loads(data, object_hook=hook), number=1, repeat=args.repeat))
+        print("{:10} {:8.1f}ms".format(name, best * 1000))
@@ -8,7 +8,8 @@ import argparse
 import json
 import os
 import sys
-from datetime import datetime
+
+from ktl.swm_codec import json_object_decode
 
 
 # SwmStatus
@@ -16,33 +17,14 @@ from datetime import datetime
 class SwmStatus:
     _url = 'https://kernel.ubuntu.com/~kernel-ppa/status/swm/status.json'
 
-    def _json_object_decode(self, obj):
-        isoformat = obj.get('_isoformat')
-        if isoformat is not None:
-            #return datetime.fromisoformat(isoformat)
-            # XXX: before python 3.6 fromisoformat is not available.
-            if isoformat[-3] == ':':
-                isoformat = isoformat[0:-3] + isoformat[-2:]
-            for fmt in (
-                    '%Y-%m-%dT%H:%M:%S.%f%z',
-                    '%Y-%m-%dT%H:%M:%S%z',
-                    '%Y-%m-%dT%H:%M:%S.%f',
-                    '%Y-%m-%dT%H:%M:%S'):
-                try:
-                    obj = datetime.strptime(isoformat, fmt)
-                    break
-                except ValueError:
-                    pass
-            else:
-                raise ValueError("isoformat: {} invalid format".format(isoformat))
-        return obj
-
     def __init__(self, url=None, path=None, data=None, use_local=False):
         if data is None and url is None:
             url = self._url
+        journal = None
         if data is None and path is not None and os.path.exists(path):
             with open(path) as sfd:
                 data = sfd.read()
+            journal = path + '.journal'
         if data is None and url is not None:
             response = urlopen(url)
             data = response.read()
@@ -50,13 +32,45 @@ class SwmStatus:
         if isinstance(data, bytes):
             data = data.decode('utf-8')
         if isinstance(data, str):
-            data = json.loads(data, object_hook=self._json_object_decode)
+            data = json.loads(data, object_hook=json_object_decode)
 
         if not isinstance(data, dict):
             raise ValueError("expecting to construct a dictionary")
 
         self._data = data
 
+        if journal is not None:
+            self._replay(journal)
+
+    # _replay
+    #
+    def _replay(self, journal):
+        '''
+        Apply the per-tracker updates journaled since status.json was last
+        written, see wfl.status_store.
+        '''
+        try:
+            with open(journal, 'rb') as jfd:
+                data = jfd.read()
+        except (IOError, OSError):
+            return
+
+        # Only complete records, a trailing partial one is still being written.
+        trackers = self.trackers
+        for line in data[:data.rfind(b'\n') + 1].split(b'\n'):
+            if len(line) == 0:
+                continue
+            try:
+                record = json.loads(line.decode('utf-8'), object_hook=json_object_decode)
+                bugid = record['tracker']
+                summary = record['status']
+            except (ValueError, KeyError, TypeError):
+                continue
+            if summary is None:
+                trackers.pop(bugid, None)
+            else:
+                trackers[bugid] = summary
+
     @property
     def trackers(self):
         return self._data.get('trackers', self._data)
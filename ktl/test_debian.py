@@ -0,0 +1,141 @@
+import os
+import sys
+import unittest
+from testfixtures       import TempDirectory
+
+# Run from here our debian.py would shadow python-debian's debian package.
+path = sys.path
+sys.path = [entry for entry in path if os.path.abspath(entry) != os.path.dirname(os.path.abspath(__file__))]
+from ktl.debian         import Debian, DebianChangelog, DebianChangelogParser, DebianError
+sys.path = path
+
+
+def changelog_text(versions):
+    text = ''
+    for version in versions:
+        upload = int(version.split('.')[-1])
+        text += 'linux ({}) focal; urgency=medium\n'.format(version)
+        text += '\n'
+        text += '  * change {} (LP: #{})\n'.format(upload, 1000 + upload)
+        text += '\n'
+        text += ' -- Kernel Team <kernel-team@lists.ubuntu.com>  Mon, 0{} Mar 2020 10:00:00 +0000\n'.format(upload)
+        text += '\n'
+    return text
+
+
+class TestDebianChangelog(unittest.TestCase):
+
+    versions = ['5.4.0-4.4', '5.4.0-3.3', '5.4.0-2.2', '5.4.0-1.1']
+
+    def setUp(self):
+        self.d = TempDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.d.path)
+        self.changelog_cache = Debian.changelog_cache
+        Debian.changelog_cache = {}
+
+        self.lines = changelog_text(self.versions).split('\n')
+        self.full = Debian.changelog_as_list(self.lines)
+
+    def tearDown(self):
+        Debian.changelog_cache = self.changelog_cache
+        os.chdir(self.cwd)
+        self.d.cleanup()
+
+    def lazy(self):
+        parser = DebianChangelogParser(Debian.changelog_sections(self.lines))
+        return (parser, DebianChangelog(parser))
+
+    def test_full_parse(self):
+        self.assertEqual([section['version'] for section in self.full], self.versions)
+        self.assertEqual(self.full[1]['bugs'], set(['1003']))
+
+    def test_lazy_equal(self):
+        (parser, changelog) = self.lazy()
+        self.assertEqual(changelog, self.full)
+        self.assertEqual(list(changelog), self.full)
+        self.assertEqual(len(changelog), len(self.full))
+
+    def test_lazy_parse(self):
+        (parser, changelog) = self.lazy()
+        self.assertTrue(changelog)
+        self.assertEqual(changelog[0], self.full[0])
+        # Only as far as needed, a section is complete once the next starts.
+        self.assertLess(len(parser.sections), len(self.full))
+
+        self.assertEqual(changelog[1:3], self.full[1:3])
+        self.assertLess(len(parser.sections), len(self.full))
+
+    def test_indexes(self):
+        (parser, changelog) = self.lazy()
+        self.assertEqual(changelog[-1], self.full[-1])
+        self.assertEqual(changelog[-2:], self.full[-2:])
+        self.assertEqual(changelog[:-1], self.full[:-1])
+        self.assertEqual(changelog[::2], self.full[::2])
+        with self.assertRaises(IndexError):
+            changelog[len(self.full)]
+
+    def test_pop(self):
+        (parser, changelog) = self.lazy()
+        self.assertEqual(changelog.pop(0), self.full[0])
+        self.assertEqual(changelog[0], self.full[1])
+        self.assertEqual(changelog[-1], self.full[-1])
+        self.assertEqual(len(changelog), 3)
+
+        self.assertEqual(changelog.pop(), self.full[-1])
+        self.assertEqual(changelog, self.full[1:3])
+
+        # Views sharing the parser are unaffected.
+        self.assertEqual(DebianChangelog(parser), self.full)
+
+    def test_empty(self):
+        changelog = DebianChangelog(DebianChangelogParser(iter([])))
+        self.assertFalse(changelog)
+        self.assertEqual(len(changelog), 0)
+        self.assertEqual(changelog[0:2], [])
+
+    def test_master_changelog_cache(self):
+        self.d.write('debian.master/changelog', changelog_text(self.versions).encode('utf-8'))
+        first = Debian.master_changelog()
+        self.assertEqual(first, self.full)
+        self.assertEqual(len(Debian.changelog_cache), 1)
+
+        # Unchanged, the parse is shared.
+        self.assertEqual(Debian.master_changelog(), self.full)
+        self.assertEqual(len(Debian.changelog_cache), 1)
+
+        # A new upload changes the file and so the key.
+        self.d.write('debian.master/changelog', changelog_text(['5.4.0-5.5'] + self.versions).encode('utf-8'))
+        changed = Debian.master_changelog()
+        self.assertEqual(changed[0]['version'], '5.4.0-5.5')
+        self.assertEqual(changed[1:], self.full)
+        self.assertEqual(len(Debian.changelog_cache), 2)
+
+        # As does one of the same size, by its mtime.
+        self.d.write('debian.master/changelog', changelog_text(['5.4.0-6.6'] + self.versions).encode('utf-8'))
+        os.utime('debian.master/changelog', (1, 1))
+        self.assertEqual(Debian.master_changelog()[0]['version'], '5.4.0-6.6')
+
+    def test_cache_bounded(self):
+        for nr in range(Debian.changelog_cache_max + 4):
+            Debian.changelog_cached(('blob', str(nr)), lambda: self.lines)
+        self.assertEqual(len(Debian.changelog_cache), Debian.changelog_cache_max)
+        self.assertNotIn(('blob', '0'), Debian.changelog_cache)
+
+        # The same blob shares its parse.
+        parsed = []
+
+        def contents():
+            parsed.append(True)
+            return self.lines
+        Debian.changelog_cached(('blob', 'x'), contents)[0]
+        Debian.changelog_cached(('blob', 'x'), contents)[0]
+        self.assertEqual(parsed, [True])
+
+    def test_not_a_changelog(self):
+        with self.assertRaises(DebianError):
+            Debian.changelog_cached(('blob', 'bad'), lambda: ['not a version line'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import subprocess
+import unittest
+from testfixtures       import TempDirectory
+
+from ktl.git            import Git, GitBatch, GitError
+
+
+class TestGitBatch(unittest.TestCase):
+
+    def git(self, *args):
+        env = dict(os.environ,
+                   GIT_AUTHOR_NAME='Test', GIT_AUTHOR_EMAIL='test@example.com',
+                   GIT_COMMITTER_NAME='Test', GIT_COMMITTER_EMAIL='test@example.com')
+        result = subprocess.run(['git'] + list(args), cwd=self.d.path, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        return result.stdout.decode('utf-8').strip()
+
+    def setUp(self):
+        self.d = TempDirectory()
+        self.git('init', '-q')
+        self.git('checkout', '-q', '-b', 'main')
+        self.d.write('README', b'line one\nline two\n')
+        self.git('add', 'README')
+        self.git('commit', '-q', '-m', 'UBUNTU: Ubuntu-5.4.0-1.1\n\nBody text.')
+        self.git('tag', 'Ubuntu-5.4.0-1.1')
+        self.cwd = os.getcwd()
+        os.chdir(self.d.path)
+        Git.batch = True
+
+    def tearDown(self):
+        Git.batch = False
+        os.chdir(self.cwd)
+        GitBatch.close_all()
+        self.d.cleanup()
+
+    def test_read(self):
+        batch = GitBatch.get(self.d.path)
+
+        (sha1, kind, content) = batch.read('HEAD:README')
+        self.assertEqual(kind, 'blob')
+        self.assertEqual(content, b'line one\nline two\n')
+        self.assertIsNone(batch.read('HEAD:MISSING'))
+        self.assertEqual(batch.check('HEAD')[1], 'commit')
+
+    def test_rev_parse_fresh(self):
+        batch = GitBatch.get(self.d.path)
+        first = batch.rev_parse('refs/heads/main')
+
+        self.git('commit', '-q', '--allow-empty', '-m', 'second')
+        self.assertNotEqual(batch.rev_parse('refs/heads/main'), first)
+        self.assertEqual(batch.rev_parse('refs/heads/main'), self.git('rev-parse', 'HEAD'))
+
+    def test_refs_invalidate(self):
+        batch = GitBatch.get(self.d.path)
+        self.assertEqual(list(batch.refs('refs/heads/')), ['refs/heads/main'])
+
+        self.git('branch', 'other')
+        self.assertEqual(list(batch.refs('refs/heads/')), ['refs/heads/main'])
+        batch.invalidate()
+        self.assertEqual(sorted(batch.refs('refs/heads/')), ['refs/heads/main', 'refs/heads/other'])
+
+    def test_git_api(self):
+        self.assertEqual(Git.branches(), ['main'])
+        self.assertEqual(Git.tags(), ['Ubuntu-5.4.0-1.1'])
+        self.assertEqual(Git.current_branch(), 'main')
+        self.assertEqual(Git.current_commit(), self.git('rev-parse', 'HEAD'))
+        self.assertEqual(Git.subject('HEAD'), 'UBUNTU: Ubuntu-5.4.0-1.1')
+        self.assertEqual(Git.show('README', branch='HEAD'), ['line one', 'line two'])
+        with self.assertRaises(GitError):
+            Git.show('MISSING', branch='HEAD')
+
+    def test_git_api_matches_fork(self):
+        batched = (Git.branches(), Git.current_branch(), Git.current_commit(),
+                   Git.subject('HEAD'), Git.show('README', branch='HEAD'))
+        Git.batch = False
+        forked = (Git.branches(), Git.current_branch(), Git.current_commit(),
+                  Git.subject('HEAD'), Git.show('README', branch='HEAD'))
+        self.assertEqual(batched, forked)
+
+
+if __name__ == '__main__':
+    unittest.main()
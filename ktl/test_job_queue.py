@@ -0,0 +1,259 @@
+import os
+import threading
+import unittest
+from testfixtures       import TempDirectory
+from time               import sleep, time
+
+from ktl.job_queue      import JobQueue, JobQueueError, JobQueueWorkers
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.d = TempDirectory()
+        self.queue = JobQueue(self.d.path)
+
+    def tearDown(self):
+        self.d.cleanup()
+
+    def test_priority_order(self):
+        # As written by the shell queue.
+        self.d.write('C.1000.mainline.aaaaaaaa.Q', b'job c\n')
+        self.d.write('A.1002.mainline.bbbbbbbb.Q', b'job a2\n')
+        self.d.write('A.1001.mainline.cccccccc.Q', b'job a1\n')
+        self.d.write('A.1000.other.dddddddd.Q', b'job other\n')
+        self.queue.enqueue('mainline', 'B', ['job', 'b'])
+
+        picked = []
+        for who in ('w1', 'w2', 'w3', 'w4'):
+            (entry, command) = self.queue.pick(who, 'mainline')
+            self.assertEqual(self.d.read(who + '.O', encoding='utf-8'), entry + '\nleased\n')
+            picked.append(command)
+        self.assertEqual(picked, ['job a1\n', 'job a2\n', 'job b\n', 'job c\n'])
+        self.assertIsNone(self.queue.pick('w5', 'mainline'))
+
+    def test_pick_complete(self):
+        entry = self.queue.enqueue('mainline', 'A', ['cod-queue-runner', 'x'])
+        self.assertEqual(self.queue.listing(), [(entry, 'cod-queue-runner x')])
+
+        (rentry, command) = self.queue.pick('w1', 'mainline')
+        self.assertEqual(rentry, entry[:-2] + '.R')
+        with self.assertRaises(JobQueueError):
+            self.queue.pick('w1', 'mainline')
+
+        self.assertEqual(self.queue.complete(['w1', 'w2']), ['w2'])
+        self.assertEqual(os.listdir(self.d.path), [])
+
+    def test_lease(self):
+        self.queue.enqueue('mainline', 'A', ['job'])
+        (entry, command) = self.queue.pick('w1', 'mainline')
+        self.assertEqual(self.queue.renew(['w1']), [])
+        self.assertEqual(self.queue.recover(), [])
+
+        past = time() - 1000
+        os.utime(self.d.getpath('w1.O'), (past, past))
+        self.assertEqual(self.queue.recover(lease=900), [])
+        # The job itself was only just picked.
+        self.assertEqual(self.queue.recover(lease=-1), [entry[:-2] + '.Q'])
+
+        self.assertEqual(self.queue.renew(['w1']), ['w1'])
+        self.assertEqual(self.queue.complete(['w1']), ['w1'])
+        self.assertEqual(self.queue.pick('w2', 'mainline'), (entry, command))
+
+    def test_unleased(self):
+        # Old runners never renew, their jobs must not be taken from them.
+        self.queue.enqueue('mainline', 'A', ['job'])
+        (entry, command) = self.queue.pick('w1', 'mainline', leased=False)
+        self.assertEqual(self.d.read('w1.O', encoding='utf-8'), entry + '\n')
+
+        past = time() - 100000
+        os.utime(self.d.getpath('w1.O'), (past, past))
+        self.assertEqual(self.queue.recover(lease=-1), [])
+        self.assertIsNone(self.queue.metrics()['running'][0]['lease'])
+        self.assertEqual(self.queue.complete(['w1']), [])
+        self.assertEqual(os.listdir(self.d.path), [])
+
+    def test_recover_orphans(self):
+        self.d.write('A.1000.mainline.aaaaaaaa.R', b'job\n')
+        self.d.write('A.1000.mainline.bbbbbbbb.N', b'jo')
+        self.assertEqual(self.queue.recover(), [])
+        self.assertEqual(self.queue.recover(lease=-1), ['A.1000.mainline.aaaaaaaa.Q'])
+        self.assertEqual(sorted(os.listdir(self.d.path)), ['A.1000.mainline.aaaaaaaa.Q'])
+
+    def test_metrics(self):
+        self.d.write('A.1000.mainline.aaaaaaaa.Q', b'job\n')
+        self.d.write('A.1010.mainline.bbbbbbbb.Q', b'job\n')
+        self.d.write('C.1020.mainline.cccccccc.Q', b'job\n')
+        self.d.write('B.1030.other.dddddddd.Q', b'job\n')
+        self.queue.pick('w1', 'other')
+
+        metrics = self.queue.metrics(now=2000)
+        self.assertEqual(metrics['queued'], {'mainline': {'depth': {'A': 2, 'C': 1}, 'oldest': 1000}})
+        self.assertEqual([(job['who'], job['entry']) for job in metrics['running']], [('w1', 'B.1030.other.dddddddd.R')])
+
+
+class TestJobQueueWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.d = TempDirectory()
+        self.queue = JobQueue(self.d.path)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.concurrency = 0
+        self.ran = []
+        self.published = []
+
+    def tearDown(self):
+        self.d.cleanup()
+
+    def run_job(self, who, entry, command):
+        with self.lock:
+            self.running += 1
+            self.concurrency = max(self.concurrency, self.running)
+        sleep(0.1)
+        with self.lock:
+            self.running -= 1
+            self.ran.append(command.strip())
+        return 0
+
+    def publish(self, entries):
+        # Nothing may be running while we publish.
+        self.assertEqual(self.running, 0)
+        self.published.append(sorted(entries))
+        return True
+
+    def test_parallel(self):
+        for nr in range(8):
+            self.queue.enqueue('mainline', 'A', ['job', str(nr)])
+
+        workers = JobQueueWorkers(self.queue, 'mainline', self.run_job, self.publish, workers=4)
+        stats = workers.run()
+
+        self.assertEqual(sorted(self.ran), sorted('job {}'.format(nr) for nr in range(8)))
+        self.assertEqual(self.concurrency, 4)
+        self.assertEqual(stats['jobs'], 8)
+        self.assertEqual(sum(len(batch) for batch in self.published), 8)
+        self.assertLess(len(self.published), 8)
+        self.assertEqual(os.listdir(self.d.path), [])
+
+    def test_areas(self):
+        # Concurrent jobs never share a work area.
+        busy = set()
+        used = []
+
+        def run_job(who, entry, command, area):
+            with self.lock:
+                self.assertNotIn(area, busy)
+                busy.add(area)
+                used.append(area)
+            sleep(0.1)
+            with self.lock:
+                busy.remove(area)
+            return 0
+
+        for nr in range(6):
+            self.queue.enqueue('mainline', 'A', ['job', str(nr)])
+        workers = JobQueueWorkers(self.queue, 'mainline', run_job, self.publish, workers=3, areas=['a', 'b', 'c'])
+        stats = workers.run()
+        self.assertEqual(stats['jobs'], 6)
+        self.assertEqual(sorted(set(used)), ['a', 'b', 'c'])
+
+        with self.assertRaises(ValueError):
+            JobQueueWorkers(self.queue, 'mainline', run_job, self.publish, workers=3, areas=['a'])
+
+    def test_publish_delay(self):
+        # With no delay each finished job holds off new ones until it is
+        # published.
+        for nr in range(4):
+            self.queue.enqueue('mainline', 'A', ['job', str(nr)])
+
+        workers = JobQueueWorkers(self.queue, 'mainline', self.run_job, self.publish, workers=2, publish_delay=0)
+        workers.run()
+        self.assertEqual(sum(len(batch) for batch in self.published), 4)
+        self.assertEqual(os.listdir(self.d.path), [])
+
+    def test_publish_each(self):
+        # A single worker publishes each job before it starts the next,
+        # however long the publish_delay.
+        events = []
+
+        def run_job(who, entry, command):
+            events.append(command.strip())
+            return self.run_job(who, entry, command)
+
+        def publish(entries):
+            events.append('publish')
+            return self.publish(entries)
+
+        for nr in range(3):
+            self.queue.enqueue('mainline', 'A', ['job', str(nr)])
+        workers = JobQueueWorkers(self.queue, 'mainline', run_job, publish, workers=1, publish_delay=300)
+        stats = workers.run()
+        self.assertEqual(events[1::2], ['publish'] * 3)
+        self.assertEqual(sorted(events[0::2]), ['job 0', 'job 1', 'job 2'])
+        self.assertEqual(stats['batches'], 3)
+
+    def test_publish_retry(self):
+        self.queue.enqueue('mainline', 'A', ['job'])
+        attempts = []
+
+        def publish(entries):
+            attempts.append(entries)
+            return len(attempts) > 1
+
+        workers = JobQueueWorkers(self.queue, 'mainline', self.run_job, publish, workers=1, publish_delay=0.1)
+        stats = workers.run()
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual((stats['publish-failed'], stats['batches']), (1, 1))
+        self.assertEqual(os.listdir(self.d.path), [])
+
+    def test_publish_gives_up(self):
+        self.queue.enqueue('mainline', 'A', ['job'])
+
+        workers = JobQueueWorkers(self.queue, 'mainline', self.run_job, lambda entries: False, workers=1, publish_delay=0.01, publish_retries=2)
+        stats = workers.run()
+        self.assertEqual(stats['publish-failed'], 2)
+        self.assertEqual(os.listdir(self.d.path), [])
+
+    def test_renew(self):
+        self.queue.enqueue('mainline', 'A', ['job'])
+        renewed = []
+
+        def run_job(who, entry, command):
+            past = time() - 1000
+            os.utime(self.d.getpath(who + '.O'), (past, past))
+            sleep(0.3)
+            renewed.append(os.stat(self.d.getpath(who + '.O')).st_mtime > past)
+            return 1
+
+        workers = JobQueueWorkers(self.queue, 'mainline', run_job, self.publish, workers=1, renew_interval=0.05)
+        stats = workers.run()
+        self.assertEqual(renewed, [True])
+        self.assertEqual(stats['failed'], 1)
+
+    def test_renew_interval(self):
+        # Jobs coming and going do not renew the leases early.
+        renewed = []
+
+        class Queue:
+            def pick(queue, who, which):
+                return self.queue.pick(who, which)
+
+            def renew(queue, whos):
+                renewed.append(whos)
+                return self.queue.renew(whos)
+
+            def complete(queue, whos):
+                return self.queue.complete(whos)
+
+        for nr in range(8):
+            self.queue.enqueue('mainline', 'A', ['job', str(nr)])
+        workers = JobQueueWorkers(Queue(), 'mainline', self.run_job, self.publish, workers=2, renew_interval=0.25)
+        stats = workers.run()
+        self.assertEqual(stats['jobs'], 8)
+        self.assertEqual(stats['lost'], 0)
+        self.assertLessEqual(len(renewed), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import os
 import sys
 import unittest
 from testfixtures       import TempDirectory
@@ -3097,5 +3098,152 @@ class TestKernelRoutingEntry(TestKernelSeriesCore):
         self.assertFalse(source.private)
 
 
+
+class TestKernelSeriesIndexes(TestKernelSeriesCore):
+
+    data_yaml = """
+    defaults:
+        routing-table:
+            default:
+                build:
+                    - ['ppa:canonical-kernel-team/ubuntu/ppa', 'Release' ]
+                updates:
+                    - ['ubuntu', 'Updates' ]
+            signing:
+                build:
+                    - ['ppa:canonical-signing/ubuntu/ppa', 'Release' ]
+    '18.04':
+        codename: bionic
+        sources:
+            linux:
+                packages:
+                    linux:
+                    linux-meta:
+                        type: meta
+                snaps:
+                    pc-kernel:
+            linux-aws:
+                derived-from: [ '18.04', 'linux' ]
+                routing: signing
+                packages:
+                    linux-aws:
+                    linux-meta-aws:
+                        type: meta
+    '16.04':
+        codename: xenial
+        sources:
+            linux:
+                packages:
+                    linux:
+                snaps:
+                    pc-kernel:
+            linux-hwe:
+                derived-from: [ '18.04', 'linux' ]
+                routing:
+    """
+
+    def test_lookup_package_entries(self):
+        ks = KernelSeries(data=self.data_yaml)
+
+        packages = ks.lookup_package_entries('linux')
+        self.assertItemsEqual([str(package.source) for package in packages], ['18.04 linux', '16.04 linux'])
+        for package in packages:
+            self.assertTrue(isinstance(package, KernelPackageEntry))
+        self.assertIs(ks.lookup_package_entries('linux-meta')[0],
+                      ks.lookup_series('18.04').lookup_source('linux').lookup_package('linux-meta'))
+        self.assertEqual(ks.lookup_package_entries('linux-unknown'), [])
+
+    def test_lookup_snap_entries(self):
+        ks = KernelSeries(data=self.data_yaml)
+
+        snaps = ks.lookup_snap_entries('pc-kernel')
+        self.assertItemsEqual([str(snap) for snap in snaps], ['18.04 linux pc-kernel', '16.04 linux pc-kernel'])
+        self.assertEqual(ks.lookup_snap_entries('unknown-kernel'), [])
+
+    def test_lookup_derivatives(self):
+        ks = KernelSeries(data=self.data_yaml)
+
+        source = ks.lookup_series('18.04').lookup_source('linux')
+        derivatives = ks.lookup_derivatives(source)
+        self.assertItemsEqual([str(derivative) for derivative in derivatives], ['18.04 linux-aws', '16.04 linux-hwe'])
+        for derivative in derivatives:
+            self.assertEqual(derivative.derived_from, source)
+        self.assertEqual(ks.lookup_derivatives(derivatives[0]), [])
+
+    def test_lookup_routed_sources(self):
+        ks = KernelSeries(data=self.data_yaml)
+
+        sources = ks.lookup_routed_sources('ppa:canonical-kernel-team/ubuntu/ppa')
+        self.assertItemsEqual([str(source) for source in sources], ['18.04 linux', '16.04 linux'])
+        sources = ks.lookup_routed_sources('ppa:canonical-signing/ubuntu/ppa')
+        self.assertEqual([str(source) for source in sources], ['18.04 linux-aws'])
+        self.assertEqual(ks.lookup_routed_sources('ppa:unknown/ubuntu/ppa'), [])
+
+
+class TestKernelSeriesCompiled(TestKernelSeriesCore):
+
+    data_yaml = """
+    '18.04':
+        codename: bionic
+        sources:
+            linux:
+                packages:
+                    linux:
+                    linux-meta:
+                snaps:
+                    pc-kernel:
+    """
+
+    def setUp(self):
+        self.cache_dir = KernelSeries._cache_dir
+        KernelSeries._data_compiled.clear()
+
+    def tearDown(self):
+        KernelSeries._cache_dir = self.cache_dir
+        KernelSeries._data_compiled.clear()
+
+    def test_interned_entries(self):
+        KernelSeries._cache_dir = None
+        ks = KernelSeries(data=self.data_yaml)
+
+        series = ks.lookup_series('18.04')
+        self.assertIs(series, ks.lookup_series(codename='bionic'))
+        self.assertIs(series, ks.series[0])
+        source = series.lookup_source('linux')
+        self.assertIs(source, series.sources[0])
+        self.assertIs(source.lookup_package('linux-meta'), source.packages[1])
+        self.assertIs(source.lookup_snap('pc-kernel'), source.snaps[0])
+
+    def test_instances_independent(self):
+        KernelSeries._cache_dir = None
+        ks1 = KernelSeries(data=self.data_yaml)
+        ks2 = KernelSeries(data=self.data_yaml)
+
+        snap = ks1.lookup_series('18.04').lookup_source('linux').lookup_snap('pc-kernel')
+        self.assertEqual(snap.promote_to, ['edge'])
+        self.assertNotIn('promote-to', ks2._data['18.04']['sources']['linux']['snaps']['pc-kernel'] or {})
+
+    def test_disk_cache(self):
+        with TempDirectory() as d:
+            KernelSeries._cache_dir = d.path
+            KernelSeries(data=self.data_yaml)
+            self.assertEqual(len(os.listdir(d.path)), 1)
+
+            KernelSeries._data_compiled.clear()
+            ks = KernelSeries(data=self.data_yaml)
+            self.assertEqual(ks.lookup_series('18.04').codename, 'bionic')
+
+    def test_disk_cache_corrupt(self):
+        with TempDirectory() as d:
+            KernelSeries._cache_dir = d.path
+            KernelSeries(data=self.data_yaml)
+            for name in os.listdir(d.path):
+                d.write(name, b'garbage')
+
+            KernelSeries._data_compiled.clear()
+            ks = KernelSeries(data=self.data_yaml)
+            self.assertEqual(ks.lookup_series('18.04').codename, 'bionic')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import unittest
+from testfixtures       import TempDirectory
+from time               import sleep, time
+
+from ktl.msgq           import MsgQueue
+from ktl.msgq_stub      import MsgQueueStubBroker, topic_match
+
+
+def touch_handler(payload):
+    # Process pool handlers must be importable.
+    with open(payload['path'], 'w') as wfd:
+        wfd.write(str(os.getpid()))
+
+
+class TestMsgQueuePublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = MsgQueueStubBroker()
+        self.brokers = [self.broker]
+
+    def tearDown(self):
+        for broker in self.brokers:
+            broker.stop()
+
+    def publisher(self, **kwargs):
+        mq = MsgQueue(exchange='test', connect=False, connection_attempts=1, **self.broker.parameters())
+        kwargs.setdefault('backoff_initial', 0.05)
+        kwargs.setdefault('backoff_max', 0.2)
+        return mq.publisher(**kwargs)
+
+    def received(self, broker=None):
+        broker = self.broker if broker is None else broker
+        return [json.loads(body)['nr'] for exchange, key, body, properties in broker.published]
+
+    def test_publish_order(self):
+        with self.publisher(window=8) as publisher:
+            for nr in range(100):
+                publisher.publish('test.key', {'nr': nr})
+            publisher.publish_batch([('test.key', {'nr': nr}, 3) for nr in range(100, 110)])
+
+        self.assertEqual(self.received(), list(range(110)))
+        (exchange, key, body, properties) = self.broker.published[-1]
+        self.assertEqual((exchange, key, properties.delivery_mode, properties.priority), ('test', 'test.key', 2, 3))
+        self.assertEqual(publisher.stats['confirmed'], 110)
+
+    def test_flush(self):
+        publisher = self.publisher()
+        for nr in range(10):
+            publisher.publish('test.key', {'nr': nr})
+        self.assertTrue(publisher.flush(timeout=10))
+        self.assertEqual(self.received(), list(range(10)))
+        self.assertTrue(publisher.close())
+
+        with self.assertRaises(ValueError):
+            publisher.publish('test.key', {'nr': 10})
+
+    def test_reconnect(self):
+        with self.publisher(window=4) as publisher:
+            for nr in range(20):
+                publisher.publish('test.key', {'nr': nr})
+            self.assertTrue(self.broker.wait_published(5))
+            self.broker.drop()
+            for nr in range(20, 40):
+                publisher.publish('test.key', {'nr': nr})
+
+        # Delivery is at least once, unconfirmed messages may be repeated.
+        received = self.received()
+        self.assertEqual(set(received), set(range(40)))
+        self.assertEqual(sorted(set(received), key=received.index), list(range(40)))
+
+    def test_nack(self):
+        refused = set()
+
+        def nack(key, body):
+            nr = json.loads(body)['nr']
+            if nr % 3 == 0 and nr not in refused:
+                refused.add(nr)
+                return True
+            return False
+        self.broker.nack = nack
+
+        with self.publisher() as publisher:
+            for nr in range(30):
+                publisher.publish('test.key', {'nr': nr})
+
+        self.assertEqual(sorted(self.received()), list(range(30)))
+        self.assertEqual(publisher.stats['nacked'], 10)
+
+    def test_broker_away(self):
+        port = self.broker.port
+        publisher = self.publisher()
+        self.broker.stop()
+
+        for nr in range(50):
+            publisher.publish('test.key', {'nr': nr})
+        sleep(0.3)
+        self.assertFalse(publisher.flush(timeout=0.1))
+
+        broker = MsgQueueStubBroker(port=port)
+        self.brokers.append(broker)
+        self.assertTrue(publisher.close(timeout=30))
+        self.assertEqual(self.received(broker), list(range(50)))
+        self.assertGreater(publisher.stats['reconnects'], 0)
+
+    def test_close_timeout(self):
+        publisher = self.publisher()
+        self.broker.stop()
+
+        publisher.publish('test.key', {'nr': 0})
+        self.assertFalse(publisher.close(timeout=0.2))
+
+
+class TestMsgQueueWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = MsgQueueStubBroker(heartbeat=1)
+        self.mq = MsgQueue(exchange='test', **self.broker.parameters())
+        self.lock = threading.Lock()
+        self.handled = []
+        self.running = 0
+        self.concurrency = 0
+
+    def tearDown(self):
+        self.mq.close()
+        self.broker.stop()
+
+    def handler(self, delay=0.0, stop_after=None, fail=None):
+        def handler(channel, method, properties, payload):
+            with self.lock:
+                self.running += 1
+                self.concurrency = max(self.concurrency, self.running)
+            sleep(delay)
+            if payload['nr'] == fail:
+                raise ValueError('handler failed')
+            with self.lock:
+                self.running -= 1
+                self.handled.append((method.routing_key, payload['nr']))
+                if len(self.handled) == stop_after:
+                    self.mq.listen_stop()
+        return handler
+
+    def publish(self, keys, count):
+        for nr in range(count):
+            self.mq.publish(keys[nr % len(keys)], {'nr': nr})
+
+    def test_topic_match(self):
+        self.assertTrue(topic_match('test.#', 'test'))
+        self.assertTrue(topic_match('test.#', 'test.a.b'))
+        self.assertTrue(topic_match('*.a', 'test.a'))
+        self.assertFalse(topic_match('*.a', 'test.a.b'))
+        self.assertFalse(topic_match('test.b', 'test.a'))
+
+    def test_parallel(self):
+        self.mq.listen_pool(workers=4, ordered=False)
+        self.mq.listen_worker('work', 'test.#', handler=self.handler(delay=0.2, stop_after=8), prefetch_count=8)
+        self.publish(['test.a'], 8)
+
+        start = time()
+        self.mq.listen_start()
+        self.assertLess(time() - start, 1.2)
+        self.assertEqual(sorted(nr for key, nr in self.handled), list(range(8)))
+        self.assertEqual(self.concurrency, 4)
+        self.assertEqual(self.broker.wait_queue_state('work', (0, 0)), (0, 0))
+
+    def test_ordered(self):
+        self.mq.listen_pool(workers=4)
+        self.mq.listen_worker('work', 'test.#', handler=self.handler(delay=0.05, stop_after=12), prefetch_count=12)
+        self.publish(['test.a', 'test.b', 'test.c'], 12)
+
+        self.mq.listen_start()
+        for key in ('test.a', 'test.b', 'test.c'):
+            handled = [nr for handled_key, nr in self.handled if handled_key == key]
+            self.assertEqual(handled, sorted(handled))
+            self.assertEqual(len(handled), 4)
+        self.assertGreater(self.concurrency, 1)
+        self.assertEqual(self.broker.wait_queue_state('work', (0, 0)), (0, 0))
+
+    def test_drain(self):
+        # The first handler stops us, the messages waiting behind it go back.
+        self.mq.listen_pool(workers=4)
+        self.mq.listen_worker('work', 'test.#', handler=self.handler(delay=0.2, stop_after=1), prefetch_count=10)
+        self.publish(['test.a'], 10)
+
+        self.mq.listen_start()
+        self.assertEqual(self.handled, [('test.a', 0)])
+        self.assertEqual(self.broker.wait_queue_state('work', (9, 0)), (9, 0))
+
+    def test_failure(self):
+        self.mq.listen_pool(workers=2)
+        self.mq.listen_worker('work', 'test.#', handler=self.handler(fail=2), prefetch_count=4)
+        self.publish(['test.a'], 4)
+
+        with self.assertRaises(ValueError):
+            self.mq.listen_start()
+        self.assertEqual(self.handled, [('test.a', 0), ('test.a', 1)])
+        self.assertEqual(self.broker.wait_queue_state('work', (2, 0)), (2, 0))
+
+    def test_heartbeat(self):
+        # The broker drops us if we miss heartbeats for two seconds.
+        self.mq.listen_pool(workers=1)
+        self.mq.listen_worker('work', 'test.#', handler=self.handler(delay=3, stop_after=1))
+        self.publish(['test.a'], 1)
+
+        self.mq.listen_start()
+        self.assertEqual(self.handled, [('test.a', 0)])
+        self.assertEqual(self.broker.wait_queue_state('work', (0, 0)), (0, 0))
+
+    def test_handler_acks(self):
+        # Acknowledge in batches of three, the last message is left held.
+        def handler(channel, method, properties, payload):
+            self.handled.append(payload['nr'])
+            if len(self.handled) % 3 == 0:
+                channel.basic_ack(method.delivery_tag, multiple=True)
+            if len(self.handled) == 7:
+                self.mq.listen_stop()
+
+        self.mq.listen_worker('work', 'test.#', handler=handler, prefetch_count=8, handler_acks=True)
+        self.publish(['test.a'], 7)
+
+        self.mq.listen_start()
+        self.assertEqual(self.handled, list(range(7)))
+        self.assertEqual(self.broker.wait_queue_state('work', (0, 1)), (0, 1))
+
+        self.mq.listen_pool(workers=2)
+        with self.assertRaises(ValueError):
+            self.mq.listen_worker('other', 'test.#', handler=handler, handler_acks=True)
+
+    def test_processes(self):
+        with TempDirectory() as d:
+            self.mq.listen_pool(workers=2, processes=True, ordered=False)
+            self.mq.listen_worker('work', 'test.#', handler_function=touch_handler, prefetch_count=4)
+            for nr in range(4):
+                self.mq.publish('test.a', {'path': d.getpath(str(nr))})
+
+            while len(os.listdir(d.path)) < 4:
+                self.mq.connection.process_data_events(time_limit=0.1)
+            self.mq.listen_stop()
+            self.mq.listen_start()
+
+            self.assertNotIn(str(os.getpid()), [d.read(str(nr), encoding='utf-8') for nr in range(4)])
+            self.assertEqual(self.broker.wait_queue_state('work', (0, 0)), (0, 0))
+
+            with self.assertRaises(ValueError):
+                self.mq.listen_worker('other', 'test.#', handler=self.handler())
+
+
+if __name__ == '__main__':
+    unittest.main()
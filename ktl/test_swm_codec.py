@@ -0,0 +1,50 @@
+import json
+import unittest
+
+from datetime           import datetime, timedelta, timezone
+
+from swm_codec          import (datetime_decode,
+                                json_object_decode,
+                                json_object_encode,
+                               )
+
+
+class TestSwmCodec(unittest.TestCase):
+
+    def test_datetime_decode_naive(self):
+        self.assertEqual(datetime_decode('2022-01-02T03:04:05.000006'), datetime(2022, 1, 2, 3, 4, 5, 6))
+
+    def test_datetime_decode_naive_seconds(self):
+        self.assertEqual(datetime_decode('2022-01-02T03:04:05'), datetime(2022, 1, 2, 3, 4, 5))
+
+    def test_datetime_decode_offset(self):
+        self.assertEqual(datetime_decode('2022-01-02T03:04:05+01:00'),
+            datetime(2022, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=1))))
+
+    def test_datetime_decode_offset_nocolon(self):
+        self.assertEqual(datetime_decode('2022-01-02T03:04:05.000006+0000'),
+            datetime(2022, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc))
+
+    def test_datetime_decode_invalid(self):
+        with self.assertRaises(ValueError):
+            datetime_decode('not-a-date')
+
+    def test_json_object_decode_passthrough(self):
+        obj = {'_isoformat': '2022-01-02T03:04:05', 'other': 1}
+
+        self.assertIs(json_object_decode(obj), obj)
+
+    def test_round_trip(self):
+        data = {
+            'naive': datetime(2022, 1, 2, 3, 4, 5),
+            'micro': datetime(2022, 1, 2, 3, 4, 5, 6),
+            'utc': datetime(2022, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+            'plain': {'a': [1, 2, 3]},
+        }
+        encoded = json.dumps(data, default=json_object_encode)
+
+        self.assertEqual(json.loads(encoded, object_hook=json_object_decode), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,6 +53,19 @@ class TestSwmStatus(TestSwmStatusCore):
 
         self.assertEqual(sorted(ss.trackers.keys()), self.data_trackers)
 
+    def test_initialisation_path_journal(self):
+        with TempDirectory() as d:
+            d.write('status.json', b'{"trackers": {"123": {"phase": "a"}, "124": {"phase": "a"}}}')
+            d.write('status.json.journal',
+                b'{"tracker":"123","status":{"phase":"b"}}\n'
+                b'{"tracker":"124","status":null}\n'
+                b'{"tracker":"125","status":{"phase":"c"}}\n'
+                b'{"tracker":"126","sta')
+
+            ss = SwmStatus(path=d.getpath('status.json'))
+
+        self.assertEqual(ss.trackers, {'123': {'phase': 'b'}, '125': {'phase': 'c'}})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+import os
+import unittest
+from testfixtures       import TempDirectory
+
+from ktl.work_queue     import WorkQueue
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.d = TempDirectory()
+
+    def tearDown(self):
+        self.d.cleanup()
+
+    def test_put_claim_ack(self):
+        queue = WorkQueue(self.d.getpath('queue'))
+        queue.put({'nr': 1})
+        queue.put({'nr': 2})
+        self.assertEqual(queue.pending(), 2)
+
+        claimed = queue.claim()
+        self.assertEqual([record for name, record in claimed], [{'nr': 1}, {'nr': 2}])
+        self.assertEqual(queue.pending(), 0)
+        self.assertEqual(queue.claim(), [])
+
+        queue.ack([name for name, record in claimed])
+        self.assertEqual(os.listdir(self.d.getpath('queue/cur')), [])
+
+    def test_claim_limit(self):
+        queue = WorkQueue(self.d.getpath('queue'))
+        for nr in range(3):
+            queue.put({'nr': nr})
+
+        self.assertEqual([record['nr'] for name, record in queue.claim(limit=2)], [0, 1])
+        self.assertEqual([record['nr'] for name, record in queue.claim()], [2])
+
+    def test_shared(self):
+        producer = WorkQueue(self.d.getpath('queue'))
+        consumer_a = WorkQueue(self.d.getpath('queue'))
+        consumer_b = WorkQueue(self.d.getpath('queue'))
+        producer.put({'nr': 1})
+
+        self.assertEqual(len(consumer_a.claim()), 1)
+        self.assertEqual(consumer_b.claim(), [])
+
+    def test_release(self):
+        queue = WorkQueue(self.d.getpath('queue'))
+        queue.put({'nr': 1})
+
+        claimed = queue.claim()
+        queue.release([name for name, record in claimed])
+        self.assertEqual(queue.claim(), claimed)
+
+    def test_recover(self):
+        queue = WorkQueue(self.d.getpath('queue'))
+        queue.put({'nr': 1})
+        claimed = queue.claim()
+        self.d.write('queue/tmp/partial.json', b'{"nr":')
+
+        self.assertEqual(queue.recover(age=3600), 0)
+        self.assertEqual(queue.recover(age=-1), 1)
+        self.assertEqual(queue.claim(), claimed)
+        self.assertEqual(os.listdir(self.d.getpath('queue/tmp')), [])
+
+    def test_corrupt_dropped(self):
+        queue = WorkQueue(self.d.getpath('queue'))
+        self.d.write('queue/new/0.corrupt.json', b'{"nr":')
+        queue.put({'nr': 1})
+
+        self.assertEqual([record for name, record in queue.claim()], [{'nr': 1}])
+        self.assertEqual(len(os.listdir(self.d.getpath('queue/cur'))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#
+# work_queue -- a durable local work queue shared between processes
+#
+# Each entry is a single JSON file moved between three directories in the
+# queue, maildir style:
+#
+#   tmp/  entries being written, invisible to consumers,
+#   new/  entries ready to be claimed,
+#   cur/  entries claimed by a consumer and not yet acknowledged.
+#
+# Every transition is a rename within one filesystem so each entry is
+# either wholly present in one state or not at all, and any number of
+# producers and consumers may share a queue.
+#
+import json
+import os
+import socket
+import threading
+from time import time
+
+
+# WorkQueue
+#
+class WorkQueue:
+
+    # __init__
+    #
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._host = socket.gethostname().replace('/', '_')
+        for state in ('tmp', 'new', 'cur'):
+            os.makedirs(os.path.join(path, state), exist_ok=True)
+
+    def _path(self, state, name=None):
+        if name is None:
+            return os.path.join(self.path, state)
+        return os.path.join(self.path, state, name)
+
+    def _name(self):
+        # Names sort in arrival order and are unique across processes.
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        return '{:.6f}.{}.{}.{}.json'.format(time(), os.getpid(), seq, self._host)
+
+    # put
+    #
+    def put(self, record):
+        '''
+        Durably add record to the queue, returning its entry name.  The entry
+        is on disk before we return.
+        '''
+        name = self._name()
+        data = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        tmp = self._path('tmp', name)
+        with open(tmp, 'wb') as wfd:
+            wfd.write(data)
+            wfd.flush()
+            os.fsync(wfd.fileno())
+        os.rename(tmp, self._path('new', name))
+
+        # Make the directory entry durable too.
+        dfd = os.open(self._path('new'), os.O_RDONLY)
+        try:
+            os.fsync(dfd)
+        finally:
+            os.close(dfd)
+        return name
+
+    def _read(self, path):
+        try:
+            with open(path) as rfd:
+                return json.load(rfd)
+        except ValueError:
+            return None
+
+    # claim
+    #
+    def claim(self, limit=None):
+        '''
+        Claim pending entries, oldest first, returning a list of (name, record)
+        pairs.  Claimed entries must be ack()ed once handled or release()d
+        for another attempt.  Entries which cannot be decoded are dropped.
+        '''
+        claimed = []
+        for name in sorted(os.listdir(self._path('new'))):
+            if limit is not None and len(claimed) >= limit:
+                break
+            cur = self._path('cur', name)
+            try:
+                os.rename(self._path('new', name), cur)
+            except FileNotFoundError:
+                # Claimed by another consumer.
+                continue
+            record = self._read(cur)
+            if record is None:
+                os.unlink(cur)
+                continue
+            claimed.append((name, record))
+        return claimed
+
+    # ack
+    #
+    def ack(self, names):
+        for name in names:
+            try:
+                os.unlink(self._path('cur', name))
+            except FileNotFoundError:
+                pass
+
+    # release
+    #
+    def release(self, names):
+        '''
+        Return claimed entries to the queue.
+        '''
+        for name in names:
+            try:
+                os.rename(self._path('cur', name), self._path('new', name))
+            except FileNotFoundError:
+                pass
+
+    # recover
+    #
+    def recover(self, age=3600):
+        '''
+        Return entries claimed more than age seconds ago to the queue, their
+        consumer has most likely died.  Abandoned partial writes are removed.
+        Returns the number of entries returned.
+        '''
+        limit = time() - age
+        recovered = 0
+        for name in os.listdir(self._path('cur')):
+            try:
+                if os.stat(self._path('cur', name)).st_ctime < limit:
+                    os.rename(self._path('cur', name), self._path('new', name))
+                    recovered += 1
+            except FileNotFoundError:
+                pass
+        for name in os.listdir(self._path('tmp')):
+            try:
+                if os.stat(self._path('tmp', name)).st_mtime < limit:
+                    os.unlink(self._path('tmp', name))
+            except FileNotFoundError:
+                pass
+        return recovered
+
+    # pending
+    #
+    def pending(self):
+        return len(os.listdir(self._path('new')))
+
+# vi:set ts=4 sw=4 expandtab:
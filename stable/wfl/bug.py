@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 #
+from copy                               import deepcopy
 from datetime                           import datetime, timedelta, timezone
 from textwrap                           import fill
 import yaml
@@ -11,10 +12,11 @@
 from .errors                            import ShankError, WorkflowCrankError, WorkflowCorruptError
 from .deltatime                         import DeltaTime
 from .snap                              import SnapDebs, SnapError
-from .task                              import WorkflowBugTask, WorkflowBugTaskSynPersistent, WorkflowBugTaskSynPreparePackages
+from .task                              import WorkflowBugTask, WorkflowBugTaskSnapshot, WorkflowBugTaskSynPersistent, WorkflowBugTaskSynPreparePackages
 from ktl.kernel_series                  import KernelSeries
 from ktl.sru_cycle                      import SruCycle
 from .swm_config                        import SwmConfig
+from .swm_properties                    import SwmPropertiesCache, swm_properties_equal
 from .git_tag                           import GitTag, GitTagError
 
 
@@ -45,6 +47,12 @@ class WorkflowBug():
     no_phase_changes  = False
     local_msgqueue_port = None
 
+    # Read all tasks from a single snapshot and hold task writes until save().
+    task_snapshot     = True
+
+    # Parsed swm properties keyed by description.
+    properties_cache  = SwmPropertiesCache()
+
     # __init__
     #
     def __init__(s, lp, bugid=None, bug=None, ks=None, sru_cycle=None, manager=None):
@@ -84,6 +92,7 @@ def __init__(s, lp, bugid=None, bug=None, ks=None, sru_cycle=None, manager=None)
         s.error = None
         s.title = s.lpbug.title
         s._tags = None
+        s._task_snapshot = None
         s.bprops = s.load_bug_properties()
         s.reasons = {}
         s._refresh = [None, None]
@@ -304,6 +313,7 @@ def _remove_live_tag(s):
     # save
     #
     def save(s):
+        s.save_tasks()
         s.save_bug_properties()
         s._remove_live_tag()
         if s.tracker_modified:
@@ -311,6 +321,30 @@ def save(s):
             s.lpbug.lpbug.lp_save()
             s.tracker_modified = False
 
+    # save_tasks
+    #
+    def save_tasks(s):
+        '''
+        Write back any task modifications held in the task snapshot.
+        '''
+        if s._task_snapshot is not None:
+            s._task_snapshot.save()
+
+    # lp_tasks
+    #
+    @property
+    def lp_tasks(s):
+        '''
+        The Launchpad tasks for this bug.  In snapshot mode these all come
+        from a single collection fetch and any changes are only written by
+        save_tasks().
+        '''
+        if not WorkflowBug.task_snapshot:
+            return s.lpbug.tasks
+        if s._task_snapshot is None:
+            s._task_snapshot = WorkflowBugTaskSnapshot(s.lpbug.lpbug)
+        return s._task_snapshot
+
     @property
     def _dryrun(s):
         return WorkflowBug.dryrun
@@ -467,29 +501,11 @@ def dup_replaces(s, inactive_only=False):
     #
     def load_bug_properties(s):
         center(s.__class__.__name__ + '.load_bug_properties')
-        retval = {}
-        started = False
-        buf = ''
-
-        description = s.lpbug.description
-        for l in description.split('\n'):
-            if started:
-                buf += l + '\n'
-            if l.startswith('-- swm properties --'):
-                started = True
-
-        if started and buf is not None:
-            # Launchpad will convert leading spaces into utf-8 non-breaking spaces
-            # when you manually edit the description in the web interface.
-            buf = buf.replace('\xa0', ' ')
-            try:
-                retval = yaml.safe_load(buf)
-                if retval is None:
-                    retval = {}
-            except Exception as e:
-                retval = {}
-                error = str(e).split('\n')[0]
-                s.error = WorkflowCorruptError('failed to load swm-properties -- {}'.format(error))
+
+        entry = WorkflowBug.properties_cache.lookup(s.lpbug.description)
+        if entry['error'] is not None:
+            s.error = WorkflowCorruptError('failed to load swm-properties -- {}'.format(entry['error']))
+        retval = deepcopy(entry['props'])
 
         cleave(s.__class__.__name__ + '.load_bug_properties')
         return retval
@@ -532,9 +548,18 @@ def save_bug_properties(s):
         if len(s.bprops) > 0:
             status = s.bprops
             status.setdefault('reason', {}).update(s.reasons)
-            new_props = s.properties_for_description(status)
 
+            # Only render the properties when they differ from those in the
+            # description, or where we do not already know their form.
             description = s.lpbug.description
+            entry = WorkflowBug.properties_cache.lookup(description)
+            if entry['error'] is None and swm_properties_equal(status, entry['props']):
+                if entry['rendered'] is None:
+                    entry['rendered'] = s.properties_for_description(status)
+                new_props = entry['rendered']
+            else:
+                new_props = s.properties_for_description(status)
+
             for l in description.split('\n'):
                 if l.startswith('-- swm properties --'):
                     break
@@ -542,6 +567,7 @@ def save_bug_properties(s):
 
             newd += '-- swm properties --\n'
             newd += new_props
+            WorkflowBug.properties_cache.canonical_add(newd)
 
             if s.lpbug.description != newd:
                 if s._dryrun:
@@ -732,7 +758,7 @@ def check_is_valid(s):
         s.is_crankable = False
         s.is_closed = False
         s.is_gone = False
-        for t in s.lpbug.tasks:
+        for t in s.lp_tasks:
             task_name       = t.bug_target_name
 
             if task_name in WorkflowBug.projects_tracked:
@@ -755,13 +781,14 @@ def accept_new(self):
         if not self.is_new:
             return
 
-        for t in self.lpbug.tasks:
+        for t in self.lp_tasks:
             task_name       = t.bug_target_name
 
             if task_name in WorkflowBug.projects_tracked:
                 cinfo("accept_new: Triaged tracker now tracked flipping In Progress")
                 t.status = 'In Progress'
                 break
+        self.save_tasks()
 
         self.check_is_valid()
 
@@ -779,7 +806,7 @@ def _create_tasks_by_name_mapping(s):
 
         synthesise = set()
 
-        for t in s.lpbug.tasks:
+        for t in s.lp_tasks:
             task_name       = t.bug_target_name
 
             if task_name.startswith(s.workflow_project):
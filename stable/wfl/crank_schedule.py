@@ -0,0 +1,62 @@
+#
+# crank_schedule -- the order in which to crank trackers concurrently
+#
+from concurrent.futures                 import wait, FIRST_COMPLETED
+
+
+# WorkflowCrankSchedule
+#
+class WorkflowCrankSchedule:
+    '''
+    The dependencies between the trackers of a single crank pass.  A tracker
+    is only started once every one of its master-bug ancestors in this pass
+    has completed.  Trackers we knew nothing about at the start of the run
+    are ordered last by tracker_key, so they are held until all known
+    trackers are complete.
+    '''
+    # __init__
+    #
+    def __init__(s, buglist, known, ancestors):
+        '''
+        buglist is already in tracker_key order, known holds the trackers we
+        had status for at the start of the run and ancestors(bugid) returns
+        the master-bug chain for a known tracker.
+        '''
+        s.buglist = list(buglist)
+        known = set(bugid for bugid in s.buglist if bugid in known)
+        s.waits = {}
+        for bugid in s.buglist:
+            if bugid in known:
+                s.waits[bugid] = set(ancestors(bugid)) & known
+            else:
+                s.waits[bugid] = known
+
+    # run
+    #
+    def run(s, pool, crank, progress):
+        '''
+        Submit crank(bugid, progress(scanned, total)) to the executor pool
+        for each tracker as soon as it is ready and return the trackers to
+        rescan which they report.
+        '''
+        rescan = []
+        queued = list(s.buglist)
+        running = {}
+        done = set()
+        bugs_scanned = 0
+        while len(queued) > 0 or len(running) > 0:
+            for bugid in list(queued):
+                if s.waits[bugid] <= done:
+                    queued.remove(bugid)
+                    bugs_scanned += 1
+                    running[pool.submit(crank, bugid, progress(bugs_scanned, len(s.buglist)))] = bugid
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                bugid = running.pop(future)
+                rescan += future.result()
+                done.add(bugid)
+
+        return rescan
+
+# vi:set ts=4 sw=4 expandtab:
@@ -1,19 +1,224 @@
 #!/usr/bin/python3
 
+from hashlib import sha1
+import json
+import os
+import time
+
 from launchpadlib.launchpad import Launchpad
+from lazr.restfulclient.errors import HTTPError
+from lazr.restfulclient.resource import Entry
+from wadllib.application import Resource as WadlResource
+
+
+class LaunchpadCacheStoreStats:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.refreshed = 0
+        self.latency = 0.0
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        return "hits={} misses={} revalidated={} refreshed={} latency={:.3f}s avg={:.3f}s".format(
+            self.hits, self.misses, self.revalidated, self.refreshed,
+            self.latency, self.latency / lookups if lookups else 0.0)
+
+
+class LaunchpadCacheStore:
+    '''
+    On-disk cache of Launchpad entries keyed by kind and lookup key.  Each
+    entry records the entry representation as returned by Launchpad and is
+    used directly until the TTL for its kind expires.  After that it is
+    revalidated against its ETag, only fetching the body when it has
+    changed.  Entries are one file each so that concurrent processes can
+    share the cache; the least recently used are evicted once there are
+    more than max_entries.  We keep a running count of the entries so the
+    directory is only scanned when it may be over that, and then evict down
+    to evict_ratio of the limit so the next scan is some way off.
+    '''
+
+    # Seconds an entry may be used without revalidation, by kind.
+    ttls = {
+        'archive': 24 * 3600,
+        'distro-series': 3600,
+        'project-series': 3600,
+        'git-repository': 3600,
+    }
+    ttl_default = 3600
+
+    evict_ratio = 0.9
+
+    def __init__(self, root, path, max_entries=2048):
+        self.root = root
+        self.path = path
+        self.max_entries = max_entries
+        self.stats = {}
+        self.evicted = 0
+        self.entries = None
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def _stats(self, kind):
+        if kind not in self.stats:
+            self.stats[kind] = LaunchpadCacheStoreStats()
+        return self.stats[kind]
+
+    def _entry_path(self, kind, key):
+        # Keep production and staging (etc) entries apart.
+        digest = sha1(json.dumps([str(self.root._root_uri), kind, key]).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + '.json')
+
+    def _read(self, path):
+        try:
+            with open(path) as rfd:
+                return json.load(rfd)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, record):
+        with open(path + '.new', 'w') as wfd:
+            json.dump(record, wfd)
+        os.rename(path + '.new', path)
+
+    def _bind(self, record):
+        '''
+        Rebuild a bound Entry from a cached representation without going
+        back to Launchpad (as Launchpad.load() would after its GET).
+        '''
+        representation = record['representation']
+        resource_type = self.root._wadl.get_resource_type(representation['resource_type_link'])
+        wadl_resource = WadlResource(self.root._wadl, record['url'], resource_type.tag)
+        return self.root._create_bound_resource(self.root, wadl_resource,
+            representation, 'application/json', representation_needs_processing=False)
+
+    def _revalidate(self, record):
+        '''
+        Conditionally refetch an expired record, returns True if the
+        representation changed.
+        '''
+        headers = {}
+        etag = record['representation'].get('http_etag')
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        document = self.root._browser.get(record['url'], headers=headers)
+        if document == self.root._browser.NOT_MODIFIED:
+            return False
+        if isinstance(document, bytes):
+            document = document.decode('utf-8')
+        record['representation'] = json.loads(document)
+        return True
+
+    def lookup(self, kind, key, fetch):
+        '''
+        Return the Entry for kind/key, calling fetch() to look it up in
+        Launchpad when we have no usable cached copy.
+        '''
+        stats = self._stats(kind)
+        start = time.monotonic()
+        try:
+            path = self._entry_path(kind, key)
+            record = self._read(path)
+            now = time.time()
+
+            if record is not None and now - record['fetched'] > self.ttls.get(kind, self.ttl_default):
+                try:
+                    if self._revalidate(record):
+                        stats.refreshed += 1
+                    else:
+                        stats.revalidated += 1
+                    record['fetched'] = now
+                    self._write(path, record)
+                except HTTPError:
+                    # Gone or otherwise unavailable, look it up again.
+                    record = None
+
+            if record is not None:
+                stats.hits += 1
+                os.utime(path)
+                return self._bind(record)
+
+            stats.misses += 1
+            value = fetch()
+            # Only entries can be rebuilt, anything else (including None for
+            # a failed lookup) is not persisted.
+            if isinstance(value, Entry):
+                record = {
+                    'kind': kind,
+                    'key': key,
+                    'url': str(value.self_link),
+                    'fetched': now,
+                    'representation': value._wadl_resource.representation,
+                }
+                added = not os.path.exists(path)
+                self._write(path, record)
+                if added:
+                    self._added()
+            return value
+
+        finally:
+            stats.latency += time.monotonic() - start
+
+    def _added(self):
+        # Others sharing the cache add entries too, so the count is only a
+        # lower bound until the next scan; it is found by the first one.
+        if self.entries is not None:
+            self.entries += 1
+            if self.entries <= self.max_entries:
+                return
+        self.evict()
+
+    def evict(self):
+        '''
+        Once there are more than max_entries, drop the least recently used
+        entries until we are back to evict_ratio of that.
+        '''
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            try:
+                entries.append((os.stat(os.path.join(self.path, name)).st_mtime, name))
+            except FileNotFoundError:
+                pass
+        self.entries = len(entries)
+        if self.entries <= self.max_entries:
+            return
+        keep = int(self.max_entries * self.evict_ratio)
+        for (mtime, name) in sorted(entries)[:len(entries) - keep]:
+            try:
+                os.unlink(os.path.join(self.path, name))
+                self.evicted += 1
+            except FileNotFoundError:
+                pass
+            self.entries -= 1
+
+    def __str__(self):
+        lines = ["{}: {}".format(kind, stats) for kind, stats in sorted(self.stats.items())]
+        lines.append("evicted: {}".format(self.evicted))
+        return "\n".join(lines)
 
 
 class LaunchpadCacheNamedOperation:
 
-    def __init__(self, value, key, cache):
+    def __init__(self, value, key, cache, store=None, kind=None, scope=None):
         self.__value = value
         self.__key = key
         self.__cache = cache
+        self.__store = store
+        self.__kind = kind
+        self.__scope = scope
 
     def __call__(self, *args, **kwargs):
         op_key = kwargs[self.__key]
         if op_key not in self.__cache:
-            self.__cache[op_key] = self.__value.__call__(*args, **kwargs)
+            if self.__store is not None and len(args) == 0 and len(kwargs) == 1:
+                self.__cache[op_key] = self.__store.lookup(self.__kind, [self.__scope, op_key],
+                    lambda: self.__value.__call__(*args, **kwargs))
+            else:
+                self.__cache[op_key] = self.__value.__call__(*args, **kwargs)
         return self.__cache[op_key]
 
 
@@ -29,75 +234,73 @@ def __str__(self):
         return str(self.__value)
 
 
+# The in-memory caches below hold Launchpad objects bound to a connection
+# and so are per LaunchpadCache instance; connections are not shared between
+# threads.
 class LaunchpadCacheArchives(LaunchpadCacheAttr):
 
-    __reference_cache = {}
-
-    def __init__(self, value):
+    def __init__(self, value, store=None):
         super().__init__(value)
 
-        self.getByReference = LaunchpadCacheNamedOperation(value.getByReference, 'reference', self.__reference_cache)
+        self.getByReference = LaunchpadCacheNamedOperation(value.getByReference, 'reference', dict(), store, 'archive')
 
 
 class LaunchpadCacheDistributionsEntry(LaunchpadCacheAttr):
 
-    def __init__(self, value):
+    def __init__(self, value, store=None, name=None):
         super().__init__(value)
 
-        self.getSeries = LaunchpadCacheNamedOperation(value.getSeries, 'name_or_version', dict())
+        self.getSeries = LaunchpadCacheNamedOperation(value.getSeries, 'name_or_version', dict(), store, 'distro-series', name)
 
 
 class LaunchpadCacheDistributions:
 
-    __cache = {}
-
-    def __init__(self, value):
+    def __init__(self, value, store=None):
         self.__value = value
+        self.__store = store
+        self.__cache = {}
 
     def __getitem__(self, item):
         if item not in self.__cache:
-            value = LaunchpadCacheDistributionsEntry(self.__value[item])
+            value = LaunchpadCacheDistributionsEntry(self.__value[item], self.__store, item)
             self.__cache[item] = value
         return self.__cache[item]
 
 
 class LaunchpadCacheProjectsEntry(LaunchpadCacheAttr):
 
-    def __init__(self, value):
+    def __init__(self, value, store=None, name=None):
         super().__init__(value)
-        self.getSeries = LaunchpadCacheNamedOperation(value.getSeries, 'name', dict())
+        self.getSeries = LaunchpadCacheNamedOperation(value.getSeries, 'name', dict(), store, 'project-series', name)
 
 
 class LaunchpadCacheProjects:
 
-    __cache = {}
-
-    def __init__(self, value):
+    def __init__(self, value, store=None):
         self.__value = value
+        self.__store = store
+        self.__cache = {}
 
     def __getitem__(self, item):
         if item not in self.__cache:
-            value = LaunchpadCacheProjectsEntry(self.__value[item])
+            value = LaunchpadCacheProjectsEntry(self.__value[item], self.__store, item)
             self.__cache[item] = value
         return self.__cache[item]
 
 
 class LaunchpadCacheGitRepositories(LaunchpadCacheAttr):
 
-    __path_cache = {}
-
-    def __init__(self, value):
+    def __init__(self, value, store=None):
         super().__init__(value)
 
-        self.getByPath = LaunchpadCacheNamedOperation(value.getByPath, 'path', self.__path_cache)
+        self.getByPath = LaunchpadCacheNamedOperation(value.getByPath, 'path', dict(), store, 'git-repository')
 
 
 class LaunchpadCachePeople:
 
-    __cache = {}
-
     def __init__(self, value):
         self.__value = value
+        self.__cache = {}
 
     def __getitem__(self, item):
         if item not in self.__cache:
@@ -107,14 +310,23 @@ def __getitem__(self, item):
 
 class LaunchpadCache(Launchpad):
 
+    # Where named operation results are persisted between runs, None to
+    # disable the on-disk cache.
+    store_path = os.path.expanduser('~/.cache/swm/launchpad')
+    store_max_entries = 2048
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._me = False
 
-        self.archives = LaunchpadCacheArchives(self.archives)
-        self.distributions = LaunchpadCacheDistributions(self.distributions)
-        self.projects = LaunchpadCacheProjects(self.projects)
-        self.git_repositories = LaunchpadCacheGitRepositories(self.git_repositories)
+        self.store = None
+        if self.store_path is not None:
+            self.store = LaunchpadCacheStore(self, self.store_path, max_entries=self.store_max_entries)
+
+        self.archives = LaunchpadCacheArchives(self.archives, self.store)
+        self.distributions = LaunchpadCacheDistributions(self.distributions, self.store)
+        self.projects = LaunchpadCacheProjects(self.projects, self.store)
+        self.git_repositories = LaunchpadCacheGitRepositories(self.git_repositories, self.store)
         self.people = LaunchpadCachePeople(self.people)
 
     @property
@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 #
-from logging                            import info, debug
+from logging                            import info, debug, getLogger, DEBUG, INFO
 from ktl.termcolor                      import colored
 
+# All of the log helpers accept either a message or a callable returning the
+# message.  A callable is only evaluated if the message will be emitted,
+# allowing expensive debug messages to be built lazily:
+#
+#   cdebug(lambda: 'status: {}'.format(expensive()))
+#
 def cinfo(msg, color='white'):
     Clog.info(msg, color)
 
@@ -32,21 +38,38 @@ class Clog:
     color = True
     indent = 0
 
+    _logger = getLogger()
+    _indents = {}
+    _colors = {}
+
     @classmethod
     def colored(c, msg, color):
         if c.color:
-            return colored(msg, color)
+            # Cache the escape sequences for each color.
+            wrap = c._colors.get(color)
+            if wrap is None:
+                wrap = c._colors[color] = colored('\0', color).split('\0')
+            return wrap[0] + msg + wrap[1]
         return msg
 
+    @classmethod
+    def format(c, msg, color):
+        if callable(msg):
+            msg = msg()
+        prefix = c._indents.get(c.indent)
+        if prefix is None:
+            prefix = c._indents[c.indent] = ' ' * c.indent
+        return c.colored(prefix + str(msg), color)
+
     @classmethod
     def info(c, msg, color='white'):
-        msg = ' ' * c.indent + str(msg)
-        info(c.colored(msg, color))
+        if c._logger.isEnabledFor(INFO):
+            info(c.format(msg, color))
 
     @classmethod
     def debug(c, msg, color='magenta'):
-        msg = ' ' * c.indent + str(msg)
-        debug(c.colored(msg, color))
+        if c._logger.isEnabledFor(DEBUG):
+            debug(c.format(msg, color))
 
     @classmethod
     def warn(c, msg, color='red'):
@@ -68,4 +91,39 @@ def leave(c, msg):
             c.indent -= 4
         c.debug(msg, 'green')
 
+
+if __name__ == '__main__':
+    # Benchmark a stubbed tracker run walking build records with debug
+    # logging disabled, against the previous eager implementation.
+    import logging
+    from timeit import repeat
+
+    logging.basicConfig(level=logging.INFO)
+
+    class Build:
+        arch_tag = 'amd64'
+        buildstate = 'Successfully built'
+
+    records = [Build()] * 200
+
+    def eager_debug(msg, color='magenta'):
+        msg = ' ' * Clog.indent + str(msg)
+        debug(Clog.colored(msg, color))
+
+    def eager_crank():
+        for build in records:
+            eager_debug('Enter ' + 'PackageBuild.__determine_build_status', 'green')
+            eager_debug("build arch={} status={}".format(build.arch_tag, build.buildstate))
+            eager_debug('Leave ' + 'PackageBuild.__determine_build_status', 'green')
+
+    def lazy_crank():
+        for build in records:
+            center('PackageBuild.__determine_build_status')
+            cdebug(lambda: "build arch={} status={}".format(build.arch_tag, build.buildstate))
+            cleave('PackageBuild.__determine_build_status')
+
+    for name, func in (('eager', eager_crank), ('lazy', lazy_crank)):
+        best = min(repeat(func, number=100, repeat=5)) / 100
+        print("{:6} records={} {:8.1f}us".format(name, len(records), best * 1000000))
+
 # vi:set ts=4 sw=4 expandtab syntax=python:
@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 #
 
+from concurrent.futures                 import ProcessPoolExecutor
 from contextlib                         import contextmanager
 from copy                               import copy
 from datetime                           import datetime
 from fcntl                              import lockf, LOCK_EX, LOCK_NB, LOCK_UN
-import json
+import multiprocessing
 import os
-import yaml
+import threading
+import time
 
 from lazr.restfulclient.errors          import PreconditionFailed
 
@@ -20,11 +22,32 @@
 from .launchpad_stub                    import LaunchpadStub
 from .bug                               import WorkflowBug, WorkflowBugError
 from .package                           import PackageError, SeriesLookupFailure
-from .snap                              import SnapError
+from .snap                              import SnapError, SnapStore, SnapStoreCache
 from .bugmail                           import BugMailConfigFileMissing
+from .crank_schedule                    import WorkflowCrankSchedule
+from .status_store                      import WorkflowStatusStore, WorkflowStatusIndex
+from .swm_properties                    import SwmPropertiesCache
 import wfl.wft
 
 
+# Parallel cranking is done in forked worker processes, each of which needs
+# its own copy of the manager.  The manager holds open files and locks and
+# cannot be pickled, so it is handed over via this global as the workers are
+# forked.
+_crank_manager = None
+
+def _crank_worker_init():
+    # Never share the parent's Launchpad connection across the fork.
+    _crank_manager._lp = None
+
+def _crank_worker(bugid, progress):
+    s = _crank_manager
+    with s.lock_bug(bugid):
+        cinfo('')
+        cinfo("Processing ({}): {} ({})".format(progress, bugid, s.lp.bug_url(bugid)))
+        return s.crank(bugid)
+
+
 # WorkflowManager
 #
 class WorkflowManager():
@@ -34,6 +57,7 @@ def __init__(s, args, test_mode=False, ks=None, sru_cycle=None):
         center('WorkflowManager.__init__')
         s.test_mode = test_mode
         s.args = args
+        s.jobs = getattr(args, 'jobs', 1)
         s._lp = None
         s._task_map = {
             'kernel-sru-workflow'       : wfl.wft.Workflow,
@@ -82,10 +106,14 @@ def __init__(s, args, test_mode=False, ks=None, sru_cycle=None):
         WorkflowBug.no_status_changes = s.args.no_status_changes
         WorkflowBug.no_phase_changes  = s.args.no_phase_changes
         WorkflowBug.local_msgqueue_port = s.args.local_msgqueue_port
+        # The launchpad stub only models lpltk tasks.
+        WorkflowBug.task_snapshot     = not s.test_mode
 
         # Per bug locking.
         s.lockfile = 'swm.lock'
         s.lockfd = open(s.lockfile, 'w')
+        s.status_thread_lock = threading.RLock()
+        s.status_lock_depth = 0
 
         # Load up the initial status.  If we are scaning all bugs we will
         # attempt to clean out any bugs we did not know.  We should only
@@ -94,12 +122,19 @@ def __init__(s, args, test_mode=False, ks=None, sru_cycle=None):
         # instances.
         s.status_path = 'status.json'
         s.status_altpath = 'status.yaml'
-        s.status_validator = None
-        s.Status_current = None
+        s.status_store = WorkflowStatusStore(s.status_path, s.status_altpath, lock=s.lock_status)
         with s.lock_status():
-            s.status_start = s.status_load()
+            s.status_start = dict(s.status_load())
+        s.status_start_index = WorkflowStatusIndex(s.status_start)
         s.status_wanted = {}
 
+        # Share snap store channel maps with any other instances.
+        SnapStore.cache = SnapStoreCache(path=os.path.expanduser('~/.cache/swm/snap'))
+
+        # Remember which tracker descriptions hold our own rendering of their
+        # properties across runs.
+        WorkflowBug.properties_cache = SwmPropertiesCache(path=os.path.expanduser('~/.cache/swm/properties-canonical'))
+
         cleave('WorkflowManager.__init__')
 
     @contextmanager
@@ -116,10 +151,21 @@ def single_thread(s):
         with s.lock_bug(1, block=False):
             yield
 
+    # The status lock is also taken by the status store compactor thread.
+    # lockf() locks belong to the process as a whole, so serialise our own
+    # threads first and only take the file lock on the outermost entry.
     @contextmanager
     def lock_status(s):
-        with s.lock_bug(2):
-            yield
+        with s.status_thread_lock:
+            s.status_lock_depth += 1
+            try:
+                if s.status_lock_depth == 1:
+                    with s.lock_bug(2):
+                        yield
+                else:
+                    yield
+            finally:
+                s.status_lock_depth -= 1
 
     @contextmanager
     def single_dependants_only(s):
@@ -128,9 +174,7 @@ def single_dependants_only(s):
 
     def status_get(s, bugid, summary=False, modified=None):
         with s.lock_status():
-            status = s.status_load()
-
-        return status.get(bugid, {})
+            return s.status_load().get(bugid, {})
 
     def status_set(s, bugid, summary=False, update=False, modified=None):
         with s.lock_status():
@@ -153,75 +197,31 @@ def status_set(s, bugid, summary=False, update=False, modified=None):
                     if modified is True or 'time-modified' not in manager:
                         manager['time-modified'] = copy(now)
 
-                status[bugid] = summary
+                s.status_save(bugid, summary)
                 s.status_wanted[bugid] = True
             else:
                 if bugid in status:
                     cinfo('overall status {} closing'.format(bugid))
-                    del status[bugid]
+                    s.status_save(bugid, None)
                 s.status_wanted[bugid] = False
 
-            s.status_save(status)
-
-    def _json_object_decode(self, obj):
-        isoformat = obj.get('_isoformat')
-        if isoformat is not None:
-            #return datetime.fromisoformat(isoformat)
-            # XXX: before python 3.6 fromisoformat is not available.
-            if isoformat[-3] == ':':
-                isoformat = isoformat[0:-3] + isoformat[-2:]
-            for fmt in (
-                    '%Y-%m-%dT%H:%M:%S.%f%z',
-                    '%Y-%m-%dT%H:%M:%S%z',
-                    '%Y-%m-%dT%H:%M:%S.%f',
-                    '%Y-%m-%dT%H:%M:%S'):
-                try:
-                    obj = datetime.strptime(isoformat, fmt)
-                    break
-                except ValueError:
-                    pass
-            else:
-                raise ValueError("isoformat: {} invalid format".format(isoformat))
-        return obj
-
+    # Must be called with the status lock held.  The returned status is the
+    # live in-memory index, it is only valid while that lock is held.
     def status_load(s):
-        status = {}
-        if os.path.exists(s.status_path):
-            with open(s.status_path) as rfd:
-                stat = os.stat(rfd.fileno())
-                validator = (stat.st_ino, stat.st_mtime)
-                cinfo("VALIDATOR: {} {}".format(s.status_validator, validator))
-                if validator != s.status_validator:
-                    data = json.load(rfd, object_hook=s._json_object_decode)
-                    s.status_current = data.get('trackers', data)
-                    s.status_validator = validator
-            status = s.status_current
-
-        return status
-
-    def _json_object_encode(self, obj):
-        if isinstance(obj, datetime):
-            return { '_isoformat': obj.isoformat() }
-        raise TypeError('Object of type %s with value of %s is not JSON serializable' % (type(obj), repr(obj)))
-
-    def status_save(s, status):
-        # Use a top-level trackers collection to allow us to extend with
-        # non-tracker information later.
-        data = {'trackers': status}
-
-        with open(s.status_path + '.new', 'w') as wfd:
-            json.dump(data, fp=wfd, default=s._json_object_encode, separators=(',', ':'))
-        os.rename(s.status_path + '.new', s.status_path)
-
-        with open(s.status_altpath + '.new', 'w') as wfd:
-            yaml.dump(data, wfd, default_flow_style=False)
-        os.rename(s.status_altpath + '.new', s.status_altpath)
-
-        # We are writing the file, update our cache.
-        stat = os.stat(s.status_path)
-        validator = (stat.st_ino, stat.st_mtime)
-        s.status_current = status
-        s.status_validator = (stat.st_ino, stat.st_mtime)
+        return s.status_store.load()
+
+    # Record the new status for a single tracker, None drops it.  Must be
+    # called with the status lock held after a status_load().
+    def status_save(s, bugid, summary):
+        s.status_store.update(bugid, summary)
+
+    # Fold the status journal into status.json and regenerate the status.yaml
+    # mirror.  This is done once at the end of each run.
+    def status_flush(s):
+        s.status_store.wait()
+        with s.lock_status():
+            s.status_store.compact()
+            s.status_store.save_yaml()
 
     # Returns a tuple (depth, master-bug-number, bug-number) which will be used
     # to sort a list of bug numbers.  By sorting by master-bug chain length we
@@ -238,37 +238,32 @@ def status_save(s, status):
     # Note #2: we are forming part of the sort key from external data, we
     # lookup the master_bug number and also count the master_bug link depth in
     # the status_start data which is an associative array of information by bug
-    # number.  This contains a master-bug element when such is present.
+    # number.  This contains a master-bug element when such is present.  The
+    # depth of each bug is precomputed by status_start_index.
     def tracker_key(s, bug_nr):
         # If we do not know this bug at all, order it last.
         if bug_nr not in s.status_start:
             return (100, 0, bug_nr)
 
-        # Follow the master-bug links we have recorded back up the hierachy
-        # counting the number of levels.
-        master_bug = bug_nr
-        depth = 0
-        while master_bug != '0':
-            master_bug = str(s.status_start.get(master_bug, {}).get('master-bug', 0))
-            depth += 1
-
         # Order by depth, master-bug, primary bug.
-        key = (depth, str(s.status_start.get(bug_nr, {}).get('master-bug', 0)), bug_nr)
+        key = (s.status_start_index.depth(bug_nr), str(s.status_start.get(bug_nr, {}).get('master-bug', 0)), bug_nr)
         return key
 
+    # Returns the master-bug chain recorded for this bug in status_start,
+    # closest parent first.
+    def tracker_ancestors(s, bug_nr):
+        return s.status_start_index.ancestors(bug_nr)
+
     def live_children(s, bug_nr):
         result = []
         with s.lock_status():
             status = s.status_load()
-
-        for child_nr, child_data in status.items():
-            master_bug = str(child_data.get('master-bug', 0))
-            if master_bug != bug_nr:
-                continue
-            series = child_data.get('series', 'unknown')
-            source = child_data.get('source', 'unknown')
-            target = child_data.get('target', 'unknown')
-            result.append((series, source, target, child_nr, child_data))
+            for child_nr in s.status_store.index.children(bug_nr):
+                child_data = status[child_nr]
+                series = child_data.get('series', 'unknown')
+                source = child_data.get('source', 'unknown')
+                target = child_data.get('target', 'unknown')
+                result.append((series, source, target, child_nr, child_data))
 
         return result
 
@@ -288,25 +283,21 @@ def live_trackers_for_target(s, series, source, target):
         result = []
         with s.lock_status():
             status = s.status_load()
+            trackers = s.status_store.index.trackers_for_target(series, source, target)
+            complete = s.status_store.index.phase('Complete')
 
-        for tracker_nr, tracker_data in status.items():
-            t_series = tracker_data.get('series', 'unknown')
-            t_source = tracker_data.get('source', 'unknown')
-            t_target = tracker_data.get('target', 'unknown')
-            t_phase = tracker_data.get('phase', 'unknown')
-
-            if (series == t_series and
-                source == t_source and
-                target == t_target and
-                t_phase != 'Complete'):
-                    result.append((tracker_nr, tracker_data))
+            for tracker_nr in trackers:
+                if tracker_nr not in complete:
+                    result.append((tracker_nr, status[tracker_nr]))
 
         return sorted(result, key=s.cycle_key)
 
     def live_dependants_rescan(s):
         result = []
+        # The live status changes under us once we drop the lock, scan a
+        # snapshot of it.
         with s.lock_status():
-            status = s.status_load()
+            status = dict(s.status_load())
 
         for child_nr, child_data in status.items():
             rescan = False
@@ -343,15 +334,9 @@ def live_dependants_rescan(s):
     def live_duplicates_mark(s, old, new):
         with s.lock_status():
             status = s.status_load()
-            modified = False
-            for child_nr, child_data in status.items():
-                # This tracker has no parent, skip it.
-                parent_nr = str(child_data.get('master-bug'))
-                if parent_nr is None:
-                    continue
-                # Unrelated to the duplication in process.
-                if parent_nr != old:
-                    continue
+            modified = []
+            for child_nr in s.status_store.index.children(old):
+                child_data = status[child_nr]
 
                 # Ignore snap-debs variants as those should remain tightly
                 # coupled with their parent.
@@ -365,10 +350,10 @@ def live_duplicates_mark(s, old, new):
 
                 # Mark this child as needing scanning by removing its scan time.
                 child_data['manager']['time-scanned'] = None
-                modified = True
+                modified.append(child_nr)
 
-            if modified:
-                s.status_save(status)
+            for child_nr in modified:
+                s.status_save(child_nr, status[child_nr])
 
     # Some changes to a tracker can only safely be applied while we have the
     # lock for that bug.  The easiest way to do that is trigger scanning of
@@ -403,7 +388,7 @@ def apply_fixes(s, bugid, bug):
                 bug.save()
 
             if status_modified:
-                s.status_save(status_all)
+                s.status_save(bugid, status)
 
     @property
     def lp(s):
@@ -433,13 +418,7 @@ def buglist(s):
                     if len(bits) < 3:
                         bits.append(bits[-1])
 
-                    for search_id, search_data in s.status_start.items():
-                        search_key = [
-                            search_data.get('series', '-'),
-                            search_data.get('source', '-'),
-                            search_data.get('target', '-')]
-                        if bits == search_key:
-                            bugs.append(search_id)
+                    bugs += s.status_start_index.trackers_for_target(*bits[0:3])
                 else:
                     cerror('    {}: bugid format unknown'.format(bugid), 'red')
                     continue
@@ -486,6 +465,7 @@ def manage(s):
 
         else:
             s.manage_payload()
+        s.status_flush()
         cinfo('Completed run ' + str(datetime.now()))
 
     # manage_payload
@@ -505,6 +485,8 @@ def manage_payload(s):
             if s.args.dependants_only:
                 buglist = s.live_dependants_rescan()
 
+            s.snap_prefetch(buglist)
+
             while len(buglist) > 0:
                 # Make sure that each bug only appears once.
                 buglist = list(set(buglist))
@@ -520,13 +502,18 @@ def manage_payload(s):
                 # Order such that parents are handled before their children.
                 buglist = list(sorted(buglist, key=s.tracker_key))
                 cinfo("manage_payload: scan={}".format(buglist))
-                for bugid in buglist:
-                    bugs_scanned += 1
-                    with s.lock_bug(bugid):
-                        cinfo('')
-                        cinfo("Processing ({}/{} pass={} total={}): {} ({})".format(bugs_scanned, bugs_total, bugs_pass, bugs_overall, bugid, s.lp.bug_url(bugid)))
+                pass_start = time.monotonic()
+                if s.jobs > 1:
+                    buglist_rescan += s.crank_parallel(buglist, bugs_pass, bugs_overall)
+                else:
+                    for bugid in buglist:
+                        bugs_scanned += 1
+                        with s.lock_bug(bugid):
+                            cinfo('')
+                            cinfo("Processing ({}/{} pass={} total={}): {} ({})".format(bugs_scanned, bugs_total, bugs_pass, bugs_overall, bugid, s.lp.bug_url(bugid)))
 
-                        buglist_rescan += s.crank(bugid)
+                            buglist_rescan += s.crank(bugid)
+                cinfo("manage_payload: pass={} bugs={} jobs={} elapsed={:.1f}s".format(bugs_pass, bugs_total, s.jobs, time.monotonic() - pass_start))
 
                 # If we are interested in scanning dependants, trigger them if
                 # they have a parent and that parent has been modified since
@@ -547,6 +534,66 @@ def manage_payload(s):
         cleave('WorkflowManager.manage_payload')
         return 0
 
+    # snap_prefetch
+    #
+    def snap_prefetch(s, buglist):
+        '''
+        Refresh the channel maps for all snaps referenced by the trackers we
+        are about to crank in one concurrent batch.
+        '''
+        center('WorkflowManager.snap_prefetch')
+        snap_names = set()
+        for bugid in buglist:
+            data = s.status_start.get(str(bugid))
+            if data is None:
+                continue
+            if not any(task.startswith('snap-') for task in data.get('task', {})):
+                continue
+            if data.get('variant', 'combo') == 'snap-debs':
+                snap_name = data.get('snap-name')
+                if snap_name is not None:
+                    snap_names.add(snap_name)
+                continue
+            series = s.kernel_series.lookup_series(codename=data.get('series'))
+            source = series.lookup_source(data.get('source')) if series is not None else None
+            if source is None:
+                continue
+            for snap in source.snaps:
+                if snap.primary:
+                    snap_names.add(snap.name)
+                    break
+        if len(snap_names) > 0:
+            SnapStore.prefetch(snap_names)
+        cleave('WorkflowManager.snap_prefetch')
+
+    # crank_parallel
+    #
+    def crank_parallel(s, buglist, bugs_pass, bugs_overall):
+        '''
+        Crank the bugs in buglist (already in tracker_key order) using a pool
+        of s.jobs worker processes, each bug once the WorkflowCrankSchedule
+        says its dependencies are complete.  Each worker takes the per-bug
+        lock for the bug it is cranking.
+        '''
+        global _crank_manager
+        center('WorkflowManager.crank_parallel')
+
+        schedule = WorkflowCrankSchedule(buglist, s.status_start, s.tracker_ancestors)
+
+        # Workers are forked, make sure no compaction is in progress as it
+        # holds the status lock.
+        s.status_store.wait()
+        _crank_manager = s
+
+        def progress(bugs_scanned, bugs_total):
+            return "{}/{} pass={} total={} jobs={}".format(bugs_scanned, bugs_total, bugs_pass, bugs_overall, s.jobs)
+
+        with ProcessPoolExecutor(max_workers=s.jobs, mp_context=multiprocessing.get_context('fork'), initializer=_crank_worker_init) as pool:
+            rescan = schedule.run(pool, _crank_worker, progress)
+
+        cleave('WorkflowManager.crank_parallel')
+        return rescan
+
     # crank
     #
     def crank(s, bugid):
@@ -666,6 +713,9 @@ def __crank(s, bugid):
             modified = False
             for l in e.args:
                 cerror(e.__class__.__name__ + ': ' + l)
+            # Task changes made before we bailed are still wanted.
+            if bug is not None:
+                bug.save_tasks()
 
         except WorkflowCrankError as e:
             modified = False
@@ -683,6 +733,7 @@ def __crank(s, bugid):
             for l in e.args:
                 cerror(e.__class__.__name__ + ': ' + l)
             if bug is not None:
+                bug.save_tasks()
                 critical = {'reason': {'crank-failure': 'Stalled -- ' + e.args[0]}}
                 s.status_set(bugid, update=critical, modified=False)
                 bug.accept_new()
@@ -701,7 +752,7 @@ def process_bug_tasks(s, bug):
 
         # Determine this bugs project.
         #
-        for task in bug.lpbug.tasks:
+        for task in bug.lp_tasks:
             task_name = task.bug_target_name
             if task_name in WorkflowBug.projects_tracked:
                 s.projectname = task_name
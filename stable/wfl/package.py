@@ -36,11 +36,74 @@ class SeriesLookupFailure(ShankError):
     pass
 
 
+# PackageBuildPrefetch
+#
+class PackageBuildPrefetch:
+    '''
+    Shared source publication lookups for all of the PackageBuilds of a
+    tracker.  Rather than asking each archive for the publications of a
+    source once per pocket we ask once per (archive, source) for all pockets
+    and split the result by pocket locally.  As each per-pocket query would
+    page through the entire publication history for that pocket anyway this
+    returns the same records in far fewer round-trips.
+
+    The builds and binaries of the matching publication are still fetched
+    per publication (getBuilds/getPublishedBinaries).  Launchpad has no way
+    to ask for those across several sources: getBuildRecords only covers
+    builds made in the archive itself, missing those of copied sources, and
+    getPublishedBinaries filters only by binary name.
+    '''
+
+    def __init__(self, series):
+        self.series = series
+        self._sources = {}
+        self._wanted = {}
+
+    # want
+    #
+    def want(self, archive, source_name, pocket):
+        '''
+        Record a lookup we will need so that prefetch() can gather them.
+        '''
+        self._wanted.setdefault((archive.reference, source_name), (archive, set()))[1].add(pocket)
+
+    # prefetch
+    #
+    def prefetch(self):
+        center(self.__class__.__name__ + '.prefetch')
+        for (key, (archive, pockets)) in sorted(self._wanted.items()):
+            if key not in self._sources:
+                self._lookup(archive, key[1])
+        self._wanted = {}
+        cleave(self.__class__.__name__ + '.prefetch')
+
+    def _lookup(self, archive, source_name):
+        key = (archive.reference, source_name)
+        by_pocket = {}
+        for pub in archive.getPublishedSources(distro_series=self.series, exact_match=True, source_name=source_name, order_by_date=True):
+            by_pocket.setdefault(pub.pocket, []).append(pub)
+        cdebug("prefetch: {} {} {}".format(archive.reference, source_name,
+            ' '.join('{}={}'.format(pocket, len(pubs)) for pocket, pubs in sorted(by_pocket.items()))))
+        self._sources[key] = by_pocket
+        return by_pocket
+
+    # published_sources
+    #
+    def published_sources(self, archive, source_name, pocket):
+        '''
+        The publications of source_name in pocket of archive, newest first.
+        '''
+        by_pocket = self._sources.get((archive.reference, source_name))
+        if by_pocket is None:
+            by_pocket = self._lookup(archive, source_name)
+        return by_pocket.get(pocket, [])
+
+
 # PackageBuild
 #
 class PackageBuild:
 
-    def __init__(self, bug, series, dependent, pocket, routing, package, version, abi, sloppy):
+    def __init__(self, bug, series, dependent, pocket, routing, package, version, abi, sloppy, prefetch=None):
         self.bug = bug
         self.series = series
         self.dependent = dependent
@@ -50,6 +113,7 @@ def __init__(self, bug, series, dependent, pocket, routing, package, version, ab
         self.srch_version = version
         self.srch_abi = abi
         self.srch_sloppy = sloppy
+        self.prefetch = PackageBuildPrefetch(series) if prefetch is None else prefetch
 
         self._data = None
 
@@ -70,7 +134,7 @@ def __is_fully_built(s, package, abi, archive, release, pocket, sloppy):
         # Do a loose match, we will select for the specific version we wanted
         # in __find_matches but this way we have the published version for
         # pocket emptyness checks.
-        ps = archive.getPublishedSources(distro_series=s.series, exact_match=True, source_name=package, pocket=pocket, order_by_date=True)
+        ps = s.prefetch.published_sources(archive, package, pocket)
         matches = s.__find_matches(ps, abi, release, sloppy)
         if len(matches) > 0 and matches[0].status in ('Pending', 'Published'):
             cdebug('    match: %s (%s)' % (release, abi), 'green')
@@ -124,9 +188,9 @@ def __find_matches(s, ps, abi, release, sloppy):
             dep_ver2 = '%s.%s' % (release, abi)
             for p in ps:
                 src_ver = p.source_package_version
-                cdebug('examining: %s' % src_ver)
+                cdebug(lambda: 'examining: %s' % src_ver)
                 if ((src_ver.startswith(dep_ver1 + '.') or src_ver.startswith(dep_ver2 + '.'))):
-                    cdebug('adding: %s' % src_ver, 'green')
+                    cdebug(lambda: 'adding: %s' % src_ver, 'green')
                     matches.append(p)
                     match = True
         else:
@@ -135,7 +199,7 @@ def __find_matches(s, ps, abi, release, sloppy):
                 src_ver = p.source_package_version
                 # Exact match or exact prefix plus '+somethingN'
                 if src_ver == release or (sloppy and src_ver.startswith(release + '+')):
-                    cdebug('adding: %s' % src_ver, 'green')
+                    cdebug(lambda: 'adding: %s' % src_ver, 'green')
                     matches.append(p)
                     match = True
 
@@ -193,7 +257,7 @@ def __sources_built(s, sources, archive, package, release, pocket):
         for build in builds:
             buildstate = build.buildstate
             ##print(build, build.buildstate, build.datebuilt)
-            cdebug("build arch={} status={}".format(build.arch_tag, buildstate))
+            cdebug(lambda: "build arch={} status={}".format(build.arch_tag, buildstate))
             if build.buildstate in (
                     'Needs building',
                     'Currently building',
@@ -260,7 +324,7 @@ def __sources_built(s, sources, archive, package, release, pocket):
                 arch_tag = binary.distro_arch_series_link.split('/')[-1]
             else:
                 arch_tag = 'all'
-            cdebug("binary arch={} status={}".format(arch_tag, binary.status))
+            cdebug(lambda: "binary arch={} status={}".format(arch_tag, binary.status))
             if binary.status == 'Pending':
                 status.add('PENDING')
             elif binary.status  == 'Published':
@@ -395,6 +459,9 @@ def get(self, name, default=None):
 #
 class Package():
 
+    # How long to wait for the message queue to confirm testing requests.
+    testing_request_timeout = 60
+
     # __init__
     #
     def __init__(s, lp, shankbug, ks=None):
@@ -599,6 +666,7 @@ def __determine_build_status(s):
         center('Sources::__determine_build_status')
 
         s._cache = {}
+        prefetch = PackageBuildPrefetch(s.distro_series)
 
         cinfo('')
         cinfo('Build Status:', 'cyan')
@@ -654,12 +722,21 @@ def __determine_build_status(s):
                     cwarn(s.bug.overall_reason)
                     continue
 
-                s._cache[dep][pocket] = PackageBuild(s.bug, s.distro_series, dep, pocket_from, s._routing[pocket_from], s.pkgs[dep], version, abi, sloppy)
+                s._cache[dep][pocket] = PackageBuild(s.bug, s.distro_series, dep, pocket_from, s._routing[pocket_from], s.pkgs[dep], version, abi, sloppy, prefetch=prefetch)
+                # The first route is always scanned, later ones only if it
+                # does not hold the version we want.
+                if len(s._routing[pocket_from]) > 0 and s._routing[pocket_from][0][0] is not None:
+                    (src_archive, src_pocket) = s._routing[pocket_from][0]
+                    prefetch.want(src_archive, s.pkgs[dep], src_pocket)
                 if pocket == scan_pockets[0]:
                     s._cache[dep]['ppa'] = s._cache[dep][pocket]
                 #cinfo('%-8s : %-5s / %-10s    (%s : %s) %s [%s %s]' % (pocket, info[0], info[5], info[3], info[4], info[6], src_archive.reference, src_pocket), 'cyan')
             Clog.indent -= 4
 
+        # Gather the source publications for every package and pocket in one
+        # go, the PackageBuilds are then instantiated from those.
+        prefetch.prefetch()
+
         #cdebug('')
         #cdebug('The Cache:', 'cyan')
         #for d in sorted(s._cache):
@@ -1749,7 +1826,7 @@ def check_component_in_pocket(s, tstamp_prop, pocket):
 
     # send_testing_message
     #
-    def send_testing_message(s, op="sru", ppa=False, flavour="generic", meta=None):
+    def send_testing_message(s, op="sru", ppa=False, flavour="generic", meta=None, publishers=None):
         # Send a message to the message queue. This will kick off testing of
         # the kernel packages in the -proposed pocket.
         #
@@ -1812,11 +1889,15 @@ def send_testing_message(s, op="sru", ppa=False, flavour="generic", meta=None):
             # ckct and emit the request into both.  The request will either be
             # understood and consumed or lost in each.  Once we have migrated
             # everything to the new server we can drop the first of these.
-            mq = MsgQueue()
-            mq.publish(msg['key'], msg)
+            if publishers is None:
+                mq = MsgQueue()
+                mq.publish(msg['key'], msg)
 
-            mq = MsgQueueCkct()
-            mq.publish(msg['key'], msg)
+                mq = MsgQueueCkct()
+                mq.publish(msg['key'], msg)
+            else:
+                for publisher in publishers:
+                    publisher.publish(msg['key'], msg)
 
         return msg
 
@@ -1887,13 +1968,27 @@ def test_flavours(s):
     # send_testing_requests
     #
     def send_testing_requests(s, op="sru", ppa=False):
-        for flavour_meta in s.test_flavour_meta():
-            s.send_testing_request(op=op, ppa=ppa, flavour=flavour_meta[0], meta=flavour_meta[1])
+        # Send every flavour over a single pipelined connection to each
+        # service rather than connecting afresh for each message.
+        publishers = None
+        if not (s.bug._dryrun or s.bug._no_announcements):
+            publishers = [MsgQueue(connect=False).publisher(), MsgQueueCkct(connect=False).publisher()]
+        try:
+            for flavour_meta in s.test_flavour_meta():
+                s.send_testing_request(op=op, ppa=ppa, flavour=flavour_meta[0], meta=flavour_meta[1], publishers=publishers)
+        finally:
+            delivered = True
+            for publisher in publishers or []:
+                delivered = publisher.close(timeout=s.testing_request_timeout) and delivered
+        # Some may well have been delivered, failing here would have the retry
+        # send them all again; carry on and leave it to the logs.
+        if not delivered:
+            cwarn("{}: testing requests not confirmed by the message queue within {}s".format(s.bug.lpbug.id, s.testing_request_timeout))
 
     # send_testing_request
     #
-    def send_testing_request(s, op="sru", ppa=False, flavour="generic", meta=None):
-        msg = s.send_testing_message(op, ppa, flavour, meta)
+    def send_testing_request(s, op="sru", ppa=False, flavour="generic", meta=None, publishers=None):
+        msg = s.send_testing_message(op, ppa, flavour, meta, publishers=publishers)
 
         where = " uploaded" if not ppa else " available in ppa"
         subject = "[" + s.series + "] " + s.name + " " + flavour + " " + s.version + where
@@ -7,11 +7,16 @@
 except ImportError:
     from urllib2 import urlopen, urlencode, Request, URLError, HTTPError
 
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
+import os
+import threading
+import time
 from .errors import ShankError
-from datetime import datetime
 
 from ktl.kernel_series                          import KernelSeries
+from ktl.swm_codec                              import datetime_decode
 
 from wfl.git_tag                                import GitTagsSnap
 from wfl.log                                    import center, cleave, cinfo, cerror, cdebug
@@ -34,6 +39,109 @@ class SnapStoreError(ShankError):
     pass
 
 
+# SnapStoreCache
+#
+class SnapStoreCache:
+    """
+    A process-wide cache of snap store channel maps, keyed by snap name and
+    store-id.  Entries are fresh for ttl seconds after they were fetched,
+    after which they are kept for conditional revalidation.  When a path is
+    supplied entries are also persisted there, one file per key, so they
+    may be shared with other processes.
+    """
+    ttl = 300
+
+    # __init__
+    #
+    def __init__(s, path=None, ttl=None):
+        s.path = path
+        if ttl is not None:
+            s.ttl = ttl
+        s.lock = threading.Lock()
+        s.entries = {}
+
+    def _entry_path(s, key):
+        digest = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(s.path, digest + '.json')
+
+    # lookup
+    #
+    def lookup(s, key):
+        """
+        Return the (entry, fresh) pair for this key, entry is None when
+        we have nothing cached.
+        """
+        with s.lock:
+            entry = s.entries.get(key)
+        if entry is None and s.path is not None:
+            try:
+                with open(s._entry_path(key)) as rfd:
+                    data = json.load(rfd)
+                if data.get('key') == list(key):
+                    entry = s._entry(data['time'], data.get('etag'), data['records'])
+                    with s.lock:
+                        s.entries.setdefault(key, entry)
+            except (OSError, ValueError, KeyError, TypeError):
+                entry = None
+        if entry is None:
+            return (None, False)
+        return (entry, time.time() - entry['time'] < s.ttl)
+
+    def _entry(s, when, etag, records):
+        # Build the channel map, parsing released-at only once per entry.
+        channel_map = {}
+        for channel_rec in records:
+            channel = (channel_rec['channel']['architecture'],
+                channel_rec['channel']['track'] + '/' +
+                channel_rec['channel']['risk'])
+            entry = {}
+            entry['version'] = channel_rec['version']
+            entry['revision'] = channel_rec['revision']
+            entry['released-at'] = channel_rec['channel']['released-at']
+            released_at = entry['released-at']
+            entry['released-at-date'] = datetime_decode(released_at) if released_at else None
+            channel_map[channel] = entry
+        return {'time': when, 'etag': etag, 'records': records, 'map': channel_map}
+
+    # store
+    #
+    def store(s, key, etag, records):
+        """
+        Record a freshly fetched channel map and return it.
+        """
+        entry = s._entry(time.time(), etag, records)
+        with s.lock:
+            s.entries[key] = entry
+        s._save(key, entry)
+        return entry['map']
+
+    # revalidated
+    #
+    def revalidated(s, key, entry):
+        """
+        The store confirmed our copy is current, restart its TTL.
+        """
+        entry = dict(entry, time=time.time())
+        with s.lock:
+            s.entries[key] = entry
+        s._save(key, entry)
+        return entry['map']
+
+    def _save(s, key, entry):
+        if s.path is None:
+            return
+        data = {'key': list(key), 'time': entry['time'], 'etag': entry['etag'], 'records': entry['records']}
+        path = s._entry_path(key)
+        try:
+            os.makedirs(s.path, exist_ok=True)
+            tmp = '{}.{}.{}'.format(path, os.getpid(), threading.get_ident())
+            with open(tmp, 'w') as wfd:
+                json.dump(data, wfd)
+            os.rename(tmp, path)
+        except OSError as e:
+            cinfo("SnapStoreCache: {} unable to save ({})".format(path, e))
+
+
 # SnapStore
 #
 class SnapStore:
@@ -44,6 +152,9 @@ class SnapStore:
     common_headers = {'Snap-Device-Series': '16'}
     # curl -H 'Snap-Device-Series: 16' 'https://api.snapcraft.io/v2/snaps/info/pc-kernel?fields=channel-map,architecture,channel,revision,version'
 
+    # Channel maps shared by all SnapStore instances in this process.
+    cache = SnapStoreCache()
+
     # __init__
     #
     def __init__(s, snap):
@@ -65,34 +176,46 @@ def channel_map_lookup(s):
         """
         cdebug("    snap.name={}".format(s.snap.name))
         cdebug("    snap.publish_to={}".format(s.snap.publish_to))
+        return s.channel_map_fetch(s.snap.name, s.secrets.get(s.snap.name, {}).get('store-id'))
+
+    # channel_map_fetch
+    #
+    @classmethod
+    def channel_map_fetch(cls, snap_name, store_id):
+        """
+        Return the channel map for this snap, from the cache if it is fresh,
+        otherwise from the snap store revalidating any cached copy.
+        """
+        key = (snap_name, store_id)
+        (cached, fresh) = cls.cache.lookup(key)
+        if fresh:
+            cdebug("SnapStore: {} channel-map cached".format(key))
+            return cached['map']
 
-        result = {}
         try:
-            headers = s.common_headers
+            headers = dict(cls.common_headers)
 
             params = urlencode({'fields': 'revision,version'})
-            store_id = s.secrets.get(s.snap.name, {}).get('store-id')
             if store_id is not None:
-                cdebug('SnapStore: {} using snap specific store-id')
+                cdebug('SnapStore: {} using snap specific store-id'.format(snap_name))
                 headers['Snap-Device-Store'] = store_id
-            url = "{}?{}".format(urljoin(s.base_url, s.snap.name), params)
+            if cached is not None and cached['etag'] is not None:
+                headers['If-None-Match'] = cached['etag']
+            url = "{}?{}".format(urljoin(cls.base_url, snap_name), params)
             req = Request(url, headers=headers)
             with urlopen(req) as resp:
                 raw_data = resp.read().decode('utf-8')
                 cinfo("SNAP JSON: {}".format(raw_data))
                 response = json.loads(raw_data)
                 cdebug(response)
-                for channel_rec in response['channel-map']:
-                    channel = (channel_rec['channel']['architecture'],
-                        channel_rec['channel']['track'] + '/' +
-                        channel_rec['channel']['risk'])
-                    entry = {}
-                    entry['version'] = channel_rec['version']
-                    entry['revision'] = channel_rec['revision']
-                    entry['released-at'] = channel_rec['channel']['released-at']
-                    result[channel] = entry
+                return cls.cache.store(key, resp.headers.get('ETag'), response['channel-map'])
 
         except HTTPError as e:
+            # Our cached copy is still current.
+            if hasattr(e, 'code') and e.code == 304 and cached is not None:
+                cdebug("SnapStore: {} channel-map revalidated".format(key))
+                return cls.cache.revalidated(key, cached)
+
             # Error 404 is returned if the snap has never been published
             # to the given channel.
             store_err = False
@@ -110,10 +233,33 @@ def channel_map_lookup(s):
                     store_err = True
             if not store_err:
                 raise SnapStoreError('failed to retrieve store URL (%s)' % str(e))
-        except (URLError, KeyError) as e:
+            return cls.cache.store(key, None, [])
+        except (URLError, KeyError, ValueError) as e:
             raise SnapStoreError('failed to retrieve store URL (%s: %s)' %
                                  (type(e), str(e)))
-        return result
+
+    # prefetch
+    #
+    @classmethod
+    def prefetch(cls, snap_names, jobs=8):
+        """
+        Refresh the channel maps for all of the listed snaps concurrently,
+        any failures are left for the individual lookups to report.
+        """
+        center(cls.__name__ + '.prefetch')
+        secrets = Secrets().get('snaps') or {}
+        keys = set((snap_name, secrets.get(snap_name, {}).get('store-id')) for snap_name in snap_names)
+
+        def fetch(key):
+            try:
+                cls.channel_map_fetch(*key)
+            except SnapStoreError as e:
+                cinfo("SnapStore: {} prefetch failed ({})".format(key[0], e))
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(fetch, sorted(keys, key=str)))
+        cinfo("SnapStore: prefetched {} channel-maps".format(len(keys)))
+        cleave(cls.__name__ + '.prefetch')
 
     def channel_map(s):
         if s._channel_map is None:
@@ -146,14 +292,7 @@ def last_published(self):
                     if key not in data:
                         continue
 
-                    # Convert the iso8601 format timestring into one
-                    # which strptime actually can parse.
-                    released_at = data[key]['released-at']
-                    released_at = released_at[:-3] + released_at[-2:]
-                    #print("D?", released_at)
-
-                    date_published = datetime.strptime(released_at,
-                        "%Y-%m-%dT%H:%M:%S.%f%z")
+                    date_published = data[key]['released-at-date']
                     cinfo("SNAP-RELEASED-AT {} -> {} > {}".format(data[key]['released-at'], date_published, last_published))
                     if last_published is None or date_published > last_published:
                         last_published = date_published
@@ -0,0 +1,343 @@
+#
+# status_store -- journaled persistent storage for the swm tracker status
+#
+import json
+import os
+import threading
+import yaml
+
+from ktl.swm_codec              import json_object_decode, json_object_encode
+from wfl.log                    import center, cleave, cinfo, cdebug
+
+
+# WorkflowStatusIndex
+#
+class WorkflowStatusIndex:
+    '''
+    Secondary indexes over a tracker status dictionary: master-bug to
+    children, (series, source, target) to trackers, and phase to trackers.
+    The keys each tracker was indexed under are recorded so it can be
+    removed again even if its data has since been modified in place.
+    '''
+    # __init__
+    #
+    def __init__(s, status):
+        s.status = status
+        s._children = {}
+        s._targets = {}
+        s._phases = {}
+        s._keys = {}
+        s._depth = {}
+        for bugid, data in status.items():
+            s.add(bugid, data)
+
+    def _keys_for(s, data):
+        master_bug = str(data.get('master-bug', 0))
+        target = (data.get('series', 'unknown'), data.get('source', 'unknown'), data.get('target', 'unknown'))
+        phase = data.get('phase', 'unknown')
+        return (master_bug, target, phase)
+
+    # add
+    #
+    def add(s, bugid, data):
+        if bugid in s._keys:
+            s.remove(bugid)
+        keys = s._keys[bugid] = s._keys_for(data)
+        (master_bug, target, phase) = keys
+        s._children.setdefault(master_bug, set()).add(bugid)
+        s._targets.setdefault(target, set()).add(bugid)
+        s._phases.setdefault(phase, set()).add(bugid)
+        s._depth.clear()
+
+    # remove
+    #
+    def remove(s, bugid):
+        keys = s._keys.pop(bugid, None)
+        if keys is None:
+            return
+        (master_bug, target, phase) = keys
+        s._children[master_bug].discard(bugid)
+        s._targets[target].discard(bugid)
+        s._phases[phase].discard(bugid)
+        s._depth.clear()
+
+    # children
+    #
+    def children(s, master_bug):
+        '''
+        The trackers whose master-bug is master_bug.
+        '''
+        return sorted(s._children.get(str(master_bug), ()))
+
+    # trackers_for_target
+    #
+    def trackers_for_target(s, series, source, target):
+        return sorted(s._targets.get((series, source, target), ()))
+
+    # phase
+    #
+    def phase(s, phase):
+        return s._phases.get(phase, set())
+
+    # ancestors
+    #
+    def ancestors(s, bugid):
+        '''
+        The master-bug chain for this tracker, closest parent first.
+        '''
+        result = []
+        master_bug = s._keys[bugid][0] if bugid in s._keys else '0'
+        while master_bug != '0':
+            result.append(master_bug)
+            master_bug = s._keys[master_bug][0] if master_bug in s._keys else '0'
+        return result
+
+    # depth
+    #
+    def depth(s, bugid):
+        '''
+        The number of levels in the master-bug chain including this tracker,
+        memoised so repeated sort key lookups do not walk the chain.
+        '''
+        depth = s._depth.get(bugid)
+        if depth is None:
+            master_bug = s._keys[bugid][0] if bugid in s._keys else '0'
+            if master_bug == '0':
+                depth = 1
+            elif master_bug not in s._keys:
+                depth = 2
+            else:
+                depth = s.depth(master_bug) + 1
+            s._depth[bugid] = depth
+        return depth
+
+
+# WorkflowStatusStore
+#
+class WorkflowStatusStore:
+    '''
+    Persistent tracker status made up of a full snapshot (status.json) plus a
+    journal of per-tracker updates made since that snapshot was written.
+
+    Each update appends a single line to the journal recording the complete
+    new summary for one tracker (or null when the tracker is dropped).  The
+    in-memory index is kept in sync by replaying only the journal lines added
+    since we last looked.  A WorkflowStatusIndex over the status is rebuilt
+    on each full reload and maintained incrementally from there.  Once the
+    journal grows beyond compact_records entries it is folded back into the
+    snapshot, in the background where possible.  The YAML mirror is only
+    written when explicitly requested.
+
+    All methods other than compact_background() expect the caller to hold
+    the status lock; that lock is supplied so background compaction can
+    take it for itself.
+    '''
+    compact_records = 256
+
+    # __init__
+    #
+    def __init__(s, path='status.json', altpath='status.yaml', journal_path=None, lock=None, compact_records=None):
+        s.path = path
+        s.altpath = altpath
+        s.journal_path = path + '.journal' if journal_path is None else journal_path
+        s.lock = lock
+        if compact_records is not None:
+            s.compact_records = compact_records
+
+        s.status = {}
+        s.index = WorkflowStatusIndex(s.status)
+        s.validator = None
+        s.journal_ino = None
+        s.journal_offset = 0
+        s.journal_records = 0
+
+        s._compactor = None
+
+    def _stat(s, path):
+        try:
+            return os.stat(path)
+        except FileNotFoundError:
+            return None
+
+    # load
+    #
+    def load(s):
+        '''
+        Bring the in-memory index up to date with the on-disk snapshot and
+        journal and return it.  Only a changed snapshot triggers a full
+        reload, otherwise we simply replay any new journal entries.
+        '''
+        stat = s._stat(s.path)
+        validator = (stat.st_ino, stat.st_mtime) if stat is not None else None
+        jstat = s._stat(s.journal_path)
+        journal_ino = jstat.st_ino if jstat is not None else None
+        journal_size = jstat.st_size if jstat is not None else 0
+
+        if (validator != s.validator or journal_ino != s.journal_ino or
+                journal_size < s.journal_offset):
+            cinfo("VALIDATOR: {} {}".format(s.validator, validator))
+            status = {}
+            if stat is not None:
+                with open(s.path) as rfd:
+                    data = json.load(rfd, object_hook=json_object_decode)
+                status = data.get('trackers', data)
+            s.status = status
+            s.index = WorkflowStatusIndex(status)
+            s.validator = validator
+            s.journal_ino = journal_ino
+            s.journal_offset = 0
+            s.journal_records = 0
+
+        if journal_size > s.journal_offset:
+            s._replay(journal_size)
+
+        return s.status
+
+    def _replay(s, journal_size):
+        with open(s.journal_path, 'rb') as rfd:
+            rfd.seek(s.journal_offset)
+            data = rfd.read(journal_size - s.journal_offset)
+
+        # Only consume complete records, a partial trailing record is still
+        # being written (or was torn by a crash and will be skipped once the
+        # next writer terminates it).
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].split(b'\n'):
+            if len(line) == 0:
+                continue
+            try:
+                record = json.loads(line.decode('utf-8'), object_hook=json_object_decode)
+                bugid = record['tracker']
+                summary = record['status']
+            except (ValueError, KeyError, TypeError):
+                cinfo("status journal: {} dropping corrupt record".format(s.journal_path), 'red')
+                continue
+            s._apply(bugid, summary)
+            s.journal_records += 1
+        s.journal_offset += end
+
+    def _apply(s, bugid, summary):
+        if summary is None:
+            s.status.pop(bugid, None)
+            s.index.remove(bugid)
+        else:
+            s.status[bugid] = summary
+            s.index.add(bugid, summary)
+
+    # get
+    #
+    def get(s, bugid, default=None):
+        return s.load().get(bugid, default)
+
+    # update
+    #
+    def update(s, bugid, summary):
+        '''
+        Record a new summary for a single tracker, None drops the tracker.
+        The in-memory index must be current (see load()) before calling.
+        '''
+        center(s.__class__.__name__ + '.update')
+        record = json.dumps({'tracker': bugid, 'status': summary},
+            default=json_object_encode, separators=(',', ':')) + '\n'
+        record = record.encode('utf-8')
+
+        with open(s.journal_path, 'ab') as afd:
+            stat = os.fstat(afd.fileno())
+            # As we are current anything beyond our offset is a torn record
+            # left behind by a crashed writer, terminate it so ours is parsed
+            # on its own.
+            if stat.st_size != s.journal_offset:
+                record = b'\n' + record
+            afd.write(record)
+            afd.flush()
+            os.fsync(afd.fileno())
+
+            # If we created the journal this is now the one we are following.
+            s.journal_ino = stat.st_ino
+            s.journal_offset = stat.st_size + len(record)
+        s.journal_records += 1
+
+        s._apply(bugid, summary)
+        cdebug("status journal: {} records={}".format(bugid, s.journal_records))
+
+        if s.journal_records >= s.compact_records:
+            s.compact_background()
+        cleave(s.__class__.__name__ + '.update')
+
+    # compact
+    #
+    def compact(s):
+        '''
+        Fold the journal into a new full snapshot and start a fresh journal.
+        '''
+        center(s.__class__.__name__ + '.compact')
+        status = s.load()
+
+        # Use a top-level trackers collection to allow us to extend with
+        # non-tracker information later.
+        data = {'trackers': status}
+
+        with open(s.path + '.new', 'w') as wfd:
+            json.dump(data, fp=wfd, default=json_object_encode, separators=(',', ':'))
+        os.rename(s.path + '.new', s.path)
+
+        # Anyone following the old journal will notice the snapshot change
+        # and reload before looking at the new journal.
+        with open(s.journal_path + '.new', 'w'):
+            pass
+        os.rename(s.journal_path + '.new', s.journal_path)
+
+        # We are writing the files, update our cache.
+        stat = os.stat(s.path)
+        s.validator = (stat.st_ino, stat.st_mtime)
+        s.journal_ino = os.stat(s.journal_path).st_ino
+        s.journal_offset = 0
+        s.journal_records = 0
+        cinfo("status journal: compacted {} trackers".format(len(status)))
+        cleave(s.__class__.__name__ + '.compact')
+
+    # compact_background
+    #
+    def compact_background(s):
+        '''
+        Request a compaction without holding up the caller.  Without a lock
+        to serialise against the caller we have to compact synchronously.
+        '''
+        if s.lock is None:
+            s.compact()
+            return
+        if s._compactor is not None and s._compactor.is_alive():
+            return
+        s._compactor = threading.Thread(target=s._compact_locked, name='status-compact', daemon=True)
+        s._compactor.start()
+
+    def _compact_locked(s):
+        with s.lock():
+            if s.journal_records >= s.compact_records:
+                s.compact()
+
+    # wait
+    #
+    def wait(s):
+        '''
+        Wait for any background compaction to finish.  This must not be
+        called with the status lock held.
+        '''
+        if s._compactor is not None:
+            s._compactor.join()
+            s._compactor = None
+
+    # save_yaml
+    #
+    def save_yaml(s):
+        '''
+        Regenerate the YAML mirror of the current status.
+        '''
+        center(s.__class__.__name__ + '.save_yaml')
+        data = {'trackers': s.load()}
+        with open(s.altpath + '.new', 'w') as wfd:
+            yaml.dump(data, wfd, default_flow_style=False)
+        os.rename(s.altpath + '.new', s.altpath)
+        cleave(s.__class__.__name__ + '.save_yaml')
+
+# vi:set ts=4 sw=4 expandtab:
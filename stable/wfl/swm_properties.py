@@ -0,0 +1,183 @@
+#
+# swm_properties -- parsing and change detection for the swm properties
+#                   held in a tracking bug's description
+#
+import hashlib
+import os
+import yaml
+
+from .log                               import cdebug
+
+
+# swm_properties_parse
+#
+def swm_properties_parse(description):
+    '''
+    Parse the properties following the '-- swm properties --' marker in a
+    bug description.  Returns (properties, error), error being the first
+    line of the parse failure message or None.
+    '''
+    retval = {}
+    error = None
+    started = False
+    buf = ''
+
+    for l in description.split('\n'):
+        if started:
+            buf += l + '\n'
+        if l.startswith('-- swm properties --'):
+            started = True
+
+    if started and buf is not None:
+        # Launchpad will convert leading spaces into utf-8 non-breaking spaces
+        # when you manually edit the description in the web interface.
+        buf = buf.replace('\xa0', ' ')
+        try:
+            retval = yaml.safe_load(buf)
+            if retval is None:
+                retval = {}
+        except Exception as e:
+            retval = {}
+            error = str(e).split('\n')[0]
+
+    return (retval, error)
+
+
+# swm_properties_block
+#
+def swm_properties_block(description):
+    '''
+    The raw text following the '-- swm properties --' marker.
+    '''
+    lines = description.split('\n')
+    for idx, l in enumerate(lines):
+        if l.startswith('-- swm properties --'):
+            return '\n'.join(lines[idx + 1:])
+    return None
+
+
+# swm_properties_equal
+#
+def swm_properties_equal(a, b):
+    '''
+    Structural comparison of two sets of properties.  Unlike == this also
+    insists the types match; True == 1 but they are not emitted the same.
+    '''
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        if len(a) != len(b):
+            return False
+        for key, value in a.items():
+            if key not in b or not swm_properties_equal(value, b[key]):
+                return False
+        return True
+    if isinstance(a, list):
+        if len(a) != len(b):
+            return False
+        for value_a, value_b in zip(a, b):
+            if not swm_properties_equal(value_a, value_b):
+                return False
+        return True
+    return a == b
+
+
+# SwmPropertiesCache
+#
+class SwmPropertiesCache:
+    '''
+    Parsed swm properties keyed by a hash of the description they came
+    from, so each distinct description is only parsed once per process.
+
+    We also remember which descriptions we have written ourselves.  Those
+    hold exactly the rendered form of their own properties, so when the
+    properties are unchanged on save we can reuse that text rather than
+    rendering them again.  When a path is supplied these are appended
+    there, one hash per line, so that knowledge survives between runs.
+    Bump render_version whenever the rendered form changes.
+    '''
+    render_version = 1
+    max_entries = 256
+    max_canonical = 50000
+
+    # __init__
+    #
+    def __init__(s, path=None):
+        s.path = path
+        s.entries = {}
+        s._canonical = None
+
+    # key
+    #
+    def key(s, description):
+        return hashlib.sha1('{}\n{}'.format(s.render_version, description).encode('utf-8')).hexdigest()
+
+    # lookup
+    #
+    def lookup(s, description):
+        '''
+        Return the cache entry for this description: its key, the pristine
+        parsed properties, any parse error, and its properties block when
+        that is known to be in our rendered form.  Callers must copy the
+        properties before modifying them.
+        '''
+        key = s.key(description)
+        entry = s.entries.get(key)
+        if entry is None:
+            (props, error) = swm_properties_parse(description)
+            entry = {'key': key, 'props': props, 'error': error, 'rendered': None}
+            if error is None and s.canonical(key):
+                entry['rendered'] = swm_properties_block(description)
+            if len(s.entries) >= s.max_entries:
+                del s.entries[next(iter(s.entries))]
+            s.entries[key] = entry
+        return entry
+
+    def _canonical_load(s):
+        canonical = []
+        if s.path is not None:
+            try:
+                with open(s.path) as rfd:
+                    canonical = rfd.read().split()
+            except OSError:
+                pass
+
+            # Trim back to the most recent half once over our limit.
+            if len(canonical) > s.max_canonical:
+                canonical = canonical[-(s.max_canonical // 2):]
+                try:
+                    with open(s.path + '.new', 'w') as wfd:
+                        wfd.write(''.join(key + '\n' for key in canonical))
+                    os.rename(s.path + '.new', s.path)
+                except OSError:
+                    pass
+        s._canonical = set(canonical)
+
+    # canonical
+    #
+    def canonical(s, key):
+        if s._canonical is None:
+            s._canonical_load()
+        return key in s._canonical
+
+    # canonical_add
+    #
+    def canonical_add(s, description):
+        '''
+        Record a description we have rendered ourselves.
+        '''
+        key = s.key(description)
+        if s.canonical(key):
+            return
+        s._canonical.add(key)
+        cdebug(lambda: 'swm-properties: canonical {}'.format(key))
+        if s.path is not None:
+            try:
+                os.makedirs(os.path.dirname(s.path), exist_ok=True)
+                # Single short appends, concurrent writers will not interleave.
+                with open(s.path, 'a') as afd:
+                    afd.write(key + '\n')
+            except OSError:
+                pass
+
+# vi:set ts=4 sw=4 expandtab:
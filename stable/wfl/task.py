@@ -5,6 +5,143 @@
 from .log                               import cdebug, center, cleave, cinfo, cwarn
 
 
+# WorkflowBugTaskPerson
+#
+class WorkflowBugTaskPerson(object):
+    '''
+    Stand-in for a Launchpad person which knows only what its link tells
+    us, in particular the username.  Avoids fetching the person just to
+    report who a task is assigned to.
+    '''
+
+    # __init__
+    #
+    def __init__(s, link):
+        s.self_link = link
+        s.username = link[link.rindex('~') + 1:]
+
+    def __str__(s):
+        return s.username
+
+    def __eq__(s, other):
+        return isinstance(other, WorkflowBugTaskPerson) and s.self_link == other.self_link
+
+
+# WorkflowBugTaskSnapshotEntry
+#
+class WorkflowBugTaskSnapshotEntry(object):
+    '''
+    A single task within a WorkflowBugTaskSnapshot.  Presents the parts of
+    the lpltk BugTask interface we use; reads are served from the entry
+    representation returned by the collection fetch and writes are held
+    until the snapshot is saved.
+    '''
+
+    # __init__
+    #
+    def __init__(s, snapshot, lp_bug_task):
+        s.snapshot = snapshot
+        s.lp_bug_task = lp_bug_task
+        s.bug_target_name = lp_bug_task.bug_target_name
+        s.__assignee = False
+
+    # status
+    #
+    @property
+    def status(s):
+        return s.lp_bug_task.status
+
+    @status.setter
+    def status(s, value):
+        # Moving Incomplete to Incomplete is how we restart the expiry
+        # clock, Launchpad only sees that if we bounce through New which
+        # has to be written immediately.
+        if value == 'Incomplete' and s.lp_bug_task.status == 'Incomplete':
+            s.lp_bug_task.status = 'New'
+            s.lp_bug_task.lp_save()
+
+        s.lp_bug_task.status = value
+        s.snapshot.modify(s)
+
+    # importance
+    #
+    @property
+    def importance(s):
+        return s.lp_bug_task.importance
+
+    # date_left_new
+    #
+    @property
+    def date_left_new(s):
+        return s.lp_bug_task.date_left_new
+
+    # assignee
+    #
+    @property
+    def assignee(s):
+        if s.__assignee is False:
+            link = s.lp_bug_task.assignee_link
+            s.__assignee = WorkflowBugTaskPerson(link) if link is not None else None
+        return s.__assignee
+
+    @assignee.setter
+    def assignee(s, value):
+        s.lp_bug_task.assignee = value
+        s.__assignee = WorkflowBugTaskPerson(value.self_link) if value is not None else None
+        s.snapshot.modify(s)
+
+
+# WorkflowBugTaskSnapshot
+#
+class WorkflowBugTaskSnapshot(object):
+    '''
+    All of the tasks on a bug taken from a single fetch of its bug_tasks
+    collection.  The collection carries the full representation of each
+    task, including the links to the objects it references, so status,
+    importance and assignee can be answered without a round trip per
+    attribute.  Modified tasks are written back once each by save(); a
+    PreconditionFailed there is passed to the caller to retry against a
+    fresh snapshot exactly as it would have been for an immediate write.
+    '''
+
+    # __init__
+    #
+    def __init__(s, lp_bug):
+        center(s.__class__.__name__ + '.__init__')
+        s.tasks = [WorkflowBugTaskSnapshotEntry(s, lp_bug_task) for lp_bug_task in lp_bug.bug_tasks_collection]
+        s.modified = []
+        cdebug(lambda: '    tasks: {}'.format(len(s.tasks)))
+        cleave(s.__class__.__name__ + '.__init__')
+
+    def __iter__(s):
+        return iter(s.tasks)
+
+    def __len__(s):
+        return len(s.tasks)
+
+    # modify
+    #
+    def modify(s, task):
+        if task not in s.modified:
+            s.modified.append(task)
+
+    # save
+    #
+    def save(s):
+        '''
+        Write back every modified task.  Each task is only dropped from the
+        pending list once it is saved, so a failed save leaves the rest of
+        the pending writes in place.
+        '''
+        center(s.__class__.__name__ + '.save')
+        while len(s.modified) > 0:
+            task = s.modified[0]
+            cdebug(lambda: '    saving task: {}'.format(task.bug_target_name))
+            task.lp_bug_task.lp_save()
+            s.modified.pop(0)
+        cleave(s.__class__.__name__ + '.save')
+
+
 # WorkflowBugTask
 #
 class WorkflowBugTask(object):
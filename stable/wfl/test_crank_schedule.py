@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import threading
+from time               import sleep
+import unittest
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(sys.argv[0]), '..')))
+
+from wfl.crank_schedule import WorkflowCrankSchedule
+
+
+class TestWorkflowCrankSchedule(unittest.TestCase):
+
+    # 1 <- 2 <- 3 and 1 <- 4, 5 on its own with a master outside this pass,
+    # 6 and 7 new this run.
+    masters = {'1': [], '2': ['1'], '3': ['2', '1'], '4': ['1'], '5': ['99']}
+    buglist = ['1', '5', '2', '4', '3', '6', '7']
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.events = []
+        self.progress = []
+
+    def crank(self, bugid, progress):
+        with self.lock:
+            self.events.append(('start', bugid))
+            self.progress.append(progress)
+        # Long enough for anything started too early to overlap.
+        sleep(0.02)
+        with self.lock:
+            self.events.append(('end', bugid))
+        return ['rescan-' + bugid] if bugid in ('3', '6') else []
+
+    def run_schedule(self, workers):
+        schedule = WorkflowCrankSchedule(self.buglist, self.masters, lambda bugid: self.masters[bugid])
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return schedule.run(pool, self.crank, lambda scanned, total: '{}/{}'.format(scanned, total))
+
+    def assertAfter(self, bugid, after):
+        started = self.events.index(('start', bugid))
+        for other in after:
+            self.assertLess(self.events.index(('end', other)), started, "{} started before {} ended".format(bugid, other))
+
+    def test_waits(self):
+        schedule = WorkflowCrankSchedule(self.buglist, self.masters, lambda bugid: self.masters[bugid])
+        self.assertEqual(schedule.waits['1'], set())
+        self.assertEqual(schedule.waits['3'], set(['1', '2']))
+        # Masters outside this pass do not hold us up.
+        self.assertEqual(schedule.waits['5'], set())
+        self.assertEqual(schedule.waits['6'], set(['1', '2', '3', '4', '5']))
+
+    def test_ancestors(self):
+        for workers in (1, 4):
+            self.events = []
+            self.run_schedule(workers)
+            self.assertEqual(sorted(bugid for (what, bugid) in self.events if what == 'start'), sorted(self.buglist))
+            self.assertAfter('2', ['1'])
+            self.assertAfter('3', ['1', '2'])
+            self.assertAfter('4', ['1'])
+
+    def test_unknown_last(self):
+        for workers in (1, 4):
+            self.events = []
+            self.run_schedule(workers)
+            for bugid in ('6', '7'):
+                self.assertAfter(bugid, ['1', '2', '3', '4', '5'])
+
+    def test_independent_concurrent(self):
+        # 5 does not wait for 1, it is running while 1 is.
+        both = threading.Barrier(2, timeout=5)
+
+        def crank(bugid, progress):
+            if bugid in ('1', '5'):
+                both.wait()
+            return []
+
+        schedule = WorkflowCrankSchedule(self.buglist, self.masters, lambda bugid: self.masters[bugid])
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            schedule.run(pool, crank, lambda scanned, total: '')
+        self.assertFalse(both.broken)
+
+    def test_rescan(self):
+        rescan = self.run_schedule(4)
+        self.assertEqual(sorted(rescan), ['rescan-3', 'rescan-6'])
+        self.assertEqual(sorted(self.progress), sorted('{}/7'.format(nr) for nr in range(1, 8)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+import json
+import os
+import sys
+from testfixtures       import TempDirectory
+from types              import SimpleNamespace
+import unittest
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(sys.argv[0]), '..')))
+
+from lazr.restfulclient.errors  import HTTPError
+from lazr.restfulclient.resource import Entry
+
+from wfl.launchpad_cache import LaunchpadCacheStore
+
+
+class FakeEntry(Entry):
+    '''
+    Just enough of an Entry to be persisted.
+    '''
+    def __init__(self, self_link, etag, name):
+        self.__dict__['_dirty_attributes'] = {}
+        self.__dict__['self_link'] = self_link
+        self.__dict__['_wadl_resource'] = SimpleNamespace(
+            representation={'self_link': self_link, 'http_etag': etag, 'name': name})
+
+
+class FakeBrowser:
+
+    NOT_MODIFIED = object()
+
+    def __init__(self):
+        self.documents = {}
+        self.gets = []
+
+    def get(self, url, headers=None):
+        self.gets.append((url, headers))
+        document = self.documents.get(url)
+        if document is None:
+            raise HTTPError(SimpleNamespace(status=404, items=lambda: []), b'gone')
+        if headers.get('If-None-Match') == document['http_etag']:
+            return self.NOT_MODIFIED
+        return json.dumps(document).encode('utf-8')
+
+
+class FakeLaunchpadCacheStore(LaunchpadCacheStore):
+
+    def _bind(self, record):
+        # Binding needs the WADL, hand back the representation instead.
+        return record['representation']
+
+
+class TestLaunchpadCacheStore(unittest.TestCase):
+
+    def setUp(self):
+        self.d = TempDirectory()
+        self.browser = FakeBrowser()
+        self.root = SimpleNamespace(_root_uri='https://api.launchpad.net/devel/', _browser=self.browser)
+        self.fetched = []
+
+    def tearDown(self):
+        self.d.cleanup()
+
+    def store(self, **kwargs):
+        return FakeLaunchpadCacheStore(self.root, self.d.path, **kwargs)
+
+    def fetch(self, name, etag='"1"'):
+        def fetch():
+            self.fetched.append(name)
+            return FakeEntry('https://api.launchpad.net/devel/' + name, etag, name)
+        return fetch
+
+    def age(self, store, kind, key, seconds):
+        path = store._entry_path(kind, key)
+        record = store._read(path)
+        record['fetched'] -= seconds
+        store._write(path, record)
+
+    def test_hit(self):
+        store = self.store()
+        self.assertEqual(store.lookup('archive', ['a'], self.fetch('a')).self_link, 'https://api.launchpad.net/devel/a')
+        self.assertEqual(store.lookup('archive', ['a'], self.fetch('a'))['name'], 'a')
+
+        # A new store (as for the next run) shares the entries on disk.
+        store = self.store()
+        self.assertEqual(store.lookup('archive', ['a'], self.fetch('a'))['name'], 'a')
+        self.assertEqual(self.fetched, ['a'])
+        self.assertEqual((store.stats['archive'].hits, store.stats['archive'].misses), (1, 0))
+
+    def test_failed_lookup(self):
+        store = self.store()
+        self.assertIsNone(store.lookup('archive', ['a'], lambda: None))
+        self.assertEqual(os.listdir(self.d.path), [])
+
+    def test_revalidate(self):
+        store = self.store()
+        store.lookup('distro-series', ['ubuntu', 'focal'], self.fetch('focal'))
+        self.browser.documents['https://api.launchpad.net/devel/focal'] = {
+            'self_link': 'https://api.launchpad.net/devel/focal', 'http_etag': '"1"', 'name': 'focal'}
+
+        # Within the TTL we do not go back to Launchpad at all.
+        self.age(store, 'distro-series', ['ubuntu', 'focal'], 60)
+        store.lookup('distro-series', ['ubuntu', 'focal'], self.fetch('focal'))
+        self.assertEqual(self.browser.gets, [])
+
+        # Once expired the ETag is checked and the copy kept.
+        self.age(store, 'distro-series', ['ubuntu', 'focal'], 7200)
+        self.assertEqual(store.lookup('distro-series', ['ubuntu', 'focal'], self.fetch('focal'))['name'], 'focal')
+        self.assertEqual(self.browser.gets, [('https://api.launchpad.net/devel/focal', {'If-None-Match': '"1"'})])
+        self.assertEqual(store.stats['distro-series'].revalidated, 1)
+
+        # That restarts the TTL.
+        store.lookup('distro-series', ['ubuntu', 'focal'], self.fetch('focal'))
+        self.assertEqual(len(self.browser.gets), 1)
+
+        # A changed entry is refreshed from the response.
+        self.browser.documents['https://api.launchpad.net/devel/focal'] = {
+            'self_link': 'https://api.launchpad.net/devel/focal', 'http_etag': '"2"', 'name': 'focal-2'}
+        self.age(store, 'distro-series', ['ubuntu', 'focal'], 7200)
+        self.assertEqual(store.lookup('distro-series', ['ubuntu', 'focal'], self.fetch('focal'))['name'], 'focal-2')
+        self.assertEqual(store.stats['distro-series'].refreshed, 1)
+        self.assertEqual(self.fetched, ['focal'])
+
+    def test_revalidate_gone(self):
+        store = self.store()
+        store.lookup('archive', ['a'], self.fetch('a'))
+        self.age(store, 'archive', ['a'], 2 * 24 * 3600)
+
+        store.lookup('archive', ['a'], self.fetch('a'))
+        self.assertEqual(self.fetched, ['a', 'a'])
+
+    def test_evict(self):
+        store = self.store(max_entries=10)
+        for nr in range(10):
+            store.lookup('archive', [nr], self.fetch(str(nr)))
+            path = store._entry_path('archive', [nr])
+            os.utime(path, (1000 + nr, 1000 + nr))
+        # Using an entry makes it recent.
+        store.lookup('archive', [0], self.fetch('0'))
+        self.assertEqual(len(os.listdir(self.d.path)), 10)
+
+        # Going over the limit evicts the least recently used back down to
+        # evict_ratio of it.
+        store.lookup('archive', [10], self.fetch('10'))
+        self.assertEqual(len(os.listdir(self.d.path)), 9)
+        self.assertEqual(store.evicted, 2)
+        for nr in (1, 2):
+            self.assertFalse(os.path.exists(store._entry_path('archive', [nr])))
+        for nr in (0, 3, 10):
+            self.assertTrue(os.path.exists(store._entry_path('archive', [nr])))
+
+    def test_evict_scans(self):
+        # The directory is only scanned once we may be over the limit.
+        store = self.store(max_entries=10)
+        scans = []
+        evict = store.evict
+
+        def counted():
+            scans.append(store.entries)
+            evict()
+        store.evict = counted
+
+        for nr in range(10):
+            store.lookup('archive', [nr], self.fetch(str(nr)))
+        self.assertEqual(scans, [None])
+        store.lookup('archive', [10], self.fetch('10'))
+        self.assertEqual(scans, [None, 11])
+        self.assertEqual(store.entries, 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
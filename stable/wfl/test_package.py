@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+import os
+import sys
+from types              import SimpleNamespace
+import unittest
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(sys.argv[0]), '..')))
+
+from wfl.package        import PackageBuildPrefetch
+
+
+class FakeArchive:
+    '''
+    An archive holding source publications, counting the queries made
+    against it.
+    '''
+    def __init__(self, reference, pubs):
+        self.reference = reference
+        self.pubs = pubs
+        self.queries = []
+
+    def getPublishedSources(self, distro_series=None, exact_match=False, source_name=None, order_by_date=False, pocket=None):
+        self.queries.append((source_name, pocket))
+        return [pub for pub in self.pubs
+                if pub.source_package_name == source_name and (pocket is None or pub.pocket == pocket)]
+
+
+def pub(source, version, pocket):
+    return SimpleNamespace(source_package_name=source, source_package_version=version, pocket=pocket)
+
+
+class TestPackageBuildPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.primary = FakeArchive('ubuntu', [
+            pub('linux', '5.4.0-2.2', 'Proposed'),
+            pub('linux', '5.4.0-1.1', 'Updates'),
+            pub('linux', '5.4.0-1.1', 'Proposed'),
+            pub('linux-meta', '5.4.0.2.2', 'Proposed'),
+            pub('linux-meta', '5.4.0.1.1', 'Security'),
+        ])
+        self.ppa = FakeArchive('~canonical-kernel-team/ubuntu/ppa', [
+            pub('linux', '5.4.0-2.2', 'Release'),
+        ])
+
+    def test_prefetch(self):
+        prefetch = PackageBuildPrefetch('focal')
+        for source in ('linux', 'linux-meta'):
+            for pocket in ('Proposed', 'Updates', 'Security', 'Release'):
+                prefetch.want(self.primary, source, pocket)
+        prefetch.want(self.ppa, 'linux', 'Release')
+        prefetch.prefetch()
+
+        # One query per (archive, source) rather than per pocket.
+        self.assertEqual(sorted(self.primary.queries), [('linux', None), ('linux-meta', None)])
+        self.assertEqual(self.ppa.queries, [('linux', None)])
+
+        versions = [p.source_package_version for p in prefetch.published_sources(self.primary, 'linux', 'Proposed')]
+        self.assertEqual(versions, ['5.4.0-2.2', '5.4.0-1.1'])
+        self.assertEqual(len(prefetch.published_sources(self.primary, 'linux-meta', 'Security')), 1)
+        self.assertEqual(prefetch.published_sources(self.primary, 'linux', 'Release'), [])
+        self.assertEqual(len(prefetch.published_sources(self.ppa, 'linux', 'Release')), 1)
+        self.assertEqual(len(self.primary.queries) + len(self.ppa.queries), 3)
+
+    def test_lazy(self):
+        # Lookups not asked for up front are made, once, when needed.
+        prefetch = PackageBuildPrefetch('focal')
+        self.assertEqual(len(prefetch.published_sources(self.primary, 'linux', 'Updates')), 1)
+        self.assertEqual(len(prefetch.published_sources(self.primary, 'linux', 'Proposed')), 2)
+        self.assertEqual(self.primary.queries, [('linux', None)])
+
+        prefetch.want(self.primary, 'linux', 'Security')
+        prefetch.prefetch()
+        self.assertEqual(self.primary.queries, [('linux', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+from datetime           import datetime
+import json
+import os
+import sys
+from testfixtures       import TempDirectory
+import unittest
+import yaml
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(sys.argv[0]), '..')))
+
+from status_store       import WorkflowStatusStore, WorkflowStatusIndex
+
+
+class TestWorkflowStatusIndex(unittest.TestCase):
+
+    status = {
+        '1': {'series': 'focal', 'source': 'linux', 'target': 'linux', 'phase': 'Testing'},
+        '2': {'series': 'focal', 'source': 'linux-meta', 'target': 'linux', 'master-bug': 1},
+        '3': {'series': 'focal', 'source': 'linux-aws', 'target': 'linux-aws', 'master-bug': 1},
+        '4': {'series': 'focal', 'source': 'linux-aws-5.4', 'target': 'linux-aws-5.4', 'master-bug': 3},
+        '5': {'series': 'focal', 'source': 'linux', 'target': 'linux', 'phase': 'Complete'},
+        '6': {'series': 'focal', 'source': 'linux-gcp', 'target': 'linux-gcp', 'master-bug': 99},
+    }
+
+    def test_children(self):
+        index = WorkflowStatusIndex(self.status)
+
+        self.assertEqual(index.children('1'), ['2', '3'])
+        self.assertEqual(index.children(3), ['4'])
+        self.assertEqual(index.children('4'), [])
+
+    def test_trackers_for_target(self):
+        index = WorkflowStatusIndex(self.status)
+
+        self.assertEqual(index.trackers_for_target('focal', 'linux', 'linux'), ['1', '5'])
+        self.assertEqual(index.trackers_for_target('jammy', 'linux', 'linux'), [])
+
+    def test_phase(self):
+        index = WorkflowStatusIndex(self.status)
+
+        self.assertEqual(index.phase('Complete'), {'5'})
+
+    def test_depth(self):
+        index = WorkflowStatusIndex(self.status)
+
+        self.assertEqual(index.depth('1'), 1)
+        self.assertEqual(index.depth('2'), 2)
+        self.assertEqual(index.depth('4'), 3)
+        self.assertEqual(index.depth('6'), 2)
+
+    def test_ancestors(self):
+        index = WorkflowStatusIndex(self.status)
+
+        self.assertEqual(index.ancestors('4'), ['3', '1'])
+        self.assertEqual(index.ancestors('6'), ['99'])
+        self.assertEqual(index.ancestors('1'), [])
+
+    def test_update(self):
+        status = dict(self.status)
+        index = WorkflowStatusIndex(status)
+
+        index.add('4', {'series': 'focal', 'source': 'linux', 'target': 'linux', 'master-bug': 1})
+        self.assertEqual(index.children('1'), ['2', '3', '4'])
+        self.assertEqual(index.children('3'), [])
+        self.assertEqual(index.depth('4'), 2)
+
+        index.remove('1')
+        self.assertEqual(index.trackers_for_target('focal', 'linux', 'linux'), ['4', '5'])
+        self.assertEqual(index.depth('4'), 2)
+
+
+class TestWorkflowStatusStore(unittest.TestCase):
+
+    def store(self, d, **kwargs):
+        return WorkflowStatusStore(d.getpath('status.json'), d.getpath('status.yaml'), **kwargs)
+
+    def test_load_empty(self):
+        with TempDirectory() as d:
+            store = self.store(d)
+
+            self.assertEqual(store.load(), {})
+
+    def test_load_snapshot(self):
+        with TempDirectory() as d:
+            d.write('status.json', b'{"trackers":{"1":{"series":"focal","manager":{"time-scanned":{"_isoformat":"2021-01-02T03:04:05.000006"}}}}}')
+            store = self.store(d)
+
+            status = store.load()
+            self.assertEqual(status['1']['series'], 'focal')
+            self.assertEqual(status['1']['manager']['time-scanned'], datetime(2021, 1, 2, 3, 4, 5, 6))
+
+    def test_update_journal_only(self):
+        with TempDirectory() as d:
+            d.write('status.json', b'{"trackers":{"1":{"series":"focal"}}}')
+            store = self.store(d)
+            store.load()
+
+            store.update('2', {'series': 'jammy'})
+
+            self.assertEqual(d.read('status.json'), b'{"trackers":{"1":{"series":"focal"}}}')
+            self.assertEqual(sorted(store.load().keys()), ['1', '2'])
+            self.assertFalse(os.path.exists(d.getpath('status.yaml')))
+
+    def test_update_seen_by_other(self):
+        with TempDirectory() as d:
+            store_a = self.store(d)
+            store_b = self.store(d)
+            store_a.load()
+            store_b.load()
+
+            when = datetime(2021, 1, 2, 3, 4, 5)
+            store_a.update('1', {'series': 'focal', 'manager': {'time-modified': when}})
+            store_a.update('2', {'series': 'jammy'})
+            store_a.update('1', None)
+
+            status = store_b.load()
+            self.assertEqual(status, {'2': {'series': 'jammy'}})
+
+            store_b.update('3', {'series': 'kinetic'})
+            self.assertEqual(sorted(store_a.load().keys()), ['2', '3'])
+            self.assertEqual(store_a.index.trackers_for_target('kinetic', 'unknown', 'unknown'), ['3'])
+
+    def test_update_incremental_replay(self):
+        with TempDirectory() as d:
+            store_a = self.store(d)
+            store_b = self.store(d)
+            store_a.load()
+
+            store_a.update('1', {'series': 'focal'})
+            self.assertEqual(sorted(store_b.load().keys()), ['1'])
+            offset = store_b.journal_offset
+
+            store_a.update('2', {'series': 'jammy'})
+            self.assertEqual(sorted(store_b.load().keys()), ['1', '2'])
+            self.assertGreater(store_b.journal_offset, offset)
+
+    def test_torn_record(self):
+        with TempDirectory() as d:
+            d.write('status.json.journal', b'{"tracker":"1","status":{"series":"focal"}}\n{"tracker":"2","sta')
+            store = self.store(d)
+
+            self.assertEqual(sorted(store.load().keys()), ['1'])
+
+            store.update('3', {'series': 'jammy'})
+
+            store_b = self.store(d)
+            self.assertEqual(sorted(store_b.load().keys()), ['1', '3'])
+
+    def test_compact(self):
+        with TempDirectory() as d:
+            store_a = self.store(d)
+            store_b = self.store(d)
+            store_a.load()
+            store_a.update('1', {'series': 'focal'})
+            store_b.load()
+
+            store_a.compact()
+
+            data = json.loads(d.read('status.json').decode('utf-8'))
+            self.assertEqual(data, {'trackers': {'1': {'series': 'focal'}}})
+            self.assertEqual(d.read('status.json.journal'), b'')
+
+            store_a.update('2', {'series': 'jammy'})
+            self.assertEqual(sorted(store_b.load().keys()), ['1', '2'])
+
+    def test_compact_threshold(self):
+        with TempDirectory() as d:
+            store = self.store(d, compact_records=2)
+            store.load()
+
+            store.update('1', {'series': 'focal'})
+            self.assertFalse(os.path.exists(d.getpath('status.json')))
+            store.update('2', {'series': 'jammy'})
+            store.wait()
+
+            data = json.loads(d.read('status.json').decode('utf-8'))
+            self.assertEqual(sorted(data['trackers'].keys()), ['1', '2'])
+            self.assertEqual(store.journal_records, 0)
+
+    def test_save_yaml(self):
+        with TempDirectory() as d:
+            store = self.store(d)
+            store.load()
+            store.update('1', {'series': 'focal'})
+
+            store.save_yaml()
+
+            data = yaml.safe_load(d.read('status.yaml').decode('utf-8'))
+            self.assertEqual(data, {'trackers': {'1': {'series': 'focal'}}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+
+from copy               import deepcopy
+from datetime           import datetime, timezone
+import os
+import sys
+from testfixtures       import TempDirectory
+import unittest
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(sys.argv[0]), '..')))
+
+from wfl.bug            import WorkflowBug
+from wfl.swm_properties import (
+                            SwmPropertiesCache,
+                            swm_properties_block,
+                            swm_properties_equal,
+                            swm_properties_parse,
+                            )
+
+
+HEADER = '''This bug will contain status and test results related to a kernel source (or snap) as stated in the title.
+
+For an explanation of the tasks and the associated workflow see:
+  https://wiki.ubuntu.com/Kernel/kernel-sru-workflow
+'''
+
+PROPS_DEBS = {
+    'built': {'lrm': '5.15.0-1019.23', 'main': '5.15.0-1019.23', 'meta': '5.15.0.1019.18', 'signed': '5.15.0-1019.23'},
+    'delta': {'promote-to-proposed': ['lrm', 'main', 'meta', 'signed']},
+    'flag': {'boot-testing-requested': True, 'proposed-announcement-sent': True},
+    'issue': 'KSRU-1234',
+    'kernel-stable-master-bug': '1986789',
+    'packages': {
+        'lrm': 'linux-restricted-modules-aws',
+        'main': 'linux-aws',
+        'meta': 'linux-meta-aws',
+        'signed': 'linux-signed-aws',
+    },
+    'phase': 'Testing',
+    'phase-changed': datetime(2022, 8, 17, 10, 2, 11, 102912, tzinfo=timezone.utc),
+    'reason': {
+        'automated-testing': 'Stalled -- testing FAILED',
+        'certification-testing': 'Ongoing -- testing in progress',
+        'promote-to-updates': 'Pending -- waiting on master bug for the release to complete; the master bug must itself reach Fix Released before this tracker may be promoted to -updates in any pocket',
+        'security-signoff': 'Pending -- waiting for signoff',
+    },
+    'synthetic': {':promote-to-as-proposed': 'Fix Released'},
+    'variant': 'debs',
+    'versions': {
+        'lrm': '5.15.0-1019.23',
+        'main': '5.15.0-1019.23',
+        'meta': '5.15.0.1019.18',
+        'signed': '5.15.0-1019.23',
+        'source': '5.15.0-1019.23',
+    },
+}
+
+PROPS_SNAP = {
+    'kernel-stable-master-bug': '1986790',
+    'phase': 'Ready for Testing',
+    'reason': {},
+    'snap-name': 'pc-kernel',
+    'variant': 'snap-debs',
+    'versions': {'source': '5.15.0-48.54'},
+}
+
+
+def render(props):
+    return WorkflowBug.properties_for_description(None, props)
+
+
+def description(props, header=HEADER):
+    return header + '-- swm properties --\n' + render(props)
+
+
+# Real trackers hold a mix of descriptions we wrote and ones which have been
+# edited by hand in the web interface.
+CORPUS = [
+    description(PROPS_DEBS),
+    description(PROPS_SNAP),
+    description({'variant': 'combo', 'reason': {'prepare-package': 'Pending -- package not yet uploaded'}}, header=''),
+    HEADER + '-- swm properties --\n{variant: debs, phase: Packaging, reason: {}}\n',
+    HEADER + '-- swm properties --\nvariant: debs\nversions:\n\xa0 main: 5.4.0-125.141\n\xa0 source: 5.4.0-125.141\n',
+    HEADER + '-- swm properties --\nvariant: debs\nphase: Complete\n\n\n',
+    HEADER + '-- swm properties --\n',
+]
+
+
+class FakeLpBug:
+    def __init__(self, description):
+        self.description = description
+
+
+class TestSwmProperties(unittest.TestCase):
+
+    def test_parse(self):
+        (props, error) = swm_properties_parse(CORPUS[0])
+        self.assertIsNone(error)
+        self.assertEqual(props, PROPS_DEBS)
+
+        (props, error) = swm_properties_parse(CORPUS[4])
+        self.assertEqual(props['versions']['main'], '5.4.0-125.141')
+
+        (props, error) = swm_properties_parse(HEADER)
+        self.assertEqual((props, error), ({}, None))
+
+        (props, error) = swm_properties_parse(HEADER + '-- swm properties --\nvariant: [debs\n')
+        self.assertEqual(props, {})
+        self.assertIsNotNone(error)
+
+    def test_block(self):
+        self.assertEqual(swm_properties_block(CORPUS[0]), render(PROPS_DEBS))
+        self.assertIsNone(swm_properties_block(HEADER))
+
+    def test_equal(self):
+        self.assertTrue(swm_properties_equal(PROPS_DEBS, deepcopy(PROPS_DEBS)))
+        self.assertFalse(swm_properties_equal({'a': True}, {'a': 1}))
+        self.assertFalse(swm_properties_equal({'a': [1, 2]}, {'a': [1, 2, 3]}))
+        self.assertFalse(swm_properties_equal({'a': 1}, {'b': 1}))
+
+    def test_round_trip(self):
+        for props in (PROPS_DEBS, PROPS_SNAP):
+            text = render(props)
+            (parsed, error) = swm_properties_parse('-- swm properties --\n' + text)
+            self.assertTrue(swm_properties_equal(parsed, props))
+            self.assertEqual(render(parsed), text)
+
+    def test_lookup_cached(self):
+        cache = SwmPropertiesCache()
+
+        entry = cache.lookup(CORPUS[0])
+        self.assertIs(cache.lookup(CORPUS[0]), entry)
+        self.assertIsNot(cache.lookup(CORPUS[1]), entry)
+        self.assertIsNone(entry['rendered'])
+
+    def test_canonical_persisted(self):
+        with TempDirectory() as d:
+            cache_a = SwmPropertiesCache(path=d.getpath('swm/canonical'))
+            cache_a.canonical_add(CORPUS[0])
+
+            cache_b = SwmPropertiesCache(path=d.getpath('swm/canonical'))
+            self.assertEqual(cache_b.lookup(CORPUS[0])['rendered'], render(PROPS_DEBS))
+            self.assertIsNone(cache_b.lookup(CORPUS[1])['rendered'])
+
+    def test_canonical_trimmed(self):
+        with TempDirectory() as d:
+            d.write('canonical', ''.join('{:040x}\n'.format(nr) for nr in range(10)).encode('utf-8'))
+            cache = SwmPropertiesCache(path=d.getpath('canonical'))
+            cache.max_canonical = 8
+
+            self.assertFalse(cache.canonical('{:040x}'.format(0)))
+            self.assertTrue(cache.canonical('{:040x}'.format(9)))
+            self.assertEqual(len(d.read('canonical').split()), 4)
+
+
+class TestWorkflowBugProperties(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = WorkflowBug.properties_cache
+        self.d = TempDirectory()
+
+    def tearDown(self):
+        WorkflowBug.properties_cache = self.cache
+        self.d.cleanup()
+
+    def bug(self, description):
+        bug = WorkflowBug.__new__(WorkflowBug)
+        bug.lpbug = FakeLpBug(description)
+        bug.error = None
+        bug.reasons = {}
+        bug.tracker_modified = False
+        bug.bprops = bug.load_bug_properties()
+        return bug
+
+    def expected(self, description, modify=None):
+        # The original behaviour: always parse, render and compare.
+        (props, error) = swm_properties_parse(description)
+        if modify is not None:
+            modify(props)
+        if len(props) == 0:
+            return description
+        props.setdefault('reason', {})
+        newd = ''
+        for l in description.split('\n'):
+            if l.startswith('-- swm properties --'):
+                break
+            newd += l + '\n'
+        return newd + '-- swm properties --\n' + render(props)
+
+    def save(self, description, modify=None):
+        bug = self.bug(description)
+        if modify is not None:
+            modify(bug.bprops)
+        bug.save_bug_properties()
+        return (bug.lpbug.description, bug.tracker_modified)
+
+    def modify(self, props):
+        props['phase'] = 'Complete'
+        props.setdefault('reason', {})['sru-review'] = 'Stalled -- review FAILED ' + 'x' * 100
+
+    def test_corpus_unchanged(self):
+        for cache in (SwmPropertiesCache(), SwmPropertiesCache(path=self.d.getpath('canonical'))):
+            WorkflowBug.properties_cache = cache
+            for desc in CORPUS:
+                expected = self.expected(desc)
+                self.assertEqual(self.save(desc), (expected, expected != desc))
+
+            # A second pass is served from the cache, and in the persistent
+            # case from a fresh process.
+            WorkflowBug.properties_cache = SwmPropertiesCache(path=cache.path)
+            for desc in CORPUS:
+                expected = self.expected(desc)
+                self.assertEqual(self.save(desc), (expected, expected != desc))
+
+    def test_corpus_modified(self):
+        WorkflowBug.properties_cache = SwmPropertiesCache(path=self.d.getpath('canonical'))
+        for desc in CORPUS:
+            expected = self.expected(desc, self.modify)
+            self.assertEqual(self.save(desc, self.modify), (expected, True))
+
+            # What we wrote is itself stable.
+            self.assertEqual(self.save(expected), (expected, False))
+
+    def test_type_change_renders(self):
+        WorkflowBug.properties_cache = SwmPropertiesCache()
+        desc = CORPUS[0]
+        self.save(desc)
+
+        def modify(props):
+            props['flag']['boot-testing-requested'] = 1
+        expected = self.expected(desc, modify)
+        self.assertNotEqual(expected, desc)
+        self.assertEqual(self.save(desc, modify), (expected, True))
+
+    def test_load_does_not_share(self):
+        WorkflowBug.properties_cache = SwmPropertiesCache()
+        bug = self.bug(CORPUS[0])
+        bug.bprops['phase'] = 'Complete'
+
+        self.assertEqual(self.bug(CORPUS[0]).bprops['phase'], 'Testing')
+
+    def test_corrupt(self):
+        WorkflowBug.properties_cache = SwmPropertiesCache()
+        bug = self.bug(HEADER + '-- swm properties --\nvariant: [debs\n')
+
+        self.assertEqual(bug.bprops, {})
+        self.assertIsNotNone(bug.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(sys.argv[0]), '..')))
+
+from lazr.restfulclient.errors  import PreconditionFailed
+
+from wfl.task           import WorkflowBugTask, WorkflowBugTaskSnapshot
+
+
+class FakeEntry:
+    '''
+    Minimal launchpadlib bug task entry, counting the saves made against it.
+    '''
+    def __init__(self, bug_target_name, status='New', assignee_link=None):
+        self.bug_target_name = bug_target_name
+        self.status = status
+        self.importance = 'Medium'
+        self.assignee_link = assignee_link
+        self.saves = []
+        self.fail = 0
+
+    def lp_save(self):
+        if self.fail > 0:
+            self.fail -= 1
+            raise PreconditionFailed(None, b'')
+        self.saves.append(self.status)
+
+
+class FakePerson:
+    def __init__(self, username):
+        self.self_link = 'https://api.launchpad.net/devel/~' + username
+
+
+class FakeBug:
+    def __init__(self, entries):
+        self.bug_tasks_collection = entries
+
+
+class TestWorkflowBugTaskSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        # WorkflowBug normally passes these along.
+        WorkflowBugTask.dryrun = False
+        WorkflowBugTask.no_assignments = False
+
+    def snapshot(self):
+        self.entries = [
+            FakeEntry('kernel-sru-workflow', 'In Progress', 'https://api.launchpad.net/devel/~canonical-kernel-team'),
+            FakeEntry('kernel-sru-workflow/prepare-package', 'Confirmed'),
+        ]
+        return WorkflowBugTaskSnapshot(FakeBug(self.entries))
+
+    def test_reads(self):
+        snapshot = self.snapshot()
+
+        self.assertEqual([t.bug_target_name for t in snapshot],
+            ['kernel-sru-workflow', 'kernel-sru-workflow/prepare-package'])
+        self.assertEqual(snapshot.tasks[0].assignee.username, 'canonical-kernel-team')
+        self.assertIsNone(snapshot.tasks[1].assignee)
+        self.assertEqual(snapshot.tasks[1].status, 'Confirmed')
+        self.assertEqual(snapshot.tasks[1].importance, 'Medium')
+
+    def test_writes_deferred(self):
+        snapshot = self.snapshot()
+        task = WorkflowBugTask(snapshot.tasks[1], 'prepare-package', None, None)
+
+        task.status = 'Fix Committed'
+        task.assignee = FakePerson('apw')
+        self.assertEqual(task.status, 'Fix Committed')
+        self.assertEqual(task.assignee.username, 'apw')
+        self.assertEqual(self.entries[1].saves, [])
+
+        snapshot.save()
+        self.assertEqual(self.entries[1].saves, ['Fix Committed'])
+        self.assertEqual(self.entries[0].saves, [])
+        snapshot.save()
+        self.assertEqual(self.entries[1].saves, ['Fix Committed'])
+
+    def test_incomplete_bounce(self):
+        snapshot = self.snapshot()
+        snapshot.tasks[1].status = 'Incomplete'
+        snapshot.save()
+
+        snapshot.tasks[1].status = 'Incomplete'
+        self.assertEqual(self.entries[1].saves, ['Incomplete', 'New'])
+        snapshot.save()
+        self.assertEqual(self.entries[1].saves, ['Incomplete', 'New', 'Incomplete'])
+
+    def test_save_precondition_failed(self):
+        snapshot = self.snapshot()
+        snapshot.tasks[0].status = 'Fix Released'
+        snapshot.tasks[1].status = 'Fix Released'
+        self.entries[1].fail = 1
+
+        with self.assertRaises(PreconditionFailed):
+            snapshot.save()
+        self.assertEqual(self.entries[0].saves, ['Fix Released'])
+        self.assertEqual(snapshot.modified, [snapshot.tasks[1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(sys.argv[0]), '..')))
+
+from wfl.webhook_events import WebhookEventIndex, lp_object_path
+
+
+class TestLpObjectPath(unittest.TestCase):
+
+    def test_paths(self):
+        self.assertEqual(lp_object_path('https://api.launchpad.net/devel/~a/+archive/ubuntu/b/+build/1'), '/~a/+archive/ubuntu/b/+build/1')
+        self.assertEqual(lp_object_path('https://api.launchpad.net/1.0/bugs/123'), '/bugs/123')
+        self.assertEqual(lp_object_path('/~a/+snap/b/+build/2'), '/~a/+snap/b/+build/2')
+        self.assertEqual(lp_object_path('/devel/bugs/123/'), '/bugs/123')
+        self.assertIsNone(lp_object_path('Successfully built'))
+        self.assertIsNone(lp_object_path(None))
+        self.assertIsNone(lp_object_path(12))
+
+
+class TestWebhookEventIndex(unittest.TestCase):
+
+    trackers = {
+        '100': {
+            'monitor': [
+                {'type': 'launchpad-build', 'lp-api': 'https://api.launchpad.net/devel/~canonical-kernel-team/+archive/ubuntu/ppa/+build/11'},
+                {'type': 'launchpad-upload', 'lp-api': 'https://api.launchpad.net/devel/ubuntu/jammy/+upload/12'},
+            ],
+        },
+        '101': {
+            'monitor': [
+                {'type': 'launchpad-build', 'lp-api': 'https://api.launchpad.net/devel/~canonical-kernel-team/+archive/ubuntu/ppa/+build/11'},
+                {'type': 'tracker-modified', 'watch': '100'},
+            ],
+        },
+        '102': {},
+        '103': None,
+    }
+
+    def test_monitor_links(self):
+        index = WebhookEventIndex(self.trackers)
+
+        payload = {'build': '/~canonical-kernel-team/+archive/ubuntu/ppa/+build/11', 'status': 'Successfully built'}
+        self.assertEqual(index.trackers_for(payload), {'100', '101'})
+        payload = {'object': {'self_link': 'https://api.launchpad.net/devel/ubuntu/jammy/+upload/12'}}
+        self.assertEqual(index.trackers_for(payload), {'100'})
+        self.assertEqual(index.trackers_for({'build': '/~x/+snap/y/+build/13'}), set())
+
+    def test_bug(self):
+        index = WebhookEventIndex(self.trackers)
+
+        self.assertEqual(index.trackers_for({'bug': '/bugs/102', 'target': '/ubuntu'}), {'102'})
+        self.assertEqual(index.trackers_for({'bug': '/bugs/200', 'target': '/kernel-sru-workflow'}), {'200'})
+        self.assertEqual(index.trackers_for({'bug': '/bugs/200', 'target': '/kernel-sru-workflow/promote-to-proposed'}), {'200'})
+        self.assertEqual(index.trackers_for({'bug': '/bugs/200', 'target': '/ubuntu'}), set())
+        self.assertEqual(index.trackers_for({'bug': '/bugs/200'}), set())
+
+    def test_junk(self):
+        index = WebhookEventIndex(self.trackers)
+
+        self.assertEqual(index.trackers_for(None), set())
+        self.assertEqual(index.trackers_for(['/bugs/102']), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#
+# webhook_events -- map Launchpad webhook deliveries onto swm trackers
+#
+from urllib.parse                       import urlsplit
+
+
+# Launchpad API links carry the web service version as their first path
+# element, webhook payloads carry bare object paths.
+_api_versions = ('beta', '1.0', 'devel')
+
+
+# lp_object_path
+#
+def lp_object_path(link):
+    '''
+    Reduce a Launchpad API link or webhook object path to the bare object
+    path, e.g. https://api.launchpad.net/devel/~a/+archive/ubuntu/b/+build/1
+    and /~a/+archive/ubuntu/b/+build/1 both become the latter.  Returns None
+    for anything which does not look like a Launchpad object.
+    '''
+    if not isinstance(link, str):
+        return None
+    if link.startswith('http://') or link.startswith('https://'):
+        link = urlsplit(link).path
+    if not link.startswith('/'):
+        return None
+    bits = link.split('/', 2)
+    if len(bits) > 2 and bits[1] in _api_versions:
+        link = '/' + bits[2]
+    return link.rstrip('/')
+
+
+# WebhookEventIndex
+#
+class WebhookEventIndex:
+    '''
+    Index over the tracker status from which to find the trackers a webhook
+    delivery affects.  Trackers are found by the Launchpad objects named in
+    their monitor records (via lp-api) and by their own bug.  Bug events
+    for trackers we do not yet know about are accepted when they target one
+    of the workflow projects, these are likely new trackers.
+    '''
+    projects = ('kernel-sru-workflow',)
+
+    # __init__
+    #
+    def __init__(s, trackers):
+        s.trackers = trackers
+        s.objects = {}
+        for bug_id, bug_data in trackers.items():
+            if not isinstance(bug_data, dict):
+                continue
+            for monitor in bug_data.get('monitor', []):
+                path = lp_object_path(monitor.get('lp-api'))
+                if path is not None:
+                    s.objects.setdefault(path, set()).add(bug_id)
+
+    def _links(s, payload):
+        # Every object path mentioned anywhere in the payload.
+        if isinstance(payload, dict):
+            for value in payload.values():
+                yield from s._links(value)
+        elif isinstance(payload, list):
+            for value in payload:
+                yield from s._links(value)
+        else:
+            path = lp_object_path(payload)
+            if path is not None:
+                yield path
+
+    # trackers_for
+    #
+    def trackers_for(s, payload):
+        '''
+        The set of tracker ids affected by this webhook payload.
+        '''
+        affected = set()
+        for path in s._links(payload):
+            affected |= s.objects.get(path, set())
+
+        bug = lp_object_path(payload.get('bug')) if isinstance(payload, dict) else None
+        if bug is not None and bug.startswith('/bugs/'):
+            bug_id = bug[len('/bugs/'):]
+            if bug_id in s.trackers:
+                affected.add(bug_id)
+            else:
+                project = (lp_object_path(payload.get('target')) or '').split('/')[1:2]
+                if len(project) > 0 and project[0] in s.projects:
+                    affected.add(bug_id)
+
+        return affected
+
+# vi:set ts=4 sw=4 expandtab:
@@ -1,13 +1,56 @@
 #!/usr/bin/python3
 
+import hashlib
+import hmac
+import os
 import sys
+from time import time
 
 from flask import Flask, request, Response
 
+# Add ../libs to the Python search path
+sys.path.append(os.path.realpath(os.path.join(os.path.dirname(__file__), os.pardir, 'libs')))
+
+from ktl.work_queue import WorkQueue
+
 app = Flask(__name__)
 
+# Deliveries are queued for swm-publishing-events to act on.
+queue = WorkQueue(os.environ.get('WEBHOOKS_QUEUE', os.path.expanduser('~/webhooks-queue')))
+
+# If the webhooks were registered with a secret Launchpad signs each delivery.
+secret = os.environ.get('WEBHOOKS_SECRET')
+
+
+def signature_valid(body, signature):
+    if secret is None:
+        return True
+    if signature is None or not signature.startswith('sha1='):
+        return False
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha1).hexdigest()
+    return hmac.compare_digest(expected, signature[len('sha1='):])
+
+
 @app.route('/webhooks', methods=['POST'])
 def respond():
-    print("APW", request.json);
+    received = time()
+    if not signature_valid(request.get_data(), request.headers.get('X-Hub-Signature')):
+        print("REJECTED delivery={} bad signature".format(request.headers.get('X-Launchpad-Delivery')))
+        sys.stdout.flush()
+        return Response(status=401)
+
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return Response(status=400)
+
+    # Only acknowledge the delivery once it is safely queued, Launchpad will
+    # retry anything we fail.
+    name = queue.put({
+        'received': received,
+        'event': request.headers.get('X-Launchpad-Event-Type'),
+        'delivery': request.headers.get('X-Launchpad-Delivery'),
+        'payload': payload,
+        })
+    print("QUEUED", name, request.headers.get('X-Launchpad-Event-Type'), payload)
     sys.stdout.flush()
     return Response(status=200)